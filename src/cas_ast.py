@@ -1,108 +1,513 @@
-import cas_settings
-from cas_rational import Rational
+from cas_rational import numerator, denominator
+from cas_numbers import to_float, is_exact_number
+from cas_settings import EngineContext, get_context
 
 def is_number(c):
   return "0" <= c <= "9"
 def is_letter(c):
   return "a" <= c <= "z" or "A" <= c <= "Z"
 
-# Micropython's float implementation unfortunately
-# doesn't fall back to the __float__ magic method.
-# This is a workaround for that.
-def to_float(obj):
+# Trees deeper than this are walked with an explicit stack instead of recursion.
+# Each level of recursion takes a few Python stack frames, and Micropython's stack
+# is small, so deep expressions (like repeated derivatives) would overflow it otherwise.
+MAX_RECURSION_DEPTH = 16
+
+# Yields the nodes under node (including itself) in pre-order, without recursion.
+# These are generators, so a search can stop without visiting the whole tree.
+def iter_preorder(node):
+  stack = [node]
+  while len(stack) > 0:
+    node = stack.pop()
+    yield node
+    if node.depth != 1:
+      stack.extend(reversed(node.children()))
+
+# Yields the nodes under node (including itself) in post-order, without recursion
+def iter_postorder(node):
+  stack = [node]
+  while len(stack) > 0:
+    node = stack.pop()
+    if type(node) == int:
+      # All of the children of the node under this marker have been yielded
+      yield stack.pop()
+    elif node.depth == 1:
+      yield node
+    else:
+      stack.append(node)
+      stack.append(0)
+      stack.extend(reversed(node.children()))
+
+# Whether two sequences of nodes hold the same node objects
+def same_nodes(a, b):
+  if len(a) != len(b):
+    return False
+  for i in range(len(a)):
+    if a[i] is not b[i]:
+      return False
+  return True
+
+# For sorting nodes into their canonical order, like factors.sort(key=sort_key)
+def sort_key(node):
+  return node.sort_key()
+
+# Whether a factor of a product is in its denominator, like x^-1 or (x+1)^-2
+def is_denominator(factor):
+  return isinstance(factor, ASTPower) and isinstance(factor.exponent, ASTNumber) and factor.exponent.number < 0 and not isinstance(factor.base, ASTNumber)
+
+# Whether a reduced sum or product might be simplified by writing it as one fraction; see cas_polynomial.py
+def has_fractions(node):
+  if isinstance(node, ASTProduct):
+    for factor in node.factors:
+      if is_denominator(factor):
+        return True
+    return False
+  # Sums are only normalized when at least two of their terms are fractions
+  fractions = 0
+  for term in node.terms:
+    if is_denominator(term) or (isinstance(term, ASTProduct) and has_fractions(term)):
+      fractions += 1
+      if fractions == 2:
+        return True
+  return False
+
+# Computes a result for every node under node in post-order, without recursion.
+# leaf(node) returns the result for a node without children, or one where is_leaf(node) is true.
+# combine(node, results) returns the result for any other node, given its children's results.
+def fold(node, leaf, combine, is_leaf=None):
+  results = []
+  stack = [node]
+  while len(stack) > 0:
+    node = stack.pop()
+    if type(node) == int:
+      # All of a node's children are done; it's under the number of children on the stack
+      start = len(results) - node
+      node = stack.pop()
+      children = results[start:]
+      del results[start:]
+      results.append(combine(node, children))
+    elif node.depth == 1 or (is_leaf != None and is_leaf(node)):
+      results.append(leaf(node))
+    else:
+      children = node.children()
+      stack.append(node)
+      stack.append(len(children))
+      stack.extend(reversed(children))
+  return results[0]
+
+# Like fold, but for reduce, since children are reduced with a different state than their parent
+def reduce_iteratively(node, state):
+  results = []
+  stack = [(node, state)]
+  while len(stack) > 0:
+    entry = stack.pop()
+    if type(entry) == int:
+      start = len(results) - entry
+      node, state = stack.pop()
+      children = results[start:]
+      del results[start:]
+      result = node.reduce_with(state, children)
+      state.remember(node, result)
+      results.append(result)
+      continue
+    node, state = entry
+    known = state.reduced_form(node)
+    if known != None:
+      results.append(known)
+    elif node.depth == 1:
+      results.append(node.reduce_with(state, ()))
+    else:
+      children = node.children()
+      child_state = state.after(node)
+      stack.append(entry)
+      stack.append(len(children))
+      for child in reversed(children):
+        stack.append((child, child_state))
+  return results[0]
+
+def eval_iteratively(node, context):
+  return fold(node, lambda node: node.eval(context), lambda node, values: node.eval_with(values, context))
+
+def str_iteratively(node):
+  return fold(node, str, lambda node, strings: node.str_with(strings))
+
+# Evaluates node exactly with values; see ASTNode.exact_eval. Returns a number, or a node
+# for the parts that couldn't be evaluated exactly.
+def exact_eval_raw(node, values, context):
+  return fold(
+    node,
+    lambda node: node.exact_eval_with(values, context, ()),
+    lambda node, results: node.exact_eval_with(values, context, results)
+  )
+
+# Turns a result of exact_eval_with back into a node
+def result_node(result):
+  return result if isinstance(result, ASTNode) else ASTNumber(result)
+
+# Returns base^exponent for two numbers, approximated with a float if the exact result would
+# be too big to work with, or None if it can't be represented
+def power_of_numbers(base, exponent, context):
+  if not context.power_too_big(base, exponent):
+    result = context.backend.power(base, exponent)
+    # When the backend is exact and the result can't be represented exactly
+    if result == None:
+      return None
+    if not context.too_big(result):
+      return result
+  # The exact result is too big to work with, so approximate it if a float can hold it
   try:
-    return float(obj)
-  except:
-    return obj.__float__()
+    approximation = to_float(base) ** to_float(exponent)
+  except OverflowError:
+    approximation = 0.0
+  if approximation == 0.0:
+    return None
+  return approximation
+
+# Tokens for separators that depend on what's written around them; see PrettyWriter
+# A + that's left out before a term starting with -
+SUM_SEPARATOR = 0
+# A * that's left out after a ), and before anything but a letter or digit or after a digit (so 2*x is written 2x)
+PRODUCT_SEPARATOR = 1
+# The * between two factors that aren't numbers. Unlike PRODUCT_SEPARATOR it's kept
+# after a digit, so x^2*y isn't written x^2y.
+FACTOR_SEPARATOR = 2
+
+# Writes the pretty form of expressions, either into a list that's joined once at
+# the end, or straight to a file. Nodes describe themselves as a list of tokens
+# (see ASTNode.pretty_tokens), which are expanded with an explicit stack, so this takes
+# linear time and doesn't recurse however deep the expression is.
+class PrettyWriter:
+  # out is anything with a write method, like a file; strings are kept in a list otherwise
+  def __init__(self, out=None):
+    self.out = out
+    self.parts = []
+    # The last character written, for deciding on separators
+    self.last = ""
+    # A separator that depends on the next character written
+    self.pending = None
+  
+  def write(self, node, precidence=100):
+    # This is the inner loop of printing, so it keeps everything in locals
+    emit = self.parts.append if self.out == None else self.out.write
+    last = self.last
+    pending = self.pending
+    stack = [(node, precidence)]
+    while len(stack) > 0:
+      token = stack.pop()
+      kind = type(token)
+      if kind == tuple:
+        node, precidence = token
+        tokens = node.pretty_tokens()
+        parenthesize = node.needs_parentheses(precidence)
+        if parenthesize:
+          stack.append(")")
+        if len(tokens) == 1:
+          stack.append(tokens[0])
+        else:
+          stack.extend(reversed(tokens))
+        if parenthesize:
+          stack.append("(")
+      elif kind == int:
+        if token != SUM_SEPARATOR and last == ")":
+          continue
+        pending = token
+      elif len(token) > 0:
+        if pending != None:
+          if pending == SUM_SEPARATOR:
+            if token[0] != "-":
+              emit("+")
+          elif is_number(token[0]) or (is_letter(token[0]) and (pending == FACTOR_SEPARATOR or not is_number(last))):
+            # Digits always need a *, since 2*3^(1/2) would be read as 23^(1/2)
+            emit("*")
+          pending = None
+        emit(token)
+        last = token[-1]
+    self.last = last
+    self.pending = pending
+  
+  def getvalue(self):
+    return "".join(self.parts)
 
 class SimplifyState:
-  def __init__(self, node=None, sort_terms=False, expand_logarithms=False):
+  # context is the EngineContext to use; see cas_settings.py
+  # expand: whether to multiply out products and powers of sums; see cas_expand.py
+  def __init__(self, node=None, sort_terms=False, expand_logarithms=False, context=None, reduced=None, expand=False):
     self.parent = node
     self.sort_terms = sort_terms
     self.expand_logarithms = expand_logarithms
+    self.expand = expand
+    self.context = get_context(context)
+    # The number backend, since it's needed so often
+    self.backend = self.context.backend
+    # Nodes that have been reduced during this simplification, by id, and what they reduced to.
+    # The simplifier reduces the same subtrees repeatedly, so this avoids doing it
+    # over and over (which takes exponential time in the depth of the tree).
+    # The original nodes are kept too, so their ids can't be reused.
+    self.reduced = {} if reduced == None else reduced
   def parent_is_term(self):
     return self.parent != None and self.parent.is_term()
   def after(self, node):
-    return SimplifyState(node, self.sort_terms, self.expand_logarithms)
+    return SimplifyState(node, self.sort_terms, self.expand_logarithms, self.context, self.reduced, self.expand)
+  def remember(self, node, result):
+    self.reduced[id(node)] = (node, result)
+    self.reduced[id(result)] = (result, result)
+  def reduced_form(self, node):
+    entry = self.reduced.get(id(node))
+    return None if entry == None else entry[1]
   def reduce(self, node):
     return node.reduce(self)
   def distribute(self, node):
     return node.distribute(self)
 
+# Nodes use __slots__ to save memory, which matters a lot on calculators.
+# Every subclass needs its own __slots__ (even if it's empty), or it gets a __dict__ anyway.
+# Nodes are immutable once created, so they can be shared between expressions.
+#
+# Trees deeper than MAX_RECURSION_DEPTH are walked with an explicit stack (see fold) instead
+# of recursively. Nodes with children implement children(), with_children(), and the *_with
+# versions of the walks the stack uses, which get the results for the node's children.
+# Most walks are implemented once here in terms of those; eval and __str__ are called so
+# often that nodes implement them directly too, and only check the depth first.
 class ASTNode:
+  __slots__ = ()
   precidence = 0
+  # The fields that make two nodes of the same type equal
+  fields = ()
+  # Where nodes of this type go in the canonical order; see sort_key
+  sort_rank = 9
+  # Variables a node uses that aren't under it, like the ones in a user-defined function's body
+  outer_variables = ()
+  # Nodes with children store these (and a cached hash_value and sort_value) instead.
+  # They're computed when a node is created, since both would otherwise need a walk over the whole tree.
+  depth = 1
+  constant = False
   def __init__(self):
     raise Exception("Implement me!")
   
   def __eq__(self, other):
-    if type(self) != type(other):
-      return False
-    for attr in self.__dict__:
-      if getattr(self, attr) != getattr(other, attr):
+    # Compares without recursion, so deep trees can be compared
+    stack = [(self, other)]
+    while len(stack) > 0:
+      a, b = stack.pop()
+      if a is b:
+        continue
+      if type(a) != type(b):
         return False
+      for attr in a.fields:
+        value_a = getattr(a, attr)
+        value_b = getattr(b, attr)
+        if isinstance(value_a, ASTNode):
+          stack.append((value_a, value_b))
+        elif isinstance(value_a, tuple):
+          if len(value_a) != len(value_b):
+            return False
+          stack.extend(zip(value_a, value_b))
+        elif value_a != value_b:
+          return False
     return True
   def __ne__(self, other):
     return not self.__eq__(other)
   def __hash__(self):
-    return hash(str(self))
+    if self.depth == 1:
+      # Equal leaves have equal fields, so their first field is enough
+      return hash(getattr(self, self.fields[0]))
+    # Nodes with children cache their hash when it's first needed
+    if self.hash_value == None:
+      if self.depth > MAX_RECURSION_DEPTH:
+        fold(self, hash, lambda node, hashes: node.hash_with(hashes), lambda node: node.hash_value != None)
+      else:
+        self.hash_with([hash(child) for child in self.children()])
+    return self.hash_value
+  def hash_with(self, hashes):
+    self.hash_value = hash(tuple([hash(type(self))] + hashes))
+    return self.hash_value
+  # Returns a key for sorting nodes into a canonical order: by sort_rank, then depth, then
+  # fields or children's keys (powers are the exception; see ASTPower.sort_key_with). Equal nodes have equal keys and different nodes have different
+  # ones, and unlike hashes, keys are the same every run, so sorted output is too.
+  def sort_key(self):
+    if self.depth == 1:
+      return (self.sort_rank,) + tuple([getattr(self, attr) for attr in self.fields])
+    # Like hashes, keys are cached, and children share their keys with their parents
+    if self.sort_value == None:
+      if self.depth > MAX_RECURSION_DEPTH:
+        fold(self, sort_key, lambda node, keys: node.sort_key_with(keys), lambda node: node.sort_value != None)
+      else:
+        self.sort_key_with([child.sort_key() for child in self.children()])
+    return self.sort_value
+  def sort_key_with(self, keys):
+    self.sort_value = (self.sort_rank, self.depth, tuple(keys))
+    return self.sort_value
+  
+  def children(self):
+    return ()
+  # Returns a node like this one, but with different children
+  def with_children(self, children):
+    return self
+  # Like with_children, but returns this node itself if none of the children changed.
+  # Transformations use this so they only allocate nodes along the paths they modify.
+  def rebuild(self, children):
+    if same_nodes(self.children(), children):
+      return self
+    return self.with_children(children)
 
+  # Don't override this; override pretty_tokens and needs_parentheses instead
   def pretty_str(self, precidence):
+    writer = PrettyWriter()
+    writer.write(self, precidence)
+    return writer.getvalue()
+  # Writes the same thing as pretty_str to out (like a file), without building the whole string
+  def write_pretty(self, out, precidence=100):
+    PrettyWriter(out).write(self, precidence)
+  # Returns this node's pretty form without any surrounding parentheses, as a list of
+  # strings, (child, precidence) pairs for children, and separators (see PrettyWriter)
+  def pretty_tokens(self):
     raise Exception("Implement me!")
+  # Whether this node needs parentheses inside something with the given precidence
+  def needs_parentheses(self, precidence):
+    return precidence < self.precidence
+  # Don't override this; override str_with instead
   def __str__(self):
     raise Exception("Implement me!")
+  def str_with(self, strings):
+    raise Exception("Implement me!")
   def __repr__(self):
     return self.__str__()
   
   def negate(self):
-    return ASTProduct(ASTNumber(-1), self)
+    return ASTProduct(NEG_ONE, self)
 
-  # Don't override this; override reduce and expand instead
-  def simplify(self, sort_terms=False, expand_logarithms=True):
-    state = SimplifyState(sort_terms=sort_terms, expand_logarithms=expand_logarithms)
+  # Don't override this; override reduce_with and distribute_with instead
+  def simplify(self, sort_terms=False, expand_logarithms=True, context=None, expand=False):
+    state = SimplifyState(sort_terms=sort_terms, expand_logarithms=expand_logarithms, context=context, expand=expand)
     return self.distribute(state).reduce(state)
+  # Simplifies, multiplying out products and integer powers of sums, like (x+1)(x-1) = x^2-1.
+  # Expansions that would create more than context.max_expansion_terms terms are skipped.
+  def expand(self, sort_terms=False, expand_logarithms=True, context=None):
+    return self.simplify(sort_terms=sort_terms, expand_logarithms=expand_logarithms, context=context, expand=True)
   def reduce(self, state):
+    if self.depth == 1:
+      return self.reduce_with(state, ())
+    known = state.reduced_form(self)
+    if known != None:
+      return known
+    if self.depth > MAX_RECURSION_DEPTH:
+      return reduce_iteratively(self, state)
+    child_state = state.after(self)
+    result = self.reduce_with(state, [child.reduce(child_state) for child in self.children()])
+    state.remember(self, result)
+    return result
+  # Reduces this node, given its reduced children
+  def reduce_with(self, state, children):
     return self
   def distribute(self, state):
-    # TODO: Implement in subclasses
-    return self
+    if self.depth == 1:
+      return self
+    if self.depth > MAX_RECURSION_DEPTH:
+      return fold(self, lambda node: node, lambda node, children: node.distribute_with(state, children))
+    return self.distribute_with(state, [child.distribute(state) for child in self.children()])
+  # Distributes this node, given its distributed children
+  def distribute_with(self, state, children):
+    return self.rebuild(children)
   
+  # Calls func on every node in post-order
   def traverse(self, func):
-    # Subclasses should call traverse on all children
+    if self.depth == 1:
+      func(self)
+      return
+    if self.depth > MAX_RECURSION_DEPTH:
+      for node in iter_postorder(self):
+        func(node)
+      return
+    for child in self.children():
+      child.traverse(func)
     func(self)
+  def iter_preorder(self):
+    return iter_preorder(self)
+  def iter_postorder(self):
+    return iter_postorder(self)
+  # Returns the first node in pre-order where predicate(node) is true, or None.
+  # This stops as soon as it finds one, unlike traverse.
+  def find_first(self, predicate):
+    for node in iter_preorder(self):
+      if predicate(node):
+        return node
+    return None
+  def contains_variable(self, name):
+    if self.constant:
+      return False
+    return self.find_first(lambda node: (isinstance(node, ASTVariable) and node.name == name) or name in node.outer_variables) != None
+  # Whether every number in the expression is exact. Simplifying can approximate
+  # huge coefficients with floats; see cas_settings.MAX_COEFFICIENT_BITS.
+  def is_exact(self):
+    return self.find_first(lambda node: isinstance(node, ASTNumber) and not is_exact_number(node.number)) == None
   def get_variables(self):
     variables = set()
-    self.traverse(lambda node: variables.add(node.name) if isinstance(node, ASTVariable) else None)
+    if self.constant:
+      return variables
+    for node in iter_preorder(self):
+      if isinstance(node, ASTVariable):
+        variables.add(node.name)
+      else:
+        variables.update(node.outer_variables)
     return variables
   
   def substitute(self, var, value):
-    return self
+    # Constant subtrees don't have any variables to substitute
+    if self.depth == 1 or self.constant:
+      return self
+    if self.depth > MAX_RECURSION_DEPTH:
+      return fold(
+        self,
+        lambda node: node.substitute(var, value),
+        lambda node, children: node.rebuild(children),
+        lambda node: node.constant
+      )
+    return self.rebuild([child.substitute(var, value) for child in self.children()])
   def substitute_with_numbers(self, values):
     node = self
     for var, value in values.items():
       node = node.substitute(var, ASTNumber(value))
     return node
 
-  def eval(self):
+  # context is the EngineContext to evaluate with; see cas_settings.py
+  def eval(self, context=None):
+    raise Exception("Implement me!")
+  # Evaluates this node, given the values of its children
+  def eval_with(self, values, context):
     raise Exception("Implement me!")
+  # Evaluates the expression in one pass with values, a dictionary from variable names to numbers,
+  # doing the arithmetic with the context's numbers so results are exact where they can be.
+  # Returns an ASTNumber if the whole expression could be evaluated exactly, and otherwise
+  # a node with the parts that couldn't be, like 2sin(2)+4.
+  # Don't override this; override exact_eval_with instead
+  def exact_eval(self, values=None, context=None):
+    context = get_context(context)
+    return result_node(exact_eval_raw(self, values if values != None else {}, context))
+  # Evaluates this node, given its children's results, which are numbers, or nodes for
+  # children that couldn't be evaluated exactly
+  def exact_eval_with(self, values, context, results):
+    return self.rebuild([result_node(result) for result in results])
   
-  def derivative(self, var):
+  # context is the EngineContext used for any numbers the derivative creates
+  # Don't override this; override derivative_with instead
+  def derivative(self, var, context=None):
+    if self.constant:
+      return ZERO
+    if self.depth > MAX_RECURSION_DEPTH:
+      return fold(
+        self,
+        lambda node: node.derivative(var, context),
+        lambda node, derivatives: node.derivative_with(var, context, derivatives),
+        lambda node: node.constant
+      )
+    return self.derivative_with(var, context, [child.derivative(var, context) for child in self.children()])
+  # Differentiates this node, given the derivatives of its children
+  def derivative_with(self, var, context, derivatives):
     raise Exception("Implement me!")
 
   # Helper functions
   def is_constant(self):
-    return False
+    return self.constant
   # TODO: There's definitely a more general way to implement this, but this works for now.
-  def is_2pi_multiple(self, quarter_pi_offset):
-    # Assumes the left of multiplication with pi is the number, which is currently always the case after simplification.
-    if (self.is_exactly(0) and quarter_pi_offset == 0) or (isinstance(self, ASTPi) and quarter_pi_offset == 4):
-      return True
-    offset = Rational(quarter_pi_offset, 4) if cas_settings.USE_RATIONALS else quarter_pi_offset / 4
-    # This is even more hacky than it was before with the assumption of only 2 factors long...
-    # TODO: Fix this because it breaks under so many possible circumstances
-    if isinstance(self, ASTProduct) and self.factors[0].is_number() and isinstance(self.factors[1], ASTPi):
-      offset_coefficient = (self.factors[0].number - offset) / 2
-      return offset_coefficient == int(offset_coefficient)
-    return False
   def is_number(self):
     return isinstance(self, ASTNumber)
   def is_integer(self):
@@ -111,71 +516,85 @@ class ASTNode:
     return isinstance(self, ASTNumber) and self.number == num
 
 class ASTConstant(ASTNode):
+  __slots__ = ("number",)
+  fields = ("number",)
+  constant = True
+  sort_rank = 1
   def __init__(self):
     if type(self) == ASTConstant:
       raise Exception("Cannot create an instance of ASTConstant. Use a subclass instead.")
     self.number = None
   
-  def derivative(self, var):
-    return ASTNumber(0)
-  
-  def eval(self):
+  def eval(self, context=None):
     return to_float(self.number)
 
-  def is_constant(self):
-    return True
-
 # TODO: Tests
 class ASTPi(ASTConstant):
+  __slots__ = ()
   def __init__(self):
     from math import pi
     self.number = pi
-  def pretty_str(self, precidence):
-    return "π"
+  def pretty_tokens(self):
+    return ("π",)
   def __str__(self):
     return "π"
 
 # TODO: Tests
 class ASTEuler(ASTConstant):
+  __slots__ = ()
   def __init__(self):
     from math import e
     self.number = e
-  def pretty_str(self, precidence):
-    return "e"
+  def pretty_tokens(self):
+    return ("e",)
   def __str__(self):
     return "e"
 
+# Constants are immutable, so we only need one of each
+PI = ASTPi()
+EULER = ASTEuler()
+
 builtin_variables = {
-  "E": ASTEuler(),
-  "pi": ASTPi(),
-  "π": ASTPi()
+  "E": EULER,
+  "pi": PI,
+  "π": PI
 }
 
 class ASTNumber(ASTConstant):
+  __slots__ = ()
+  sort_rank = 0
   def __init__(self, number):
-    if cas_settings.USE_RATIONALS and isinstance(number, int):
-      self.number = Rational(number)
+    # Integers are stored as plain ints, so whole fractions from any backend are converted back
+    if type(number) != int and type(number) != float and getattr(number, "denominator", None) == 1:
+      self.number = int(number.numerator)
     else:
       self.number = number
   
-  def pretty_str(self, precidence):
-    if isinstance(self.number, Rational):
-      return "(" + str(self.number) + ")"\
-        if (precidence <= 3 and self.number.denominator != 1)\
-        else str(self.number)
-    return str(int(self.number)) if int(self.number) == self.number else str(self.number)
+  def is_fraction(self):
+    return type(self.number) != float and getattr(self.number, "denominator", 1) != 1
+  def needs_parentheses(self, precidence):
+    return precidence <= 3 and self.is_fraction()
+  def pretty_tokens(self):
+    if self.is_fraction():
+      return (str(self.number),)
+    return (str(int(self.number)) if int(self.number) == self.number else str(self.number),)
   def __str__(self):
     return str(self.number)
   
   def negate(self):
     return ASTNumber(self.number * -1)
+  def exact_eval_with(self, values, context, results):
+    return self.number
 
 class ASTVariable(ASTNode):
+  __slots__ = ("name",)
+  fields = ("name",)
+  sort_rank = 2
   def __init__(self, name):
     self.name = name
   
-  def pretty_str(self, precidence):
-    return self.name
+  def pretty_tokens(self):
+    return (self.name,)
   def __str__(self):
     return "(" + self.name + ")"
   
@@ -183,21 +602,32 @@ class ASTVariable(ASTNode):
     if self.name == var:
       return value
     return self
-  def eval(self):
+  def eval(self, context=None):
     raise Exception("Cannot evaluate variable")
-  def derivative(self, var):
+  # Variables without values are left as they are
+  def exact_eval_with(self, values, context, results):
+    value = values.get(self.name)
+    if value == None:
+      return self
+    if isinstance(value, ASTNode) or not is_exact_number(value):
+      return value
+    return context.backend.convert(value)
+  def derivative_with(self, var, context, derivatives):
     if self.name == var:
-      return ASTNumber(1)
+      return ONE
     return ASTLebiniz(self.name, var, 1)
 
 class ASTLebiniz(ASTNode):
+  __slots__ = ("main", "relative_to", "degree")
+  fields = ("main", "relative_to", "degree")
   precidence = 6
+  sort_rank = 3
   def __init__(self, main, relative_to, degree):
     self.main = main
     self.relative_to = relative_to
     self.degree = degree
   
-  def pretty_str(self, precidence):
+  def pretty_tokens(self):
     string = "d"
     if self.degree != 1:
       string += "^" + str(self.degree) + " "
@@ -206,82 +636,105 @@ class ASTLebiniz(ASTNode):
     string += "d" + self.relative_to
     if self.degree != 1:
       string += "^" + str(self.degree)
-    if precidence < ASTLebiniz.precidence:
-      string = "(" + string + ")"
-    return string
+    return (string,)
   def __str__(self):
     if self.degree != 1:
       return "(d^" + self.degree + " " + self.main + " / d" + self.relative_to + "^" + self.degree + ")"
     return "(d" + self.main + "/d" + self.relative_to + ")"
   
-  def substitute(self, var, value):
-    return self
-  def eval(self):
+  def eval(self, context=None):
     raise Exception("Cannot evaluate rate of change")
-  def derivative(self, var):
+  def derivative_with(self, var, context, derivatives):
     if self.main == var:
       return ASTLebiniz(self.main, self.relative_to, self.degree+1)
     return ASTProduct(
       ASTLebiniz(self.main, var, 1),
       self
-    ).simplify()
+    ).simplify(context=context)
 
 # Invariant: no term in a sum is a sum
 class ASTSum(ASTNode):
+  __slots__ = ("terms", "depth", "constant", "hash_value", "sort_value")
+  fields = ("terms",)
   precidence = 4
+  sort_rank = 8
   # Can be constructed like ASTSum(term1, term2, ...) or ASTSum([term1, term2, ...])
+  # Terms are stored as a tuple.
   def __init__(self, *terms):
-    if len(terms) == 1 and isinstance(terms[0], list):
-      self.terms = terms[0]
-    else:
-      self.terms = list(terms)
+    if len(terms) == 1 and (isinstance(terms[0], list) or isinstance(terms[0], tuple)):
+      terms = terms[0]
     
     # Flatten sums; this enforces our no sum children invariant
-    i = 0
-    while i < len(self.terms):
-      if isinstance(self.terms[i], ASTSum):
-        self.terms = self.terms[:i] + self.terms[i].terms + self.terms[i+1:]
+    flattened = []
+    depth = 0
+    constant = True
+    for term in terms:
+      if isinstance(term, ASTSum):
+        flattened.extend(term.terms)
+        # The deepest of its terms
+        term_depth = term.depth - 1
       else:
-        i += 1
+        flattened.append(term)
+        term_depth = term.depth
+      if term_depth > depth:
+        depth = term_depth
+      constant = constant and term.constant
+    self.terms = tuple(flattened)
+    self.depth = depth + 1
+    self.constant = constant
+    self.hash_value = None
+    self.sort_value = None
   
   @staticmethod
   def subtract(left, right):
     return ASTSum(left, right.negate())
   
-  def pretty_str(self, precidence):
-    string = ""
-    for i, term in enumerate(self.terms):
-      # This is a bit hacky, but it works for now
-      term_str = term.pretty_str(ASTSum.precidence)
-      if term_str[0] == "-":
-        string = string[:-1]
-      string += term_str
-      if i < len(self.terms) - 1:
-        string += "+"
-    
-    if precidence < ASTSum.precidence:
-      string = "(" + string + ")"
-    return string
+  def children(self):
+    return self.terms
+  def with_children(self, children):
+    return ASTSum(children)
+  def distribute_with(self, state, children):
+    if state.expand:
+      from cas_expand import collect_terms
+      return collect_terms(children, state)
+    return self.rebuild(children)
+  
+  def pretty_tokens(self):
+    tokens = []
+    for term in self.terms:
+      # The + is left out before negative terms
+      if len(tokens) > 0:
+        tokens.append(SUM_SEPARATOR)
+      tokens.append((term, ASTSum.precidence))
+    return tokens
   def __str__(self):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return str_iteratively(self)
     return "(" + "+".join(map(str, self.terms)) + ")"
+  def str_with(self, strings):
+    return "(" + "+".join(strings) + ")"
 
-  def reduce(self, original_state):
+  def reduce_with(self, original_state, new_terms):
     state = original_state.after(self)
     
     # TODO: Combine with ExpressionReducer and refactor; this is a hack to get tests working for now
-    new_terms = [term.reduce(state) for term in self.terms]
+    new_terms = list(new_terms)
     
     # Merge constants
     constant = 0
+    numbers = []
     i = 0
     while i < len(new_terms):
       if new_terms[i].is_number():
         constant += new_terms[i].number
-        new_terms.pop(i)
+        numbers.append(new_terms.pop(i))
       else:
         i += 1
-    if constant != 0:
-      new_terms.append(ASTNumber(constant))
+    if len(numbers) == 1 and constant != 0 and not state.context.too_big(constant):
+      # Nothing to merge, so keep the original node
+      new_terms.append(numbers[0])
+    elif constant != 0:
+      new_terms.append(ASTNumber(state.context.limit(constant)))
     
     from cas_simplify_expr import ExpressionReducer
     reduced = ExpressionReducer(new_terms, state).reduce().to_ast()
@@ -289,53 +742,92 @@ class ASTSum(ASTNode):
     if not isinstance(reduced, ASTSum):
       return reduced.reduce(state)
     if len(reduced.terms) == 0:
-      return ASTNumber(0)
+      return ZERO
     if len(reduced.terms) == 1:
       return reduced.terms[0]
-    
+    if not state.expand and has_fractions(reduced):
+      # Adds fractions together, like 1/(x-1) - x/(x-1) = -1
+      from cas_polynomial import normalize_quotient
+      normalized = normalize_quotient(reduced, state)
+      if normalized != None:
+        return normalized
+    # Keep this node when reducing didn't change anything
+    if same_nodes(reduced.terms, self.terms):
+      return self
     return reduced
-  def distribute(self, state):
-    # TODO
-    return ASTSum([term.distribute(state) for term in self.terms])
-  
-  def traverse(self, func):
-    for term in self.terms:
-      term.traverse(func)
-    func(self)
 
-  def substitute(self, var, value):
-    return ASTSum([term.substitute(var, value) for term in self.terms])
-  def eval(self):
-    return sum(term.eval() for term in self.terms)
-  def derivative(self, var):
-    return ASTSum([term.derivative(var) for term in self.terms]).simplify()
-  
-  def is_constant(self):
-    return all(term.is_constant() for term in self.terms)
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
+    return sum(term.eval(context) for term in self.terms)
+  def eval_with(self, values, context):
+    return sum(values)
+  def exact_eval_with(self, values, context, results):
+    constant = 0
+    terms = []
+    for result in results:
+      if isinstance(result, ASTNode):
+        terms.append(result)
+      else:
+        constant += result
+    constant = context.limit(constant)
+    if len(terms) == 0:
+      return constant
+    if constant != 0:
+      terms.append(ASTNumber(constant))
+    return terms[0] if len(terms) == 1 else ASTSum(terms)
+  def derivative_with(self, var, context, derivatives):
+    return ASTSum(derivatives).simplify(context=context)
 
 # Invariant: no factor in a product is a product
 class ASTProduct(ASTNode):
+  __slots__ = ("factors", "depth", "constant", "hash_value", "sort_value")
+  fields = ("factors",)
   precidence = 3
+  sort_rank = 7
+  # Like ASTSum, factors are stored as a tuple
   def __init__(self, *factors):
-    if len(factors) == 1 and isinstance(factors[0], list):
-      self.factors = factors[0]
-    else:
-      self.factors = list(factors)
+    if len(factors) == 1 and (isinstance(factors[0], list) or isinstance(factors[0], tuple)):
+      factors = factors[0]
     
     # Flatten products; this enforces our no product children invariant
-    i = 0
-    while i < len(self.factors):
-      if isinstance(self.factors[i], ASTProduct):
-        self.factors = self.factors[:i] + self.factors[i].factors + self.factors[i+1:]
+    flattened = []
+    depth = 0
+    constant = True
+    for factor in factors:
+      if isinstance(factor, ASTProduct):
+        flattened.extend(factor.factors)
+        factor_depth = factor.depth - 1
       else:
-        i += 1
+        flattened.append(factor)
+        factor_depth = factor.depth
+      if factor_depth > depth:
+        depth = factor_depth
+      constant = constant and factor.constant
+    self.factors = tuple(flattened)
+    self.depth = depth + 1
+    self.constant = constant
+    self.hash_value = None
+    self.sort_value = None
   
   @staticmethod
   def divide(numerator, denominator):
-    return ASTProduct(numerator, ASTPower(denominator, ASTNumber(-1)))
+    return ASTProduct(numerator, ASTPower(denominator, NEG_ONE))
   
-  def pretty_str(self, precidence):
-    string = ""
+  def children(self):
+    return self.factors
+  def with_children(self, children):
+    return ASTProduct(children)
+  def distribute_with(self, state, children):
+    if state.expand:
+      from cas_expand import expand_product
+      expanded = expand_product(children, state)
+      if expanded != None:
+        return expanded
+    return self.rebuild(children)
+  
+  def pretty_tokens(self):
+    tokens = []
     number_factors = []
     numerator_factors = []
     denominator_factors = []
@@ -351,85 +843,102 @@ class ASTProduct(ASTNode):
     # but we still handle cases where there are multiple numberical constant factors
     for i, factor in enumerate(number_factors):
       if i == 0 and factor.is_exactly(-1):
-        string += "-"
+        tokens.append("-")
       else:
-        string += factor.pretty_str(ASTProduct.precidence)
-        if i < len(number_factors) - 1 or len(numerator_factors) > 0 and string[-1] != ")":
-          string += "*"
+        tokens.append((factor, ASTProduct.precidence))
+        if i < len(number_factors) - 1:
+          tokens.append("*")
+        elif len(numerator_factors) > 0:
+          # Coefficients are written next to what they multiply, like 2x
+          tokens.append(PRODUCT_SEPARATOR)
     
     for i, factor in enumerate(numerator_factors):
-      formatted_string = factor.pretty_str(ASTProduct.precidence)
-      if len(string) > 1 and len(formatted_string) > 0 and string[-1] == "*"\
-        and (not is_letter(formatted_string[0]) or is_number(string[-2])):
-        string = string[:-1]
-      string += formatted_string
-      if i < len(numerator_factors) - 1\
-        and string[-1] != ")":
-        string += "*"
+      tokens.append((factor, ASTProduct.precidence))
+      if i < len(numerator_factors) - 1:
+        tokens.append(FACTOR_SEPARATOR)
     if len(denominator_factors) > 0:
-      string += "/"
+      tokens.append("/")
       use_parentheses = len(denominator_factors) > 1 or isinstance(denominator_factors[0], ASTProduct)
       if use_parentheses:
-        string += "("
+        tokens.append("(")
       for i, factor in enumerate(denominator_factors):
-        string += factor.pretty_str(ASTProduct.precidence)
+        tokens.append((factor, ASTProduct.precidence))
         if i < len(denominator_factors) - 1:
-          string += "*"
+          tokens.append("*")
       if use_parentheses:
-        string += ")"
-    
-    if precidence < ASTProduct.precidence:
-      string = "(" + string + ")"
-    return string
+        tokens.append(")")
+    return tokens
   def __str__(self):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return str_iteratively(self)
     return "(" + "*".join(map(str, self.factors)) + ")"
+  def str_with(self, strings):
+    return "(" + "*".join(strings) + ")"
   
-  def reduce(self, original_state):
+  def reduce_with(self, original_state, new_factors):
     state = original_state.after(self)
-
-    new_factors = [factor.reduce(state) for factor in self.factors]
     
     from cas_simplify_expr import ExpressionTerm
-    reduced = ExpressionTerm(new_factors, state).reduce().to_ast()
+    reduced = ExpressionTerm(list(new_factors), state).reduce().to_ast()
     
     if not isinstance(reduced, ASTProduct):
       return reduced.reduce(state)
     if len(reduced.factors) == 0:
-      return ASTNumber(1)
+      return ONE
     if len(reduced.factors) == 1:
       return reduced.factors[0]
-    
+    if not state.expand and has_fractions(reduced):
+      # Cancels common factors of the numerator and denominator, like 3x^2/x = 3x
+      from cas_polynomial import normalize_quotient
+      normalized = normalize_quotient(reduced, state)
+      if normalized != None:
+        return normalized
+    if same_nodes(reduced.factors, self.factors):
+      return self
     return reduced
   
-  def distribute(self, state):
-    return ASTProduct([factor.distribute(state) for factor in self.factors])
-  
-  def traverse(self, func):
-    for factor in self.factors:
-      factor.traverse(func)
-    func(self)
-  
-  def substitute(self, var, value):
-    return ASTProduct([factor.substitute(var, value) for factor in self.factors])
-  def eval(self):
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
     product = 1
     for factor in self.factors:
-      product *= factor.eval()
+      product *= factor.eval(context)
+    return product
+  def eval_with(self, values, context):
+    product = 1
+    for value in values:
+      product *= value
     return product
-  def derivative(self, var):
+  def exact_eval_with(self, values, context, results):
+    coefficient = 1
+    factors = []
+    for result in results:
+      if isinstance(result, ASTNode):
+        factors.append(result)
+      else:
+        coefficient *= result
+    coefficient = context.limit(coefficient)
+    if len(factors) == 0 or coefficient == 0:
+      return coefficient
+    if coefficient != 1:
+      factors.insert(0, ASTNumber(coefficient))
+    return factors[0] if len(factors) == 1 else ASTProduct(factors)
+  def derivative_with(self, var, context, derivatives):
     # First, move the constant factors out of the derivative
     # Then, apply the product rule recursively
     constantTerms = []
     nonConstantFactors = []
-    for factor in self.factors:
+    nonConstantDerivatives = []
+    for i, factor in enumerate(self.factors):
       if factor.is_constant():
         constantTerms.append(factor)
       else:
         nonConstantFactors.append(factor)
+        nonConstantDerivatives.append(derivatives[i])
         
     # If there are no non-constant factors, derivative is zero
     if len(nonConstantFactors) == 0:
-      return ASTNumber(0)
+      return ZERO
 
     # The generalized form of the product rule
     # is the sum of derivatives of each factor times the product of the others
@@ -437,81 +946,110 @@ class ASTProduct(ASTNode):
     sumTerms = []
     for i, factor in enumerate(nonConstantFactors):
       otherFactors = nonConstantFactors[:i] + nonConstantFactors[i+1:]
-      sumTerms.append(ASTProduct([factor.derivative(var)] + otherFactors))
+      sumTerms.append(ASTProduct([nonConstantDerivatives[i]] + otherFactors))
     
     if len(constantTerms) > 0:
-      return ASTProduct(constantTerms + [ASTSum(sumTerms)]).simplify()
-    return ASTSum(sumTerms).simplify()
-  
-  def is_constant(self):
-    return all(factor.is_constant() for factor in self.factors)
+      return ASTProduct(constantTerms + [ASTSum(sumTerms)]).simplify(context=context)
+    return ASTSum(sumTerms).simplify(context=context)
 
 class ASTPower(ASTNode):
+  __slots__ = ("base", "exponent", "depth", "constant", "hash_value", "sort_value")
+  fields = ("base", "exponent")
   precidence = 2
+  sort_rank = 6
   def __init__(self, base, exponent):
     self.base = base
     self.exponent = exponent
+    self.depth = (base.depth if base.depth > exponent.depth else exponent.depth) + 1
+    self.constant = base.constant and exponent.constant
+    self.hash_value = None
+    self.sort_value = None
   
-  def pretty_str(self, precidence):
-    string = self.base.pretty_str(ASTPower.precidence) + "^" + self.exponent.pretty_str(ASTPower.precidence)
-    if precidence < ASTPower.precidence:
-      string = "(" + string + ")"
-    return string
+  def children(self):
+    return (self.base, self.exponent)
+  def with_children(self, children):
+    return ASTPower(children[0], children[1])
+  # Powers are sorted right after their base, by exponent, so x < x^2 < x^3 < y.
+  # Nothing else has a key that starts with a whole key, so keys are still different.
+  def sort_key_with(self, keys):
+    self.sort_value = keys[0] + (keys[1],)
+    return self.sort_value
+  def distribute_with(self, state, children):
+    base, exponent = children
+    if state.expand and exponent.is_integer() and exponent.number >= 2\
+      and (isinstance(base, ASTSum) or isinstance(base, ASTProduct)):
+      from cas_expand import expand_power
+      expanded = expand_power(base, int(exponent.number), state)
+      if expanded != None:
+        return expanded
+    return self.rebuild(children)
+  
+  def pretty_tokens(self):
+    return ((self.base, ASTPower.precidence), "^", (self.exponent, ASTPower.precidence))
 
   def __str__(self):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return str_iteratively(self)
     return "(" + str(self.base) + "^" + str(self.exponent) + ")"
+  def str_with(self, strings):
+    return "(" + strings[0] + "^" + strings[1] + ")"
   
-  def reduce(self, original_state):
+  def reduce_with(self, original_state, children):
     state = original_state.after(self)
     
-    base = self.base.reduce(state)
-    exponent = self.exponent.reduce(state)
+    base, exponent = children
     # This results in the ambiguous 0^0 case being 0.
     # Maybe this should be a setting or warning?
     if base.is_exactly(0):
-      return ASTNumber(0)
+      return ZERO
     
     if exponent.is_exactly(0):
-      return ASTNumber(1)
+      return ONE
     if exponent.is_exactly(1):
       return base
     
     if base.is_exactly(1):
-      return ASTNumber(1)
+      return ONE
     
     if base.is_number() and exponent.is_number():
-      result = base.number ** exponent.number
-      # When rational numbers are enabled and the result is not a rational number
-      if result == None:
-        return self
-      return ASTNumber(result)
+      result = power_of_numbers(base.number, exponent.number, state.context)
+      if result != None:
+        return ASTNumber(result)
     
-    simplified_self = ASTPower(base, exponent)
-    return simplified_self
+    return self.rebuild(children)
 
-  def distribute(self, state):
-    # TODO
-    return ASTPower(self.base.distribute(state), self.exponent.distribute(state))
-  
-  def traverse(self, func):
-    self.base.traverse(func)
-    self.exponent.traverse(func)
-    func(self)
-  
-  def substitute(self, var, value):
-    return ASTPower(
-      self.base.substitute(var, value),
-      self.exponent.substitute(var, value)
-    )
-
-  def eval(self):
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
     if self.base.is_exactly(0) and self.exponent.is_exactly(0):
       # This is an ambiguous case; 0^0 is undefined. We should probably make this a setting and warning.
       return 0
     # This _can_ return complex numbers, but it's fine in evaluation for now.
-    return self.base.eval() ** self.exponent.eval()
+    return self.base.eval(context) ** self.exponent.eval(context)
+  def eval_with(self, values, context):
+    if self.base.is_exactly(0) and self.exponent.is_exactly(0):
+      return 0
+    return values[0] ** values[1]
+  # Like reduce_with, 0^x is 0
+  def exact_eval_with(self, values, context, results):
+    base, exponent = results
+    base_is_number = not isinstance(base, ASTNode)
+    exponent_is_number = not isinstance(exponent, ASTNode)
+    if base_is_number and (base == 0 or base == 1):
+      return base
+    if exponent_is_number:
+      if exponent == 0:
+        return 1
+      if exponent == 1:
+        return base
+      if base_is_number:
+        result = power_of_numbers(base, exponent, context)
+        if result != None:
+          return result
+    return ASTPower(result_node(base), result_node(exponent))
   
-  def derivative(self, var):
+  def derivative_with(self, var, context, derivatives):
+    base_derivative, exponent_derivative = derivatives
     # There are a few simpler cases that we can take shortcuts
     # in to avoid unnecessary calculations. These aren't technically
     # necessary, but they speed up processing.
@@ -521,9 +1059,9 @@ class ASTPower(ASTNode):
     if self.exponent.is_constant():
       return ASTProduct(
         self.exponent,
-        ASTPower(self.base, ASTSum.subtract(self.exponent, ASTNumber(1))),
-        self.base.derivative(var)
-      ).simplify()
+        ASTPower(self.base, ASTSum.subtract(self.exponent, ONE)),
+        base_derivative
+      ).simplify(context=context)
     
     # Constant to the power of a function
     # C^g(x) = C^g(x) * ln(C) * g'(x)
@@ -531,8 +1069,8 @@ class ASTPower(ASTNode):
       return ASTProduct(
         ASTPower(self.base, self.exponent),
         ASTLn(self.base),
-        self.exponent.derivative(var)
-      ).simplify()
+        exponent_derivative
+      ).simplify(context=context)
     
     # The general case:
     # (f(x)^g(x))' = f(x)^g(x) * (f'(x)/f(x) * g(x) + g'(x) * ln(f(x)))
@@ -540,78 +1078,82 @@ class ASTPower(ASTNode):
       self,
       ASTSum(
         ASTProduct(
-          ASTProduct.divide(self.base.derivative(var), self.base),
+          ASTProduct.divide(base_derivative, self.base),
           self.exponent
         ),
         ASTProduct(
-          self.exponent.derivative(var),
+          exponent_derivative,
           ASTLn(self.base)
         )
       )
-    ).simplify()
-  
-  def is_constant(self):
-    return self.base.is_constant() and self.exponent.is_constant()
+    ).simplify(context=context)
 
 class ASTLogarithm(ASTNode):
+  __slots__ = ("base", "argument", "depth", "constant", "hash_value", "sort_value")
+  fields = ("base", "argument")
   precidence = 0
+  sort_rank = 5
   def __init__(self, base, argument):
     self.base = base
     self.argument = argument
+    self.depth = (base.depth if base.depth > argument.depth else argument.depth) + 1
+    self.constant = base.constant and argument.constant
+    self.hash_value = None
+    self.sort_value = None
   
-  def pretty_str(self, precidence):
+  def children(self):
+    return (self.base, self.argument)
+  def with_children(self, children):
+    return ASTLogarithm(children[0], children[1])
+  
+  def pretty_tokens(self):
     if isinstance(self.base, ASTEuler):
-      string = "ln"
+      tokens = ["ln"]
     elif self.base.is_exactly(10):
-      string = "log"
+      tokens = ["log"]
     else:
-      string = "log_"
+      tokens = ["log_"]
       if self.base.is_number():
-        string += self.base.pretty_str(ASTLogarithm.precidence)
+        tokens.append((self.base, ASTLogarithm.precidence))
       else:
         # Maybe this should be a setting to adjust what parentheses are used?
         # I don't think it's a huge deal.
-        string += "[" + self.base.pretty_str(100) + "]"
+        tokens.extend(("[", (self.base, 100), "]"))
     
-    string += "(" + self.argument.pretty_str(100) + ")"
-    if precidence < ASTLogarithm.precidence:
-      string = "(" + string + ")"
-    return string
+    tokens.extend(("(", (self.argument, 100), ")"))
+    return tokens
   
   def __str__(self):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return str_iteratively(self)
     return "log_[ " + str(self.base) + " ](" + str(self.argument) + ")"
+  def str_with(self, strings):
+    return "log_[ " + strings[0] + " ](" + strings[1] + ")"
   
-  def reduce(self, original_state):
+  def reduce_with(self, original_state, children):
     state = original_state.after(self)
     
-    base = self.base.reduce(state)
-    argument = self.argument.reduce(state)
+    base, argument = children
     
     if base.is_exactly(1):
       # This is a special case because log_1(x) is undefined.
       # Returning 0 isn't correct, but it's better than nothing.
       # Maybe this should be a warning until we properly represent function domains?
-      return ASTNumber(0)
+      return ZERO
     if argument.is_exactly(1):
-      return ASTNumber(0)
+      return ZERO
     
     if base.is_number() and argument.is_number():
-      import math
-
-      if cas_settings.USE_RATIONALS:
-        from cas_rational import exact_rational_log
-        result = exact_rational_log(argument.number, base.number)
-        # When rational numbers are enabled and the result is not a rational number
-        if result == None:
-          return ASTLogarithm(base, argument)
-        return ASTNumber(result)
-      
-      return ASTNumber(math.log(argument.number, base.number))
+      result = state.backend.log(argument.number, base.number)
+      # When the backend is exact and the result can't be represented exactly
+      if result == None:
+        return self.rebuild(children)
+      return ASTNumber(result)
     
     # log_b(b) = 1 if b != 1
     if base == argument and not base.is_exactly(1):
       # Handles ln(e) = 1
-      return ASTNumber(1)
+      return ONE
     
     if state.expand_logarithms:
       # log_b(a) = ln(a) / ln(b)
@@ -622,11 +1164,11 @@ class ASTLogarithm(ASTNode):
         ).reduce(state)
       
       # log_b(rational a/c) = log_b(a) - log_b(c)
-      if cas_settings.USE_RATIONALS and isinstance(argument, ASTNumber) and argument.number.denominator != 1:
+      if state.backend.exact and isinstance(argument, ASTNumber) and denominator(argument.number) != 1:
         return ASTSum.subtract(
-          ASTLogarithm(base, ASTNumber(argument.number.numerator)),
-          ASTLogarithm(base, ASTNumber(argument.number.denominator))
-        )
+          ASTLogarithm(base, ASTNumber(numerator(argument.number))),
+          ASTLogarithm(base, ASTNumber(denominator(argument.number)))
+        ).reduce(state)
       
       # log_b(a^c) = c * log_b(a)
       if isinstance(argument, ASTPower):
@@ -639,28 +1181,40 @@ class ASTLogarithm(ASTNode):
       if isinstance(argument, ASTProduct):
         return ASTSum([ASTLogarithm(base, factor) for factor in argument.factors]).reduce(state)
     
-    return ASTLogarithm(base, argument)
-
-  def distribute(self, original_state):
-    # TODO
-    return ASTLogarithm(self.base.distribute(original_state), self.argument.distribute(original_state))
-  
-  def traverse(self, func):
-    self.base.traverse(func)
-    self.argument.traverse(func)
-    func(self)
-  
-  def substitute(self, var, value):
-    return ASTLogarithm(
-      self.base.substitute(var, value),
-      self.argument.substitute(var, value)
-    )
+    return self.rebuild(children)
 
-  def eval(self):
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
+    from math import log
+    return log(self.argument.eval(context), self.base.eval(context))
+  def eval_with(self, values, context):
     from math import log
-    return log(self.argument.eval(), self.base.eval())
+    return log(values[1], values[0])
+  # Like reduce_with, log_1(x) is 0
+  def exact_eval_with(self, values, context, results):
+    base, argument = results
+    base_is_number = not isinstance(base, ASTNode)
+    argument_is_number = not isinstance(argument, ASTNode)
+    if (base_is_number and base == 1) or (argument_is_number and argument == 1):
+      return 0
+    if base_is_number and argument_is_number:
+      if is_exact_number(base) and is_exact_number(argument):
+        result = context.backend.log(argument, base)
+      else:
+        from math import log
+        try:
+          result = log(argument, base)
+        except ValueError:
+          result = None
+      if result != None:
+        return result
+    elif base == argument:
+      return 1
+    return ASTLogarithm(result_node(base), result_node(argument))
   
-  def derivative(self, var):
+  def derivative_with(self, var, context, derivatives):
+    base_derivative, argument_derivative = derivatives
     # There are a few simpler cases that we can take shortcuts
     # in to avoid unnecessary calculations. These aren't technically
     # necessary, but they speed up processing.
@@ -669,12 +1223,12 @@ class ASTLogarithm(ASTNode):
     # (log_b(f(x)))' = f'(x) / (f(x) * ln(b))
     if self.base.is_constant():
       return ASTProduct.divide(
-        self.argument.derivative(var),
+        argument_derivative,
         ASTProduct(
           self.argument,
           ASTLn(self.base)
         )
-      ).simplify()
+      ).simplify(context=context)
     
     # If the argument is a constant:
     # (log_[b(x)](C))' = (-ln(c) * b'(x)) / (b(x) * ln(b(x))^2)
@@ -682,13 +1236,13 @@ class ASTLogarithm(ASTNode):
       return ASTProduct.divide(
         ASTProduct(
           ASTLn(self.argument),
-          self.base.derivative(var)
+          base_derivative
         ).negate(),
         ASTProduct(
           self.base,
-          ASTPower(ASTLn(self.base), ASTNumber(2))
+          ASTPower(ASTLn(self.base), TWO)
         )
-      ).simplify()
+      ).simplify(context=context)
     
     # The general case:
     # (log_[b(x)](f(x)))' = (ln(b(x)) * f'(x)/f(x) - ln(f(x)) * b'(x)/b(x)) / ln(b(x))^2
@@ -696,19 +1250,26 @@ class ASTLogarithm(ASTNode):
       ASTSum.subtract(
         ASTProduct(
           ASTLn(self.base),
-          ASTProduct.divide(self.argument.derivative(var), self.argument)
+          ASTProduct.divide(argument_derivative, self.argument)
         ),
         ASTProduct(
           ASTLn(self.argument),
-          ASTProduct.divide(self.base.derivative(var), self.base)
+          ASTProduct.divide(base_derivative, self.base)
         )
       ),
-      ASTPower(ASTLn(self.base), ASTNumber(2))
-    ).simplify()
-  
-  def is_constant(self):
-    return self.base.is_constant() and self.argument.is_constant()
+      ASTPower(ASTLn(self.base), TWO)
+    ).simplify(context=context)
+
+# Common numbers
+ZERO = ASTNumber(0)
+ONE = ASTNumber(1)
+NEG_ONE = ASTNumber(-1)
+TWO = ASTNumber(2)
 
 # Simple helper to avoid repetitive natural logarithm creation
 def ASTLn(argument):
-  return ASTLogarithm(ASTEuler(), argument)
\ No newline at end of file
+  return ASTLogarithm(EULER, argument)
+
+# Creates a number node for numerator/denominator using the context's number backend
+def ASTFraction(numerator, denominator, context=None):
+  return ASTNumber(get_context(context).backend.fraction(numerator, denominator))
@@ -0,0 +1,460 @@
+from cas_parser import parse_to_ast
+from cas_rational import Rational, exact_rational_log
+from cas_random_expr import ExpressionGenerator, try_eval
+from cas_settings import get_context
+import cas_settings
+
+import sys
+
+# A small benchmark harness for the CAS.
+# Run it with `python src/cas_benchmarks.py`; see parse_args for options.
+# Results can be written as JSON and compared against a stored baseline
+# so we can tell whether a change actually made things faster or slower.
+
+# Micropython doesn't have perf_counter, but it has ticks_us.
+try:
+  from time import perf_counter
+  def now():
+    return perf_counter()
+except ImportError:
+  try:
+    from time import ticks_us, ticks_diff
+    _start_ticks = ticks_us()
+    def now():
+      return ticks_diff(ticks_us(), _start_ticks) / 1000000
+  except ImportError:
+    from time import time as now
+
+# Expressions we care about in practice; mostly taken from the tests and README.
+FIXED_CORPUS = [
+  "2*csc(5 + x^2) + log_(x+2)(6*x*y)",
+  "3 - 4 + x*x - 2*x + 4*x*x + 3*x",
+  "6*x*y + 2*x*x*y",
+  "(5*x+3) / (2*x+1)",
+  "cos(sin(2*x))",
+  "cot(sec(x))",
+  "csc(2*x + 1)*tan(3*x + 1)",
+  "5*x^3 - 3*x^2 + 2*x - 4",
+  "(2*x+3) ^ (3*x+1)",
+  "((1/3)*x + 1)^(x^2/2)",
+  "log_(5+x)(x^3)",
+  "10*ln(sin(pi*x)+log_(x^2)(x/3))+55",
+]
+
+# Generated corpora scale along a single axis with n.
+# Each generator returns a list of expression strings.
+def polynomial_corpus(n):
+  # A dense polynomial in x and y with n terms
+  terms = []
+  for i in range(n):
+    term = str(3 * i + 1) + "*x^" + str(i % 5 + 1)
+    if i % 2 == 1:
+      term += "*y"
+    terms.append(term)
+  return [" + ".join(terms)]
+
+def nested_corpus(n):
+  # Function calls nested n levels deep
+  expression = "x"
+  for i in range(n):
+    expression = ("sin(" if i % 2 == 0 else "cos(") + str(i + 2) + "*" + expression + "+1)"
+  return [expression]
+
+def product_corpus(n):
+  # A product of n linear factors
+  return ["*".join("(x+" + str(i + 1) + ")" for i in range(n))]
+
+def fraction_corpus(n):
+  # A continued fraction; the simplifier is very sensitive to its depth
+  expression = "x"
+  for i in range(n):
+    expression = "(" + str(i + 1) + "+1/(" + expression + "))"
+  return [expression]
+
+# Random corpora scale a single generator parameter with n.
+# The seed is fixed so every run sees the same expressions.
+RANDOM_CORPUS_COUNT = 5
+def random_depth_corpus(n):
+  return ExpressionGenerator(seed=n, max_depth=n, sum_breadth=(2, 2), product_breadth=(2, 2)).generate_corpus(RANDOM_CORPUS_COUNT)
+def random_breadth_corpus(n):
+  return ExpressionGenerator(seed=n, max_depth=2, sum_breadth=(n, n), product_breadth=(n, n), leaf_probability=0).generate_corpus(RANDOM_CORPUS_COUNT)
+def random_variables_corpus(n):
+  variables = [chr(ord("a") + i) for i in range(n)]
+  return ExpressionGenerator(seed=n, max_depth=3, variables=variables).generate_corpus(RANDOM_CORPUS_COUNT)
+def random_coefficients_corpus(n):
+  return ExpressionGenerator(seed=n, max_depth=3, coefficient_bits=4 * n, rational_probability=0.5).generate_corpus(RANDOM_CORPUS_COUNT)
+
+GENERATED_CORPORA = {
+  "polynomial": polynomial_corpus,
+  "nested": nested_corpus,
+  "product": product_corpus,
+  "fraction": fraction_corpus,
+  "random_depth": random_depth_corpus,
+  "random_breadth": random_breadth_corpus,
+  "random_variables": random_variables_corpus,
+  "random_coefficients": random_coefficients_corpus,
+}
+
+# Nested function calls, continued fractions and deep or wide random expressions
+# blow up in the current simplifier, so they're capped lower than the other corpora.
+CORPUS_SIZE_LIMITS = {
+  "nested": 5,
+  "fraction": 5,
+  "random_depth": 5,
+  "random_breadth": 8,
+}
+
+# Values for every variable the corpora use
+EVAL_VALUES = {"x": Rational(7, 10), "y": Rational(13, 10)}
+for i in range(26):
+  EVAL_VALUES.setdefault(chr(ord("a") + i), Rational(i + 3, 10))
+
+# Pairs of (argument, base) for exact_rational_log
+def exact_log_corpus(n):
+  pairs = []
+  for k in range(1, n + 1):
+    pairs.append((Rational(3 ** k), Rational(9)))
+    pairs.append((Rational(2 ** k, 3 ** k), Rational(2, 3)))
+    pairs.append((Rational(5 ** k + 1), Rational(2)))
+  return pairs
+
+# Workloads take a prepared corpus and run the operation over every item.
+# Preparation (e.g. parsing for the simplify workload) isn't timed.
+def prepare_strings(corpus):
+  return corpus
+def prepare_asts(corpus):
+  return [parse_to_ast(expression) for expression in corpus]
+def prepare_simplified(corpus):
+  return [parse_to_ast(expression).simplify() for expression in corpus]
+
+def run_parse(items):
+  for expression in items:
+    parse_to_ast(expression)
+def run_simplify(items):
+  for ast in items:
+    ast.simplify()
+def run_derivative(items):
+  for ast in items:
+    ast.derivative("x")
+def run_eval(items):
+  # Random expressions aren't always defined at our values, so this tolerates domain errors
+  for ast in items:
+    try_eval(ast, EVAL_VALUES)
+def run_exact_eval(items):
+  for ast in items:
+    try:
+      ast.exact_eval(EVAL_VALUES)
+    except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+      pass
+def run_exact_log(items):
+  for (x, base) in items:
+    exact_rational_log(x, base)
+
+WORKLOADS = {
+  "parse": (prepare_strings, run_parse),
+  "simplify": (prepare_asts, run_simplify),
+  "derivative": (prepare_asts, run_derivative),
+  "eval": (prepare_asts, run_eval),
+  "exact_eval": (prepare_simplified, run_exact_eval),
+}
+
+# Statistics helpers
+
+def percentile(values, p):
+  # Linear interpolation between the closest ranks
+  if len(values) == 0:
+    return None
+  ordered = sorted(values)
+  position = (len(ordered) - 1) * p / 100
+  lower = int(position)
+  upper = min(lower + 1, len(ordered) - 1)
+  fraction = position - lower
+  return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+def median(values):
+  return percentile(values, 50)
+
+def summarize(times):
+  return {
+    "runs": len(times),
+    "min": min(times),
+    "median": median(times),
+    "p90": percentile(times, 90),
+    "p99": percentile(times, 99),
+    "max": max(times),
+  }
+
+# Allocation measurement uses tracemalloc where it's available, and falls
+# back to the gc module's counters on Micropython. Measured separately from
+# the timing runs since tracing slows everything down.
+def measure_allocations(run, items):
+  try:
+    import tracemalloc
+  except ImportError:
+    tracemalloc = None
+
+  if tracemalloc != None:
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+      tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    run(items)
+    _, peak = tracemalloc.get_traced_memory()
+    if not was_tracing:
+      tracemalloc.stop()
+    return {"peak_bytes": peak - start}
+
+  try:
+    import gc
+    gc.collect()
+    gc.disable()
+    start = gc.mem_alloc()
+    run(items)
+    allocated = gc.mem_alloc() - start
+    gc.enable()
+    return {"allocated_bytes": allocated}
+  except (ImportError, AttributeError):
+    return {}
+
+def count_nodes(node):
+  count = 0
+  for child in node.iter_preorder():
+    count += 1
+  return count
+
+# Measures the memory retained by parsed expressions, per AST node.
+# Unlike measure_allocations, temporary allocations while parsing aren't counted.
+def measure_node_memory(corpus):
+  try:
+    import tracemalloc
+  except ImportError:
+    tracemalloc = None
+
+  import gc
+  gc.collect()
+  if tracemalloc != None:
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+      tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    asts = [parse_to_ast(expression) for expression in corpus]
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    if not was_tracing:
+      tracemalloc.stop()
+  else:
+    try:
+      start = gc.mem_alloc()
+      asts = [parse_to_ast(expression) for expression in corpus]
+      gc.collect()
+      end = gc.mem_alloc()
+    except AttributeError:
+      return None
+
+  nodes = 0
+  for ast in asts:
+    nodes += count_nodes(ast)
+  return {
+    "nodes": nodes,
+    "bytes": end - start,
+    "bytes_per_node": (end - start) / nodes if nodes > 0 else 0,
+  }
+
+def node_memory_corpus():
+  corpus = list(FIXED_CORPUS)
+  for generate in GENERATED_CORPORA.values():
+    corpus.extend(generate(8))
+  return corpus
+
+def time_runs(run, items, repeat):
+  times = []
+  for _ in range(repeat):
+    start = now()
+    run(items)
+    times.append(now() - start)
+  return times
+
+def benchmark(name, prepare, run, corpus, repeat, measure_memory=True):
+  items = prepare(corpus)
+  # Warm up once so import and first-call costs aren't measured
+  run(items)
+  result = summarize(time_runs(run, items, repeat))
+  if measure_memory:
+    result.update(measure_allocations(run, items))
+  result["name"] = name
+  return result
+
+# Runs every selected workload over the fixed corpus and each generated corpus size.
+# Returns a dictionary of benchmark names to their result statistics.
+def run_benchmarks(sizes=(4, 8, 16), repeat=7, workloads=None, measure_memory=True, log=None):
+  if workloads == None:
+    workloads = list(WORKLOADS.keys()) + ["exact_log"]
+
+  results = {}
+  def record(result):
+    results[result["name"]] = result
+    if log != None:
+      log(format_result(result))
+
+  for workload in workloads:
+    if workload == "exact_log":
+      if not get_context().exact:
+        continue
+      for size in sizes:
+        record(benchmark(
+          "exact_log/powers/" + str(size),
+          lambda corpus: corpus, run_exact_log,
+          exact_log_corpus(size), repeat, measure_memory
+        ))
+      continue
+
+    if workload not in WORKLOADS:
+      raise Exception("Unknown workload " + workload)
+    prepare, run = WORKLOADS[workload]
+
+    record(benchmark(workload + "/fixed", prepare, run, FIXED_CORPUS, repeat, measure_memory))
+    for corpus_name, generate in GENERATED_CORPORA.items():
+      for size in sizes:
+        if size > CORPUS_SIZE_LIMITS.get(corpus_name, size):
+          continue
+        record(benchmark(
+          workload + "/" + corpus_name + "/" + str(size),
+          prepare, run, generate(size), repeat, measure_memory
+        ))
+  return results
+
+def format_seconds(seconds):
+  if seconds < 0.001:
+    return str(round(seconds * 1000000, 1)) + "us"
+  if seconds < 1:
+    return str(round(seconds * 1000, 2)) + "ms"
+  return str(round(seconds, 3)) + "s"
+
+def format_result(result):
+  string = result["name"] + ": median " + format_seconds(result["median"]) + \
+    ", p90 " + format_seconds(result["p90"]) + \
+    ", min " + format_seconds(result["min"])
+  if "peak_bytes" in result:
+    string += ", peak " + str(result["peak_bytes"]) + "B"
+  elif "allocated_bytes" in result:
+    string += ", allocated " + str(result["allocated_bytes"]) + "B"
+  return string
+
+# Baseline comparison
+
+# Compares the median time of every benchmark present in both result sets.
+# Returns a list of (name, baseline_median, current_median, ratio, regressed) tuples.
+def compare_results(current, baseline, threshold):
+  comparisons = []
+  for name in sorted(current.keys()):
+    if name not in baseline:
+      continue
+    old = baseline[name]["median"]
+    new = current[name]["median"]
+    ratio = new / old if old > 0 else 1
+    comparisons.append((name, old, new, ratio, ratio > 1 + threshold))
+  return comparisons
+
+def save_results(results, path, node_memory=None):
+  import json
+  with open(path, "w") as file:
+    json.dump({
+      "version": 1,
+      "python": sys.version,
+      "use_rationals": get_context().exact,
+      "backend": get_context().backend.name,
+      "node_memory": node_memory,
+      "results": results,
+    }, file)
+
+def load_results(path):
+  import json
+  with open(path) as file:
+    return json.load(file)["results"]
+
+def parse_args(argv):
+  options = {
+    "sizes": (4, 8, 16),
+    "repeat": 7,
+    "workloads": None,
+    "json": None,
+    "baseline": None,
+    "threshold": 0.25,
+    "memory": True,
+    "backend": None,
+  }
+  i = 0
+  while i < len(argv):
+    arg = argv[i]
+    if arg == "--no-memory":
+      options["memory"] = False
+      i += 1
+      continue
+    if i + 1 >= len(argv):
+      raise Exception("Missing value for " + arg)
+    value = argv[i + 1]
+    if arg == "--sizes":
+      options["sizes"] = tuple(int(size) for size in value.split(","))
+    elif arg == "--repeat":
+      options["repeat"] = int(value)
+    elif arg == "--only":
+      options["workloads"] = value.split(",")
+    elif arg == "--json":
+      options["json"] = value
+    elif arg == "--baseline":
+      options["baseline"] = value
+    elif arg == "--threshold":
+      options["threshold"] = float(value)
+    elif arg == "--backend":
+      options["backend"] = value
+    else:
+      raise Exception("Unknown option " + arg)
+    i += 2
+  return options
+
+def main(argv):
+  options = parse_args(argv)
+  if options["backend"] != None:
+    if options["backend"] == "float":
+      cas_settings.USE_RATIONALS = False
+    else:
+      cas_settings.NUMBER_BACKEND = options["backend"]
+  print("Number backend: " + get_context().backend.name)
+  results = run_benchmarks(
+    options["sizes"], options["repeat"], options["workloads"],
+    options["memory"], log=print
+  )
+
+  node_memory = None
+  if options["memory"]:
+    node_memory = measure_node_memory(node_memory_corpus())
+    if node_memory != None:
+      print(
+        "Memory per AST node: " + str(round(node_memory["bytes_per_node"], 1)) + "B (" +
+        str(node_memory["nodes"]) + " nodes, " + str(node_memory["bytes"]) + "B)"
+      )
+
+  if options["json"] != None:
+    save_results(results, options["json"], node_memory)
+
+  if options["baseline"] != None:
+    comparisons = compare_results(results, load_results(options["baseline"]), options["threshold"])
+    regressions = 0
+    print("\nComparison against " + options["baseline"] + ":")
+    for (name, old, new, ratio, regressed) in comparisons:
+      print(
+        ("  REGRESSION " if regressed else "  ") + name + ": " +
+        format_seconds(old) + " -> " + format_seconds(new) +
+        " (" + str(round(ratio, 2)) + "x)"
+      )
+      if regressed:
+        regressions += 1
+    if regressions > 0:
+      print(str(regressions) + " benchmarks regressed by more than " + str(round(options["threshold"] * 100)) + "%")
+      return 1
+    print("No regressions.")
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,65 @@
+from cas_ast import *
+
+# Compiled expressions, for evaluating the same expression at a lot of points.
+#
+# eval walks the whole tree every time it's called, and evaluating at a point with
+# substitute rebuilds the tree first. Compiling walks it once and makes a flat list of
+# instructions instead, where each instruction evaluates one node from its children's
+# results. Every distinct subtree gets one instruction, so repeated subexpressions
+# (which derivatives are full of) are only evaluated once per call, and constant
+# subtrees like 2π or sin(1) are evaluated when compiling.
+
+class CompiledExpression:
+  # variables are the names of the variables, in the order their values are passed in
+  def __init__(self, node, variables, context=None):
+    self.context = get_context(context)
+    self.variables = tuple(variables)
+    # The starting value of every register; the rest are filled in when called
+    self.registers = []
+    # (node, registers of its children, register for its result)
+    self.instructions = []
+    # The register each variable's value goes in
+    self.inputs = [None] * len(self.variables)
+    positions = {}
+    for i in range(len(self.variables)):
+      positions[self.variables[i]] = i
+    # Distinct subtrees and their registers
+    registers = {}
+
+    def new_register(value=None):
+      self.registers.append(value)
+      return len(self.registers) - 1
+
+    def leaf(node):
+      register = registers.get(node)
+      if register != None:
+        return register
+      if isinstance(node, ASTVariable):
+        if node.name not in positions:
+          raise Exception("Cannot evaluate variable")
+        register = new_register()
+        self.inputs[positions[node.name]] = register
+      else:
+        register = new_register(node.eval(self.context))
+      registers[node] = register
+      return register
+
+    def combine(node, inputs):
+      register = new_register()
+      self.instructions.append((node, inputs, register))
+      registers[node] = register
+      return register
+
+    self.result = fold(node, leaf, combine, lambda node: node.constant or node in registers)
+
+  # Returns the value of the expression, given the values of its variables in order
+  def __call__(self, *values):
+    registers = list(self.registers)
+    inputs = self.inputs
+    for i in range(len(inputs)):
+      if inputs[i] != None:
+        registers[inputs[i]] = values[i]
+    context = self.context
+    for node, children, register in self.instructions:
+      registers[register] = node.eval_with([registers[i] for i in children], context)
+    return registers[self.result]
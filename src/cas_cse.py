@@ -0,0 +1,115 @@
+from cas_ast import *
+
+# Common subexpression elimination.
+#
+# Derivatives repeat the same subtrees a lot (d/dx sec(u) = sec(u)tan(u)u', and
+# the chain rule copies u everywhere). This turns an expression into a list of
+# named temporaries, each defined in terms of the ones before it, so every
+# repeated subexpression is evaluated (and printed) once:
+#
+#   ta = 3x+1
+#   3sec(ta)tan(ta)
+
+# A subexpression bound to a temporary; expression can use earlier temporaries
+class Binding:
+  __slots__ = ("name", "expression")
+  def __init__(self, name, expression):
+    self.name = name
+    self.expression = expression
+
+class SharedExpression:
+  # bindings are in the order they have to be evaluated in
+  def __init__(self, bindings, result):
+    self.bindings = bindings
+    self.result = result
+
+  # Evaluates the expression, computing every temporary once.
+  # values maps variable names to numbers.
+  def eval(self, values=None, context=None):
+    known = dict(values) if values != None else {}
+    def leaf(node):
+      if isinstance(node, ASTVariable):
+        if node.name not in known:
+          raise Exception("Cannot evaluate variable")
+        return known[node.name]
+      return node.eval(context)
+    combine = lambda node, values: node.eval_with(values, context)
+    for binding in self.bindings:
+      known[binding.name] = fold(binding.expression, leaf, combine)
+    return fold(self.result, leaf, combine)
+
+  # Substitutes the temporaries back in, giving the original expression
+  def expand(self):
+    node = self.result
+    for binding in reversed(self.bindings):
+      node = node.substitute(binding.name, binding.expression)
+    return node
+
+  # One line per temporary, then the result
+  def pretty_str(self, precidence=100):
+    lines = [binding.name + " = " + binding.expression.pretty_str(precidence) for binding in self.bindings]
+    lines.append(self.result.pretty_str(precidence))
+    return "\n".join(lines)
+  def __str__(self):
+    return self.pretty_str()
+
+# Returns how many times each distinct subtree is used, counting each
+# repeated subtree's own subtrees only once (since it's only evaluated once).
+def count_uses(node):
+  uses = {}
+  stack = [node]
+  while len(stack) > 0:
+    node = stack.pop()
+    if node.depth == 1:
+      continue
+    if node in uses:
+      uses[node] += 1
+      continue
+    uses[node] = 1
+    stack.extend(node.children())
+  return uses
+
+# Temporaries are named with letters instead of numbers, since pretty_str
+# leaves out the * after a digit (3*x is printed as 3x), so t1*t1 would print as t1t1.
+def temporary_suffix(n):
+  suffix = ""
+  while n > 0:
+    n -= 1
+    suffix = chr(ord("a") + n % 26) + suffix
+    n //= 26
+  return suffix
+
+# Returns a SharedExpression for node, with every subexpression used more than once
+# bound to a temporary. Temporaries are named prefix + a, b, ..., z, aa, ab, ...,
+# skipping any names the expression already uses.
+def eliminate_common_subexpressions(node, prefix="t"):
+  uses = count_uses(node)
+  variables = node.get_variables()
+  bindings = []
+  # What each distinct subtree was replaced with
+  replaced = {}
+  counter = [0]
+
+  def new_name():
+    while True:
+      counter[0] += 1
+      name = prefix + temporary_suffix(counter[0])
+      if name not in variables:
+        return name
+
+  def combine(node, children):
+    result = node.rebuild(children)
+    if uses[node] > 1:
+      name = new_name()
+      bindings.append(Binding(name, result))
+      result = ASTVariable(name)
+    replaced[node] = result
+    return result
+
+  result = fold(
+    node,
+    lambda node: replaced.get(node, node),
+    combine,
+    lambda node: node in replaced
+  )
+  return SharedExpression(bindings, result)
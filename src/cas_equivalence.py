@@ -0,0 +1,419 @@
+from cas_ast import *
+from cas_functions import ASTFunctionCall, ASTUserFunctionCall
+from cas_rational import Rational
+from cas_random_expr import SeededRandom
+
+# Probabilistic equivalence testing for expressions.
+#
+# For the polynomial/rational fragment we evaluate both expressions at random
+# points modulo a large prime. By the Schwartz-Zippel lemma, two different
+# rational functions of degree d agree at a random point with probability at
+# most about d/p, so a few trials make a wrong answer vanishingly unlikely.
+# Anything outside that fragment (functions, logarithms, non-integer powers,
+# pi and e) is treated as an opaque atom with its own random value. Agreement
+# with atoms still proves equivalence, but disagreement might come from an
+# identity between atoms (like sin(x)^2+cos(x)^2=1), so in that case we fall
+# back to high-precision numeric sampling.
+
+# 2^61 - 1 is a Mersenne prime, so values stay small enough to be cheap
+PRIME = 2305843009213693951
+
+class NotModular(Exception):
+  pass
+class UnluckyPoint(Exception):
+  pass
+# Raised for functions without a high-precision implementation, which are compared with floats instead
+class NotDecimal(Exception):
+  pass
+
+# Random values for variables and atoms at one evaluation point.
+# Values are created lazily by name so every expression evaluated at
+# the same point sees the same values.
+class ModularPoint:
+  def __init__(self, seed, prime=PRIME):
+    self.prime = prime
+    self.random = SeededRandom(seed)
+    self.values = {}
+
+  def value(self, key):
+    if key not in self.values:
+      value = (self.random.next_int() << 32) | self.random.next_int()
+      self.values[key] = 1 + value % (self.prime - 1)
+    return self.values[key]
+
+def number_mod(number, p):
+  if isinstance(number, float):
+    if number != int(number):
+      # Floats aren't exact, so modular arithmetic would be meaningless
+      raise NotModular()
+    return int(number) % p
+  if isinstance(number, int):
+    return number % p
+  # A fraction from any number backend
+  if int(number.denominator) % p == 0:
+    raise UnluckyPoint()
+  return int(number.numerator) * pow(int(number.denominator), p - 2, p) % p
+
+# Evaluates a node modulo point.prime. atoms is a list that gets
+# True appended whenever an opaque atom is used.
+def mod_eval(node, point, atoms):
+  p = point.prime
+  if isinstance(node, ASTNumber):
+    return number_mod(node.number, p)
+  if isinstance(node, ASTVariable):
+    return point.value(node.name)
+  if isinstance(node, ASTSum):
+    total = 0
+    for term in node.terms:
+      total += mod_eval(term, point, atoms)
+    return total % p
+  if isinstance(node, ASTProduct):
+    product = 1
+    for factor in node.factors:
+      product = product * mod_eval(factor, point, atoms) % p
+    return product
+  if isinstance(node, ASTPower) and node.exponent.is_integer():
+    exponent = int(node.exponent.number)
+    base = mod_eval(node.base, point, atoms)
+    if exponent < 0:
+      if base == 0:
+        raise UnluckyPoint()
+      base = pow(base, p - 2, p)
+    return pow(base, abs(exponent), p)
+  if isinstance(node, ASTLebiniz):
+    return point.value(str(node))
+  # Everything else is an atom identified by its structure
+  atoms.append(True)
+  return point.value("atom:" + str(node))
+
+# Returns True if the expressions are equivalent, False if they definitely aren't,
+# and None if modular evaluation can't decide.
+def modular_equivalent(a, b, trials=3, seed=0):
+  used_atoms = False
+  for trial in range(trials):
+    # Retry a few times if we happen to hit a pole
+    for attempt in range(3):
+      point = ModularPoint(seed * 1000 + trial * 10 + attempt)
+      atoms = []
+      try:
+        value_a = mod_eval(a, point, atoms)
+        value_b = mod_eval(b, point, atoms)
+        break
+      except UnluckyPoint:
+        continue
+      except NotModular:
+        return None
+    else:
+      return None
+    used_atoms = used_atoms or len(atoms) > 0
+    if value_a != value_b:
+      return None if used_atoms else False
+  return True
+
+# High-precision numeric evaluation.
+# The decimal module isn't available on Micropython,
+# so we fall back to floats there.
+try:
+  import decimal
+  from decimal import Decimal
+except ImportError:
+  decimal = None
+
+_pi_cache = {}
+def decimal_pi():
+  precision = decimal.getcontext().prec
+  if precision not in _pi_cache:
+    # From the decimal module documentation's recipes
+    decimal.getcontext().prec += 2
+    three = Decimal(3)
+    lasts, t, s, n, na, d, da = 0, three, 3, 1, 0, 0, 24
+    while s != lasts:
+      lasts = s
+      n, na = n + na, na + 8
+      d, da = d + da, da + 32
+      t = (t * n) / d
+      s += t
+    decimal.getcontext().prec -= 2
+    _pi_cache[precision] = +s
+  return _pi_cache[precision]
+
+def decimal_sin(x):
+  pi = decimal_pi()
+  # Reduce to [-pi, pi] so the series converges quickly
+  x = x - 2 * pi * (x / (2 * pi)).to_integral_value()
+  i, lasts, s, fact, num, sign = 1, 0, x, 1, x, 1
+  while s != lasts:
+    lasts = s
+    i += 2
+    fact *= i * (i - 1)
+    num *= x * x
+    sign *= -1
+    s += num / fact * sign
+  return +s
+
+def decimal_cos(x):
+  return decimal_sin(x + decimal_pi() / 2)
+
+def decimal_atan(x):
+  if x < 0:
+    return -decimal_atan(-x)
+  if x > 1:
+    return decimal_pi() / 2 - decimal_atan(1 / x)
+  # atan(x) = 2 atan(x / (1 + sqrt(1 + x^2))) shrinks the argument
+  halvings = 0
+  while x > Decimal("0.1"):
+    x = x / (1 + (1 + x * x).sqrt())
+    halvings += 1
+  i, lasts, s, num, sign = 1, 0, x, x, 1
+  while s != lasts:
+    lasts = s
+    i += 2
+    num *= x * x
+    sign *= -1
+    s += num / i * sign
+  return s * (2 ** halvings)
+
+def decimal_asin(x):
+  if x > 1 or x < -1:
+    raise ValueError("math domain error")
+  if x == 1 or x == -1:
+    return x * decimal_pi() / 2
+  return decimal_atan(x / (1 - x * x).sqrt())
+
+def decimal_acos(x):
+  return decimal_pi() / 2 - decimal_asin(x)
+
+def decimal_sinh(x):
+  return (x.exp() - (-x).exp()) / 2
+
+def decimal_cosh(x):
+  return (x.exp() + (-x).exp()) / 2
+
+def decimal_tanh(x):
+  return 1 - 2 / ((2 * x).exp() + 1)
+
+def decimal_asinh(x):
+  return (x + (x * x + 1).sqrt()).ln()
+
+def decimal_acosh(x):
+  if x < 1:
+    raise ValueError("math domain error")
+  return (x + (x * x - 1).sqrt()).ln()
+
+def decimal_atanh(x):
+  if x <= -1 or x >= 1:
+    raise ValueError("math domain error")
+  return ((1 + x) / (1 - x)).ln() / 2
+
+decimal_functions = {
+  "sin": decimal_sin,
+  "cos": decimal_cos,
+  "tan": lambda x: decimal_sin(x) / decimal_cos(x),
+  "csc": lambda x: 1 / decimal_sin(x),
+  "sec": lambda x: 1 / decimal_cos(x),
+  "cot": lambda x: decimal_cos(x) / decimal_sin(x),
+  "arcsin": decimal_asin,
+  "arccos": decimal_acos,
+  "arctan": decimal_atan,
+  "arccsc": lambda x: decimal_asin(1 / x),
+  "arcsec": lambda x: decimal_acos(1 / x),
+  "arccot": lambda x: decimal_atan(1 / x),
+  "sinh": decimal_sinh,
+  "cosh": decimal_cosh,
+  "tanh": decimal_tanh,
+  "csch": lambda x: 1 / decimal_sinh(x),
+  "sech": lambda x: 1 / decimal_cosh(x),
+  "coth": lambda x: 1 / decimal_tanh(x),
+  "arcsinh": decimal_asinh,
+  "arccosh": decimal_acosh,
+  "arctanh": decimal_atanh,
+  "arccsch": lambda x: decimal_asinh(1 / x),
+  "arcsech": lambda x: decimal_acosh(1 / x),
+  "arccoth": lambda x: decimal_atanh(1 / x),
+}
+
+def to_decimal(number):
+  if isinstance(number, int) or isinstance(number, float):
+    return Decimal(number)
+  return Decimal(int(number.numerator)) / Decimal(int(number.denominator))
+
+def decimal_eval(node, values):
+  if isinstance(node, ASTPi):
+    return decimal_pi()
+  if isinstance(node, ASTEuler):
+    return Decimal(1).exp()
+  if isinstance(node, ASTNumber):
+    return to_decimal(node.number)
+  if isinstance(node, ASTVariable):
+    return values(node.name)
+  if isinstance(node, ASTLebiniz):
+    return values(str(node))
+  if isinstance(node, ASTSum):
+    total = Decimal(0)
+    for term in node.terms:
+      total += decimal_eval(term, values)
+    return total
+  if isinstance(node, ASTProduct):
+    product = Decimal(1)
+    for factor in node.factors:
+      product *= decimal_eval(factor, values)
+    return product
+  if isinstance(node, ASTPower):
+    base = decimal_eval(node.base, values)
+    exponent = decimal_eval(node.exponent, values)
+    if base == 0 and exponent == 0:
+      # Matches ASTPower.eval
+      return Decimal(0)
+    return base ** exponent
+  if isinstance(node, ASTLogarithm):
+    return decimal_eval(node.argument, values).ln() / decimal_eval(node.base, values).ln()
+  if isinstance(node, ASTUserFunctionCall):
+    return decimal_eval(node.function.substitute(node.argument), values)
+  if isinstance(node, ASTFunctionCall) and node.name in decimal_functions:
+    return decimal_functions[node.name](decimal_eval(node.argument, values))
+  raise NotDecimal("Can't numerically evaluate " + type(node).__name__)
+
+# Evaluates a node at a point, returning None where it isn't defined
+def numeric_value(node, values, use_decimal):
+  if not use_decimal:
+    try:
+      result = node.substitute_with_numbers(values.float_values()).eval()
+    except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+      return None
+    if isinstance(result, complex) or result != result:
+      return None
+    return result
+  try:
+    return decimal_eval(node, values)
+  except (ArithmeticError, ValueError):
+    return None
+
+class NumericPoint:
+  def __init__(self, random):
+    self.random = random
+    self.values = {}
+  def value(self, key):
+    if key not in self.values:
+      # Rationals with small denominators in [-3, 3], avoiding 0
+      numerator = self.random.randint(1, 300) * (1 if self.random.random() < 0.7 else -1)
+      self.values[key] = Rational(numerator, self.random.randint(97, 103))
+    return self.values[key]
+  # The value as a Decimal, for decimal_eval
+  def __call__(self, key):
+    return to_decimal(self.value(key))
+  def float_values(self):
+    values = {}
+    for key, value in self.values.items():
+      values[key] = float(value)
+    return values
+
+# Compares the expressions at random points. Points where neither is defined
+# are skipped, but a point where only one is defined means they differ.
+# Without the decimal module, or for functions it can't evaluate, floats are used.
+def numeric_equivalent(a, b, points=6, seed=0, precision=40):
+  if decimal != None:
+    try:
+      return compare_at_points(a, b, points, seed, precision, True)
+    except NotDecimal:
+      pass
+  return compare_at_points(a, b, points, seed, precision, False)
+
+def compare_at_points(a, b, points, seed, precision, use_decimal):
+  random = SeededRandom(seed + 7919)
+  compared = 0
+  for _ in range(points):
+    point = NumericPoint(random)
+    if use_decimal:
+      same = decimal_values_equal(a, b, point, precision)
+    else:
+      same = float_values_equal(a, b, point)
+    if same == None:
+      continue
+    if not same:
+      return False
+    compared += 1
+  return compared > 0
+
+# Returns the values of a and b at a point, evaluated with digits significant digits
+def decimal_values(a, b, point, digits):
+  with decimal.localcontext() as context:
+    context.prec = digits
+    return numeric_value(a, point, True), numeric_value(b, point, True)
+
+# Whether a and b are equal at a point, or None if neither is defined there.
+# Rounding errors depend on how much cancels out, so there's no tolerance that works for
+# every expression. Instead, they're compared at two precisions: rounding errors shrink
+# with the extra digits, but real differences, however small, stay the same.
+def decimal_values_equal(a, b, point, precision):
+  low_a, low_b = decimal_values(a, b, point, precision + 10)
+  high_a, high_b = decimal_values(a, b, point, 2 * precision + 10)
+  if low_a == None and low_b == None and high_a == None and high_b == None:
+    return None
+  if low_a == None or low_b == None or high_a == None or high_b == None:
+    return False
+  difference = low_a - low_b
+  # When the difference rounds to exactly 0, its exponent still says where the last digit
+  # the values were rounded to is
+  bound = max(abs(difference), Decimal(1).scaleb(difference.as_tuple().exponent))
+  return abs(high_a - high_b) <= Decimal(10) ** -(precision // 2) * bound
+
+# Like decimal_values_equal, but floats only have one precision, so the tolerance is relative
+def float_values_equal(a, b, point):
+  # Floats need every variable bound before substituting
+  for var in a.get_variables() | b.get_variables():
+    point.value(var)
+  value_a = numeric_value(a, point, False)
+  value_b = numeric_value(b, point, False)
+  if value_a == None and value_b == None:
+    return None
+  if value_a == None or value_b == None:
+    return False
+  return abs(value_a - value_b) <= 1e-9 * max(abs(value_a), abs(value_b))
+
+# Returns whether two expressions are (with overwhelming probability) equivalent.
+# This doesn't need either expression to be simplified first.
+def equivalent(a, b, trials=3, seed=0, numeric_points=6, precision=40):
+  result = modular_equivalent(a, b, trials, seed)
+  if result != None:
+    return result
+  return numeric_equivalent(a, b, numeric_points, seed, precision)
+
+# Removes equivalent duplicates from a list of expressions, keeping the first of each.
+# Expressions are grouped by their values at shared modular points, so
+# most comparisons are dictionary lookups instead of pairwise checks.
+def deduplicate(nodes, trials=3, seed=0):
+  points = [ModularPoint(seed * 1000 + trial * 10) for trial in range(trials)]
+  by_fingerprint = {}
+  uncertain = []
+  unique = []
+
+  for node in nodes:
+    atoms = []
+    try:
+      fingerprint = tuple(mod_eval(node, point, atoms) for point in points)
+    except (NotModular, UnluckyPoint):
+      fingerprint = None
+
+    if fingerprint != None and fingerprint in by_fingerprint:
+      continue
+
+    # Different fingerprints only prove a difference when no atoms were involved,
+    # so anything uncertain has to be compared directly.
+    if fingerprint != None and len(atoms) == 0:
+      candidates = uncertain
+    else:
+      candidates = unique
+    duplicate = False
+    for other in candidates:
+      if equivalent(node, other, trials, seed):
+        duplicate = True
+        break
+    if duplicate:
+      continue
+
+    unique.append(node)
+    if fingerprint != None:
+      by_fingerprint[fingerprint] = node
+    if fingerprint == None or len(atoms) > 0:
+      uncertain.append(node)
+  return unique
@@ -0,0 +1,187 @@
+from cas_ast import *
+
+# Polynomial expansion: multiplying out products and integer powers of sums.
+#
+# Terms are split into a coefficient and a dictionary of bases and their integer
+# exponents, so x*3*x^2 is 3 and {x: 3}. Expanded terms are collected in a sparse
+# accumulator keyed by those exponents, which merges like terms as soon as they're
+# created instead of letting them pile up between factors.
+#
+# Before expanding, we count how many terms the result could have. Expansions that
+# would create more than the context's max_expansion_terms are left alone, since
+# something like (x+y+z)^100 would take forever and fill up the calculator's memory.
+
+# Returns (coefficient, exponents) for a term
+def split_term(term, state):
+  coefficient = 1
+  exponents = {}
+  factors = term.factors if isinstance(term, ASTProduct) else (term,)
+  for factor in factors:
+    if isinstance(factor, ASTNumber):
+      coefficient *= factor.number
+    elif isinstance(factor, ASTPower) and factor.exponent.is_integer():
+      base = factor.base
+      exponent = int(factor.exponent.number)
+      # Fractions haven't been reduced yet when we're expanding, so 1/2 is still 1*2^-1
+      power = state.backend.power(base.number, exponent) if base.is_number() and base.number != 0 else None
+      if power != None:
+        coefficient *= power
+      else:
+        exponents[base] = exponents.get(base, 0) + exponent
+    else:
+      exponents[factor] = exponents.get(factor, 0) + 1
+  # Factors can cancel out, like y*y*y^-2
+  for base in [base for base, exponent in exponents.items() if exponent == 0]:
+    del exponents[base]
+  return coefficient, exponents
+
+def split_terms(node, state):
+  terms = node.terms if isinstance(node, ASTSum) else (node,)
+  return [split_term(term, state) for term in terms]
+
+# Returns the exponents of a*b, given the exponents of a and b
+def multiply_exponents(a, b, times=1):
+  result = dict(a)
+  for base, exponent in b.items():
+    exponent = result.get(base, 0) + exponent * times
+    if exponent == 0:
+      result.pop(base, None)
+    else:
+      result[base] = exponent
+  return result
+
+# Sorting by the bases' canonical order puts equal terms' exponents in the same order
+def exponents_key(exponents):
+  return tuple(sorted(exponents.items(), key=lambda item: item[0].sort_key()))
+
+def term_to_ast(coefficient, exponents):
+  factors = [] if coefficient == 1 else [ASTNumber(coefficient)]
+  for base, exponent in exponents.items():
+    if exponent == 1:
+      factors.append(base)
+    elif isinstance(base, ASTPower):
+      # (x^a)^n = x^(an) since n is an integer
+      factors.append(ASTPower(base.base, ASTProduct(ASTNumber(exponent), base.exponent)))
+    else:
+      factors.append(ASTPower(base, ASTNumber(exponent)))
+  if len(factors) == 0:
+    return ASTNumber(coefficient)
+  if len(factors) == 1:
+    return factors[0]
+  return ASTProduct(factors)
+
+# Collects terms, adding the coefficients of terms with the same factors
+class TermAccumulator:
+  def __init__(self):
+    self.terms = {}
+
+  def add(self, coefficient, exponents):
+    key = exponents_key(exponents)
+    entry = self.terms.get(key)
+    if entry == None:
+      self.terms[key] = [coefficient, exponents]
+    else:
+      entry[0] += coefficient
+
+  # Returns the (coefficient, exponents) pairs with non-zero coefficients
+  def items(self):
+    return [(entry[0], entry[1]) for entry in self.terms.values() if entry[0] != 0]
+
+  def to_ast(self, state):
+    terms = [term_to_ast(state.context.limit(coefficient), exponents) for coefficient, exponents in self.items()]
+    if len(terms) == 0:
+      return ZERO
+    if len(terms) == 1:
+      return terms[0]
+    return ASTSum(terms)
+
+# Merges the like terms of a sum
+def collect_terms(terms, state):
+  accumulator = TermAccumulator()
+  # Flattens any sums that came from expanding the terms
+  for term in ASTSum(terms).terms:
+    coefficient, exponents = split_term(term, state)
+    accumulator.add(coefficient, exponents)
+  return accumulator.to_ast(state)
+
+# Returns the expanded product of factors, or None if there's nothing to
+# expand or the result would have too many terms
+def expand_product(factors, state):
+  expanded_terms = 1
+  has_sum = False
+  for factor in factors:
+    if isinstance(factor, ASTSum):
+      has_sum = True
+      expanded_terms *= len(factor.terms)
+      if not state.context.can_expand(expanded_terms):
+        return None
+  if not has_sum:
+    return None
+
+  terms = [(1, {})]
+  for factor in factors:
+    accumulator = TermAccumulator()
+    factor_terms = split_terms(factor, state)
+    for coefficient, exponents in terms:
+      for factor_coefficient, factor_exponents in factor_terms:
+        accumulator.add(coefficient * factor_coefficient, multiply_exponents(exponents, factor_exponents))
+    terms = accumulator.items()
+  return accumulator.to_ast(state)
+
+# The number of ways to pick n things from k kinds with repetition,
+# which is how many terms (a_1+...+a_k)^n has before merging like terms
+def multiset_count(n, k):
+  count = 1
+  for i in range(1, k):
+    count = count * (n + i) // i
+  return count
+
+# Yields every way to write n as an ordered sum of k non-negative integers.
+# The same list is changed and yielded each time.
+def compositions(n, k):
+  counts = [0] * k
+  counts[0] = n
+  while True:
+    yield counts
+    i = k - 2
+    while i >= 0 and counts[i] == 0:
+      i -= 1
+    if i < 0:
+      return
+    # Move one from position i, and everything after it, to position i + 1
+    counts[i] -= 1
+    tail = counts[k - 1]
+    counts[k - 1] = 0
+    counts[i + 1] = tail + 1
+
+# Returns base^n expanded with the multinomial theorem, or None if
+# the result would have too many terms
+def expand_power(base, n, state):
+  terms = split_terms(base, state)
+  k = len(terms)
+  if not state.context.can_expand(multiset_count(n, k)):
+    return None
+
+  factorials = [1]
+  for i in range(1, n + 1):
+    factorials.append(factorials[-1] * i)
+  # Powers of each term's coefficient, since they're used over and over
+  coefficient_powers = []
+  for coefficient, exponents in terms:
+    powers = [1]
+    for i in range(n):
+      powers.append(powers[-1] * coefficient)
+    coefficient_powers.append(powers)
+
+  accumulator = TermAccumulator()
+  for counts in compositions(n, k):
+    coefficient = factorials[n]
+    for count in counts:
+      coefficient //= factorials[count]
+    exponents = {}
+    for i in range(k):
+      if counts[i] != 0:
+        coefficient *= coefficient_powers[i][counts[i]]
+        exponents = multiply_exponents(exponents, terms[i][1], counts[i])
+    accumulator.add(coefficient, exponents)
+  return accumulator.to_ast(state)
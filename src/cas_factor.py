@@ -0,0 +1,184 @@
+# Integer number theory used by exact rational arithmetic:
+# gcds, primality testing, and memoized prime factorization.
+
+# math.gcd is implemented in C on CPython, but Micropython doesn't have it.
+# Both versions take ints and return a non-negative result.
+try:
+  from math import gcd as int_gcd
+except ImportError:
+  def int_gcd(a, b):
+    if a < 0:
+      a = -a
+    if b < 0:
+      b = -b
+    while b:
+      a, b = b, a % b
+    return a
+
+# Micropython ints don't have bit_length
+def bit_length(n):
+  try:
+    return n.bit_length()
+  except AttributeError:
+    return len(bin(abs(n))) - 2 if n != 0 else 0
+
+# Primes below this are found with a sieve once at import time
+SMALL_PRIME_LIMIT = 1000
+
+def sieve(limit):
+  is_prime = bytearray([1]) * limit
+  is_prime[0] = 0
+  is_prime[1] = 0
+  i = 2
+  while i * i < limit:
+    if is_prime[i]:
+      for j in range(i * i, limit, i):
+        is_prime[j] = 0
+    i += 1
+  return [i for i in range(limit) if is_prime[i]]
+
+SMALL_PRIMES = sieve(SMALL_PRIME_LIMIT)
+
+# These bases make Miller-Rabin deterministic for n < 3.3 * 10^24,
+# and it's still an extremely strong probabilistic test above that.
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+def is_prime(n):
+  if n < 2:
+    return False
+  for p in SMALL_PRIMES:
+    if n % p == 0:
+      return n == p
+  if n < SMALL_PRIME_LIMIT * SMALL_PRIME_LIMIT:
+    return True
+
+  d = n - 1
+  s = 0
+  while d % 2 == 0:
+    d //= 2
+    s += 1
+  for a in MILLER_RABIN_BASES:
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+      continue
+    for _ in range(s - 1):
+      x = x * x % n
+      if x == n - 1:
+        break
+    else:
+      return False
+  return True
+
+# Finds a non-trivial factor of an odd composite n using Brent's variant
+# of Pollard's rho. Returns None in the (very unlikely) case every attempt fails.
+def pollard_rho(n):
+  for c in range(1, 32):
+    y, r, q, g = 2, 1, 1, 1
+    m = 128
+    x = ys = y
+    while g == 1:
+      x = y
+      for _ in range(r):
+        y = (y * y + c) % n
+      k = 0
+      while k < r and g == 1:
+        ys = y
+        for _ in range(min(m, r - k)):
+          y = (y * y + c) % n
+          q = q * abs(x - y) % n
+        g = int_gcd(q, n)
+        k += m
+      r *= 2
+    if g == n:
+      # The batched gcd overshot, so backtrack one step at a time
+      g = 1
+      while g == 1:
+        ys = (ys * ys + c) % n
+        g = int_gcd(abs(x - ys), n)
+    if g != n:
+      return g
+  return None
+
+# Returns the largest integer r such that r^k <= n
+def integer_root(n, k):
+  if n < 2:
+    return n
+  # Newton's method from an overestimate
+  x = 1 << ((bit_length(n) + k - 1) // k)
+  while True:
+    y = ((k - 1) * x + n // x ** (k - 1)) // k
+    if y >= x:
+      return x
+    x = y
+
+# Returns (root, k) with root^k = n and k as large as possible.
+# n must have no prime factors below SMALL_PRIME_LIMIT, so k is small.
+def perfect_power(n):
+  total = 1
+  while True:
+    found = False
+    # root >= SMALL_PRIME_LIMIT, so k can't be larger than this
+    max_k = bit_length(n) // 9
+    for k in SMALL_PRIMES:
+      if k > max_k:
+        break
+      root = integer_root(n, k)
+      if root ** k == n:
+        n = root
+        total *= k
+        found = True
+        break
+    if not found:
+      return n, total
+
+def add_factors(factors, n, multiplicity=1):
+  # n has no small prime factors here
+  if n == 1:
+    return
+  n, k = perfect_power(n)
+  multiplicity *= k
+  if is_prime(n):
+    factors[n] = factors.get(n, 0) + multiplicity
+    return
+  factor = pollard_rho(n)
+  if factor == None:
+    # Fall back to trial division; slow, but always correct
+    i = SMALL_PRIME_LIMIT + 1
+    while n % i != 0:
+      i += 2
+    factor = i
+  add_factors(factors, factor, multiplicity)
+  add_factors(factors, n // factor, multiplicity)
+
+# Factorizations are cached since the same numbers come up repeatedly while simplifying.
+# The cache is simply cleared when it fills up, which keeps memory bounded on calculators.
+FACTOR_CACHE_SIZE = 256
+_factor_cache = {}
+
+# Returns a dictionary of prime factors and their exponents
+def prime_factors(n):
+  n = abs(n)
+  if n in _factor_cache:
+    return dict(_factor_cache[n])
+
+  factors = {}
+  remaining = n
+  for p in SMALL_PRIMES:
+    if p * p > remaining:
+      break
+    if remaining % p == 0:
+      count = 0
+      while remaining % p == 0:
+        remaining //= p
+        count += 1
+      factors[p] = count
+  if remaining > 1:
+    if remaining < SMALL_PRIME_LIMIT * SMALL_PRIME_LIMIT:
+      factors[remaining] = factors.get(remaining, 0) + 1
+    else:
+      add_factors(factors, remaining)
+
+  if len(_factor_cache) >= FACTOR_CACHE_SIZE:
+    _factor_cache.clear()
+  _factor_cache[n] = factors
+  return dict(factors)
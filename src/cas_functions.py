@@ -1,368 +1,563 @@
 from cas_ast import *
 from math import sin, cos, tan, asin, acos, atan
+try:
+  from math import sinh, cosh, tanh, asinh, acosh, atanh
+except ImportError:
+  # Some Micropython builds leave out the hyperbolic functions
+  from math import exp, log, sqrt
+  def sinh(x):
+    return (exp(x) - exp(-x)) / 2
+  def cosh(x):
+    return (exp(x) + exp(-x)) / 2
+  def tanh(x):
+    return 1 - 2 / (exp(2 * x) + 1)
+  def asinh(x):
+    return log(x + sqrt(x * x + 1))
+  def acosh(x):
+    return log(x + sqrt(x * x - 1))
+  def atanh(x):
+    return log((1 + x) / (1 - x)) / 2
 
+# Each function is a subclass of ASTFunctionCall with its name, and a FunctionDefinition
+# (see below) that says how to evaluate, differentiate and simplify it.
 class ASTFunctionCall(ASTNode):
+  __slots__ = ("argument", "depth", "constant", "hash_value", "sort_value")
+  # The name is a class attribute, so two calls are equal when their types and arguments are
+  fields = ("argument",)
   name = "generic_function"
+  # Set by register_function
+  definition = None
   precidence = 0
+  sort_rank = 4
   def __init__(self, argument):
     if type(self) == ASTFunctionCall:
       raise Exception("Cannot create an instance of ASTFunctionCall. Use a subclass or ASTFunctionCall.create() instead.")
     
-    self.name = type(self).name
     self.argument = argument
+    self.depth = argument.depth + 1
+    self.constant = argument.constant
+    self.hash_value = None
+    self.sort_value = None
   
   # This isn't guarenteed to return an ASTFunctionCall instance! Some functions, like sqrt, return non-function ASTNodes.
+  # Those are created by helper functions, which also take the EngineContext to use.
   @staticmethod
-  def create(name, argument):
+  def create(name, argument, context=None):
     if name not in function_names:
       raise Exception("Function " + name + " doesn't exist.")
-    return function_names[name](argument)
+    creator = function_names[name]
+    if isinstance(creator, type):
+      return creator(argument)
+    return creator(argument, context)
   
-  def pretty_str(self, precidence):
-    return self.name + "(" + self.argument.pretty_str(100) + ")"
+  def children(self):
+    return (self.argument,)
+  def with_children(self, children):
+    return type(self)(children[0])
+  
+  # Different functions have the same rank, so they're told apart by name
+  def sort_key_with(self, keys):
+    self.sort_value = (self.sort_rank, self.name, self.depth, keys[0])
+    return self.sort_value
+  
+  def pretty_tokens(self):
+    return (self.name + "(", (self.argument, 100), ")")
   def __str__(self):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return str_iteratively(self)
     return self.name + "(" + str(self.argument) + ")"
+  def str_with(self, strings):
+    return self.name + "(" + strings[0] + ")"
   
-  def reduce(self, state):
-    return ASTFunctionCall.create(self.name, self.argument.reduce(state.after(self)))
-  def distribute(self, state):
-    return ASTFunctionCall.create(self.name, self.argument.distribute(state.after(self)))
-
-  def traverse(self, func):
-    self.argument.traverse(func)
-    func(self)
+  def reduce_with(self, state, children):
+    value = self.definition.reduce(children[0], state.context)
+    if value != None:
+      return value
+    return self.rebuild(children)
 
-  def substitute(self, var, value):
-    return ASTFunctionCall.create(self.name, self.argument.substitute(var, value))
-  def eval(self):
-    raise Exception("Evaluation for function " + self.name + " is not implemented.")
-  def derivative_f(self):
-    raise Exception("Derivative for function " + self.name + " is not implemented.")
-  def derivative(self, var):
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
+    return self.definition.kernel(self.argument.eval(context))
+  def eval_with(self, values, context):
+    return self.definition.kernel(values[0])
+  # Exact values come from the definition, and everything else is left as a call
+  def exact_eval_with(self, values, context, results):
+    argument = result_node(results[0])
+    value = self.definition.reduce(argument, context)
+    if value == None:
+      return self.rebuild([argument])
+    return value.number if isinstance(value, ASTNumber) else value
+  # The derivative of the function itself, at the argument
+  def derivative_f(self, context):
+    return self.definition.derivative(self.argument, context)
+  def derivative_with(self, var, context, derivatives):
     return ASTProduct(
-      self.derivative_f(),
-      self.argument.derivative(var)
-    ).simplify()
+      self.derivative_f(context),
+      derivatives[0]
+    ).simplify(context=context)
+
+# Exact values of the trig functions between 0 and π/2, by angle in twelfths of π, so
+# multiples of π/6 and π/4 are covered. A value (a, b, r) is a/b*sqrt(r), and a
+# denominator of 0 means the function is undefined there.
+TRIG_VALUES = {
+  # At 0, π/6, π/4, π/3 and π/2
+  "sin": {0: (0, 1, 1), 2: (1, 2, 1), 3: (1, 2, 2), 4: (1, 2, 3), 6: (1, 1, 1)},
+  "cos": {0: (1, 1, 1), 2: (1, 2, 3), 3: (1, 2, 2), 4: (1, 2, 1), 6: (0, 1, 1)},
+  "tan": {0: (0, 1, 1), 2: (1, 3, 3), 3: (1, 1, 1), 4: (1, 1, 3), 6: (1, 0, 1)},
+  "csc": {0: (1, 0, 1), 2: (2, 1, 1), 3: (1, 1, 2), 4: (2, 3, 3), 6: (1, 1, 1)},
+  "sec": {0: (1, 1, 1), 2: (2, 3, 3), 3: (1, 1, 2), 4: (2, 1, 1), 6: (1, 0, 1)},
+  "cot": {0: (1, 0, 1), 2: (1, 1, 3), 3: (1, 1, 1), 4: (1, 3, 3), 6: (0, 1, 1)},
+}
+# The sign of each function in each quadrant
+TRIG_SIGNS = {
+  "sin": (1, 1, -1, -1),
+  "cos": (1, -1, -1, 1),
+  "tan": (1, -1, 1, -1),
+  "csc": (1, 1, -1, -1),
+  "sec": (1, -1, -1, 1),
+  "cot": (1, -1, 1, -1),
+}
+
+# Returns the number that node is a multiple of π by, or None if it isn't a number times π.
+# The number can be anywhere in a product, like π*(2/3).
+def pi_multiple(node):
+  if node.is_exactly(0):
+    return 0
+  if isinstance(node, ASTPi):
+    return 1
+  if not isinstance(node, ASTProduct):
+    return None
+  coefficient = 1
+  has_pi = False
+  for factor in node.factors:
+    if isinstance(factor, ASTPi) and not has_pi:
+      has_pi = True
+    elif factor.is_number():
+      coefficient *= factor.number
+    else:
+      return None
+  return coefficient if has_pi else None
+
+# Returns node's angle in twelfths of π, between 0 and 2π, or None if it isn't a whole number of them
+def trig_angle(node):
+  coefficient = pi_multiple(node)
+  if coefficient == None:
+    return None
+  twelfths = coefficient * 12
+  if twelfths != int(twelfths):
+    return None
+  return int(twelfths) % 24
+
+# Returns the exact value of the trig function with the given name at node, or None if it doesn't have one
+def exact_trig_value(name, node, context):
+  angle = trig_angle(node)
+  if angle == None:
+    return None
+  # The angle in the first quadrant with the same value, up to sign
+  quadrant = angle // 6
+  reference = (angle, 12 - angle, angle - 12, 24 - angle)[quadrant]
+  value = TRIG_VALUES[name].get(reference)
+  if value == None:
+    return None
+  numerator, denominator, radicand = value
+  if denominator == 0:
+    # TODO: This is undefined. We should return a special value for this
+    # and at least warn the user.
+    return ZERO
+  numerator *= TRIG_SIGNS[name][quadrant]
+  if radicand != 1 and numerator != 0 and not context.exact:
+    # Surds aren't kept with floats, so the value is folded into one number
+    return ASTNumber(numerator / denominator * radicand ** 0.5)
+  coefficient = ASTFraction(numerator, denominator, context)
+  if radicand == 1 or numerator == 0:
+    return coefficient
+  surd = ASTPower(ASTNumber(radicand), ASTFraction(1, 2, context))
+  if coefficient.is_exactly(1):
+    return surd
+  return ASTProduct(coefficient, surd)
+
+# Returns numerator/denominator*constant as a node, where constant is ONE or PI
+def exact_multiple(numerator, denominator, constant, context):
+  if constant is ONE or numerator == 0:
+    return ASTFraction(numerator, denominator, context)
+  if numerator == denominator:
+    return constant
+  return ASTProduct(constant, ASTFraction(numerator, denominator, context))
+
+# Everything the engine needs to know about a function, in one place.
+# function: the function's ASTFunctionCall subclass
+# kernel: evaluates the function at a float
+# derivative: returns the function's derivative at argument, given argument and the context
+# values: a dictionary of exact values, from numbers to (numerator, denominator, constant)
+#   for numerator/denominator*constant, where constant is ONE or PI
+# domain: returns whether a number is in the function's domain
+# aliases: other names the function can be called by
+class FunctionDefinition:
+  def __init__(self, function, kernel, derivative, values=None, domain=None, aliases=()):
+    self.function = function
+    self.name = function.name
+    self.kernel = kernel
+    self.derivative = derivative
+    self.values = values if values != None else {}
+    self.domain = domain
+    self.aliases = aliases
   
-  def is_constant(self):
-    return self.argument.is_constant()
+  # Returns the exact value of the function at a reduced argument, or None if it doesn't have one
+  def reduce(self, argument, context):
+    if not argument.is_number():
+      return None
+    if self.domain != None and not self.domain(argument.number):
+      # TODO: This is undefined. We should return a special value for this
+      # and at least warn the user.
+      return ZERO
+    value = self.values.get(argument.number)
+    if value == None:
+      return None
+    return exact_multiple(value[0], value[1], value[2], context)
 
+# Trig functions' exact values come from the table above instead, since they depend on multiples of π
+class TrigFunctionDefinition(FunctionDefinition):
+  def reduce(self, argument, context):
+    return exact_trig_value(self.name, argument, context)
 
 class FunctionSin(ASTFunctionCall):
+  __slots__ = ()
   name = "sin"
-  def eval(self):
-    return sin(self.argument.eval())
-  def derivative_f(self): # d/dx sin(x) = cos(x)
-    return FunctionCos(self.argument)
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(2):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(4):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(6):
-      return ASTNumber(-1)
-    return FunctionSin(arg)
 
 class FunctionCos(ASTFunctionCall):
+  __slots__ = ()
   name = "cos"
-  def eval(self):
-    return cos(self.argument.eval())
-  def derivative_f(self): # d/dx cos(x) = -sin(x)
-    return ASTProduct(ASTNumber(-1), FunctionSin(self.argument))
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(2):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(4):
-      return ASTNumber(-1)
-    if arg.is_2pi_multiple(6):
-      return ASTNumber(0)
-    return FunctionCos(arg)
 
 class FunctionTan(ASTFunctionCall):
+  __slots__ = ()
   name = "tan"
-  def eval(self):
-    return tan(self.argument.eval())
-  def derivative_f(self): # d/dx tan(x) = sec(x)^2
-    return ASTProduct(FunctionSec(self.argument), FunctionSec(self.argument))
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(1):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(2):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(3):
-      return ASTNumber(-1)
-    if arg.is_2pi_multiple(4):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(5):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(6):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(7):
-      return ASTNumber(-1)
-    return FunctionTan(arg)
 
 class FunctionCsc(ASTFunctionCall):
+  __slots__ = ()
   name = "csc"
-  def eval(self):
-    return 1 / sin(self.argument.eval())
-  def derivative_f(self): # d/dx csc(x) = -csc(x)*cot(x)
-    return ASTProduct(
-      ASTNumber(-1),
-      FunctionCsc(self.argument),
-      FunctionCot(self.argument)
-    )
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(2):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(4):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(6):
-      return ASTNumber(-1)
-    return FunctionCsc(arg)
 
 class FunctionSec(ASTFunctionCall):
+  __slots__ = ()
   name = "sec"
-  def eval(self):
-    return 1 / cos(self.argument.eval())
-  def derivative_f(self): # d/dx sec(x) = sec(x)*tan(x)
-    return ASTProduct(FunctionSec(self.argument), FunctionTan(self.argument))
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(2):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(4):
-      return ASTNumber(-1)
-    if arg.is_2pi_multiple(6):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    return FunctionSec(arg)
 
 class FunctionCot(ASTFunctionCall):
+  __slots__ = ()
   name = "cot"
-  def eval(self):
-    return 1 / tan(self.argument.eval())
-  def derivative_f(self): # d/dx cot(x) = -csc(x)^2
-    return ASTProduct(
-      ASTNumber(-1),
-      FunctionCsc(self.argument),
-      FunctionCsc(self.argument)
-    )
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_2pi_multiple(0):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(1):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(2):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(3):
-      return ASTNumber(-1)
-    if arg.is_2pi_multiple(4):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(5):
-      return ASTNumber(1)
-    if arg.is_2pi_multiple(6):
-      return ASTNumber(0)
-    if arg.is_2pi_multiple(7):
-      return ASTNumber(-1)
-    return FunctionCot(arg)
 
 class FunctionArcSin(ASTFunctionCall):
+  __slots__ = ()
   name = "arcsin"
-  def eval(self):
-    return asin(self.argument.eval())
-  def derivative_f(self): # d/dx arcsin(x) = 1 / sqrt(1 - x^2) = (1 - x^2)^(-1/2)
-    return ASTPower(
-      ASTSum.subtract(
-        ASTNumber(1),
-        ASTPower(self.argument, ASTNumber(2))
-      ),
-      ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5)
-    )
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_number() and (arg.number < -1 or arg.number > 1):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_exactly(0):
-      return ASTNumber(0)
-    if arg.is_exactly(1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 2) if cas_settings.USE_RATIONALS else 0.5))
-    if arg.is_exactly(-1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5))
-    return FunctionArcSin(arg)
 
 class FunctionArcCos(ASTFunctionCall):
+  __slots__ = ()
   name = "arccos"
-  def eval(self):
-    return acos(self.argument.eval())
-  def derivative_f(self): # d/dx arccos(x) = -1 / sqrt(1 - x^2) = -(1 - x^2)^(-1/2)
-    return ASTPower(
-      ASTSum.subtract(
-        ASTNumber(1),
-        ASTPower(self.argument, ASTNumber(2))
-      ),
-      ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5)
-    ).negate()
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_number() and (arg.number < -1 or arg.number > 1):
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_exactly(0):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 2) if cas_settings.USE_RATIONALS else 0.5))
-    if arg.is_exactly(1):
-      return ASTNumber(0)
-    if arg.is_exactly(-1):
-      return ASTPi()
-    return FunctionArcCos(arg)
 
 class FunctionArcTan(ASTFunctionCall):
+  __slots__ = ()
   name = "arctan"
-  def eval(self):
-    return atan(self.argument.eval())
-  def derivative_f(self): # d/dx arctan(x) = 1 / (1 + x^2) = (1 + x^2)^(-1)
-    return ASTPower(
-      ASTSum(
-        ASTNumber(1),
-        ASTPower(self.argument, ASTNumber(2))
-      ),
-      ASTNumber(-1)
-    )
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_exactly(0):
-      return ASTNumber(1)
-    if arg.is_exactly(1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 4) if cas_settings.USE_RATIONALS else 0.25))
-    if arg.is_exactly(-1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(-1, 4) if cas_settings.USE_RATIONALS else -0.25))
-    return FunctionArcTan(arg)
 
 class FunctionArcCsc(ASTFunctionCall):
+  __slots__ = ()
   name = "arccsc"
-  def eval(self):
-    return asin(1 / self.argument.eval())
-  def derivative_f(self): # d/dx arccsc(x) = -(1 - x^2)^(-0.5) / x^2
-    return ASTProduct.divide(
-      ASTPower(
-        ASTSum.subtract(ASTNumber(1), ASTPower(self.argument, ASTNumber(2))),
-        ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5)
-      ),
-      ASTPower(self.argument, ASTNumber(2))
-    ).negate()
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_number() and arg.number > -1 and arg.number < 1:
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_exactly(1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 2) if cas_settings.USE_RATIONALS else 0.5))
-    if arg.is_exactly(-1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5))
-    return FunctionArcCsc(arg)
 
 class FunctionArcSec(ASTFunctionCall):
+  __slots__ = ()
   name = "arcsec"
-  def eval(self):
-    return acos(1 / self.argument.eval())
-  def derivative_f(self): # d/dx arcsec(x) = (x^4 - x^2)^(-0.5)
-    return ASTPower(
-      ASTSum.subtract(
-        ASTPower(self.argument, ASTNumber(4)),
-        ASTPower(self.argument, ASTNumber(2))
-      ),
-      ASTNumber(Rational(-1, 2) if cas_settings.USE_RATIONALS else -0.5)
-    )
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_number() and arg.number > -1 and arg.number < 1:
-      # TODO: This is undefined. We should return a special value for this
-      # and at least warn the user.
-      return ASTNumber(0)
-    if arg.is_exactly(1):
-      return ASTNumber(0)
-    if arg.is_exactly(-1):
-      return ASTPi()
-    return FunctionArcSec(arg)
 
 class FunctionArcCot(ASTFunctionCall):
+  __slots__ = ()
   name = "arccot"
-  def eval(self):
-    return atan(1 / self.argument.eval())
-  def derivative_f(self): # d/dx arccot(x) = -(1 + x^2)^(-1)
-    return ASTPower(
-      ASTSum(ASTNumber(1), ASTPower(self.argument, ASTNumber(2))),
-      ASTNumber(-1)
-    ).negate()
-  def reduce(self, state):
-    arg = self.argument.reduce(state.after(self))
-    if arg.is_exactly(0):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 2) if cas_settings.USE_RATIONALS else 0.5))
-    if arg.is_exactly(1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(1, 4) if cas_settings.USE_RATIONALS else 0.25))
-    if arg.is_exactly(-1):
-      return ASTProduct(ASTPi(), ASTNumber(Rational(3, 4) if cas_settings.USE_RATIONALS else 0.75))
-    return FunctionArcCot(arg)
 
-function_names = {
-  "sin": FunctionSin,
-  "cos": FunctionCos,
-  "tan": FunctionTan,
-  "csc": FunctionCsc,
-  "sec": FunctionSec,
-  "cot": FunctionCot,
+class FunctionSinh(ASTFunctionCall):
+  __slots__ = ()
+  name = "sinh"
+
+class FunctionCosh(ASTFunctionCall):
+  __slots__ = ()
+  name = "cosh"
+
+class FunctionTanh(ASTFunctionCall):
+  __slots__ = ()
+  name = "tanh"
+
+class FunctionCsch(ASTFunctionCall):
+  __slots__ = ()
+  name = "csch"
+
+class FunctionSech(ASTFunctionCall):
+  __slots__ = ()
+  name = "sech"
+
+class FunctionCoth(ASTFunctionCall):
+  __slots__ = ()
+  name = "coth"
+
+class FunctionArcSinh(ASTFunctionCall):
+  __slots__ = ()
+  name = "arcsinh"
+
+class FunctionArcCosh(ASTFunctionCall):
+  __slots__ = ()
+  name = "arccosh"
+
+class FunctionArcTanh(ASTFunctionCall):
+  __slots__ = ()
+  name = "arctanh"
+
+class FunctionArcCsch(ASTFunctionCall):
+  __slots__ = ()
+  name = "arccsch"
+
+class FunctionArcSech(ASTFunctionCall):
+  __slots__ = ()
+  name = "arcsech"
+
+class FunctionArcCoth(ASTFunctionCall):
+  __slots__ = ()
+  name = "arccoth"
+
+
+# Returns (1 ± argument^2)^(-1/2), which a lot of the inverse functions' derivatives have in them
+def inverse_root(argument, sign, context):
+  square = ASTPower(argument, TWO)
+  return ASTPower(
+    ASTSum(ONE, square if sign > 0 else square.negate()),
+    ASTFraction(-1, 2, context)
+  )
+
+# Returns (argument^4 - argument^2)^(-1/2), which is 1 / (|x|sqrt(x^2 - 1))
+def quartic_root(argument, context):
+  return ASTPower(
+    ASTSum.subtract(ASTPower(argument, ASTNumber(4)), ASTPower(argument, TWO)),
+    ASTFraction(-1, 2, context)
+  )
+
+FUNCTIONS = (
+  TrigFunctionDefinition(FunctionSin, sin,
+    # d/dx sin(x) = cos(x)
+    lambda u, context: FunctionCos(u)),
+  TrigFunctionDefinition(FunctionCos, cos,
+    # d/dx cos(x) = -sin(x)
+    lambda u, context: ASTProduct(NEG_ONE, FunctionSin(u))),
+  TrigFunctionDefinition(FunctionTan, tan,
+    # d/dx tan(x) = sec(x)^2
+    lambda u, context: ASTProduct(FunctionSec(u), FunctionSec(u))),
+  TrigFunctionDefinition(FunctionCsc, lambda x: 1 / sin(x),
+    # d/dx csc(x) = -csc(x)*cot(x)
+    lambda u, context: ASTProduct(NEG_ONE, FunctionCsc(u), FunctionCot(u))),
+  TrigFunctionDefinition(FunctionSec, lambda x: 1 / cos(x),
+    # d/dx sec(x) = sec(x)*tan(x)
+    lambda u, context: ASTProduct(FunctionSec(u), FunctionTan(u))),
+  TrigFunctionDefinition(FunctionCot, lambda x: 1 / tan(x),
+    # d/dx cot(x) = -csc(x)^2
+    lambda u, context: ASTProduct(NEG_ONE, FunctionCsc(u), FunctionCsc(u))),
+  
+  FunctionDefinition(FunctionArcSin, asin,
+    # d/dx arcsin(x) = 1 / sqrt(1 - x^2) = (1 - x^2)^(-1/2)
+    lambda u, context: inverse_root(u, -1, context),
+    values={0: (0, 1, ONE), 1: (1, 2, PI), -1: (-1, 2, PI)},
+    domain=lambda x: -1 <= x <= 1, aliases=("asin",)),
+  FunctionDefinition(FunctionArcCos, acos,
+    # d/dx arccos(x) = -1 / sqrt(1 - x^2) = -(1 - x^2)^(-1/2)
+    lambda u, context: inverse_root(u, -1, context).negate(),
+    values={0: (1, 2, PI), 1: (0, 1, ONE), -1: (1, 1, PI)},
+    domain=lambda x: -1 <= x <= 1, aliases=("acos",)),
+  FunctionDefinition(FunctionArcTan, atan,
+    # d/dx arctan(x) = 1 / (1 + x^2) = (1 + x^2)^(-1)
+    lambda u, context: ASTPower(ASTSum(ONE, ASTPower(u, TWO)), NEG_ONE),
+    values={0: (0, 1, ONE), 1: (1, 4, PI), -1: (-1, 4, PI)},
+    aliases=("atan",)),
+  FunctionDefinition(FunctionArcCsc, lambda x: asin(1 / x),
+    # d/dx arccsc(x) = -(x^4 - x^2)^(-0.5)
+    lambda u, context: quartic_root(u, context).negate(),
+    values={1: (1, 2, PI), -1: (-1, 2, PI)},
+    domain=lambda x: x <= -1 or x >= 1, aliases=("acsc",)),
+  FunctionDefinition(FunctionArcSec, lambda x: acos(1 / x),
+    # d/dx arcsec(x) = (x^4 - x^2)^(-0.5)
+    lambda u, context: quartic_root(u, context),
+    values={1: (0, 1, ONE), -1: (1, 1, PI)},
+    domain=lambda x: x <= -1 or x >= 1, aliases=("asec",)),
+  FunctionDefinition(FunctionArcCot, lambda x: atan(1 / x),
+    # d/dx arccot(x) = -(1 + x^2)^(-1)
+    lambda u, context: ASTPower(ASTSum(ONE, ASTPower(u, TWO)), NEG_ONE).negate(),
+    values={0: (1, 2, PI), 1: (1, 4, PI), -1: (3, 4, PI)},
+    aliases=("acot",)),
   
-  "arcsin": FunctionArcSin,
-  "arccos": FunctionArcCos,
-  "arctan": FunctionArcTan,
-  "arccsc": FunctionArcCsc,
-  "arcsec": FunctionArcSec,
-  "arccot": FunctionArcCot,
-  "asin": FunctionArcSin,
-  "acos": FunctionArcCos,
-  "atan": FunctionArcTan,
-  "acsc": FunctionArcCsc,
-  "asec": FunctionArcSec,
-  "acot": FunctionArcCot,
+  FunctionDefinition(FunctionSinh, sinh,
+    # d/dx sinh(x) = cosh(x)
+    lambda u, context: FunctionCosh(u),
+    values={0: (0, 1, ONE)}),
+  FunctionDefinition(FunctionCosh, cosh,
+    # d/dx cosh(x) = sinh(x)
+    lambda u, context: FunctionSinh(u),
+    values={0: (1, 1, ONE)}),
+  FunctionDefinition(FunctionTanh, tanh,
+    # d/dx tanh(x) = sech(x)^2
+    lambda u, context: ASTProduct(FunctionSech(u), FunctionSech(u)),
+    values={0: (0, 1, ONE)}),
+  FunctionDefinition(FunctionCsch, lambda x: 1 / sinh(x),
+    # d/dx csch(x) = -csch(x)*coth(x)
+    lambda u, context: ASTProduct(NEG_ONE, FunctionCsch(u), FunctionCoth(u)),
+    domain=lambda x: x != 0),
+  FunctionDefinition(FunctionSech, lambda x: 1 / cosh(x),
+    # d/dx sech(x) = -sech(x)*tanh(x)
+    lambda u, context: ASTProduct(NEG_ONE, FunctionSech(u), FunctionTanh(u)),
+    values={0: (1, 1, ONE)}),
+  FunctionDefinition(FunctionCoth, lambda x: 1 / tanh(x),
+    # d/dx coth(x) = -csch(x)^2
+    lambda u, context: ASTProduct(NEG_ONE, FunctionCsch(u), FunctionCsch(u)),
+    domain=lambda x: x != 0),
   
-  "sqrt": lambda arg: ASTPower(arg, ASTNumber(Rational(1, 2) if cas_settings.USE_RATIONALS else 0.5)),
-  "cbrt": lambda arg: ASTPower(arg, ASTNumber(Rational(1, 3) if cas_settings.USE_RATIONALS else 1/3)),
+  FunctionDefinition(FunctionArcSinh, asinh,
+    # d/dx arcsinh(x) = (1 + x^2)^(-1/2)
+    lambda u, context: inverse_root(u, 1, context),
+    values={0: (0, 1, ONE)}, aliases=("asinh",)),
+  FunctionDefinition(FunctionArcCosh, acosh,
+    # d/dx arccosh(x) = (x^2 - 1)^(-1/2)
+    lambda u, context: ASTPower(ASTSum(ASTPower(u, TWO), NEG_ONE), ASTFraction(-1, 2, context)),
+    values={1: (0, 1, ONE)}, domain=lambda x: x >= 1, aliases=("acosh",)),
+  FunctionDefinition(FunctionArcTanh, atanh,
+    # d/dx arctanh(x) = (1 - x^2)^(-1)
+    lambda u, context: ASTPower(ASTSum.subtract(ONE, ASTPower(u, TWO)), NEG_ONE),
+    values={0: (0, 1, ONE)}, domain=lambda x: -1 < x < 1, aliases=("atanh",)),
+  FunctionDefinition(FunctionArcCsch, lambda x: asinh(1 / x),
+    # d/dx arccsch(x) = -x^-2 * (1 + x^-2)^(-1/2)
+    lambda u, context: ASTProduct(
+      NEG_ONE,
+      ASTPower(u, ASTNumber(-2)),
+      ASTPower(ASTSum(ONE, ASTPower(u, ASTNumber(-2))), ASTFraction(-1, 2, context))
+    ),
+    domain=lambda x: x != 0, aliases=("acsch",)),
+  FunctionDefinition(FunctionArcSech, lambda x: acosh(1 / x),
+    # d/dx arcsech(x) = -x^-1 * (1 - x^2)^(-1/2)
+    lambda u, context: ASTProduct(NEG_ONE, ASTPower(u, NEG_ONE), inverse_root(u, -1, context)),
+    values={1: (0, 1, ONE)}, domain=lambda x: 0 < x <= 1, aliases=("asech",)),
+  FunctionDefinition(FunctionArcCoth, lambda x: atanh(1 / x),
+    # d/dx arccoth(x) = (1 - x^2)^(-1)
+    lambda u, context: ASTPower(ASTSum.subtract(ONE, ASTPower(u, TWO)), NEG_ONE),
+    domain=lambda x: x < -1 or x > 1, aliases=("acoth",)),
+)
+
+# A function defined by the user, like f(x) = x^2*sin(x). Calls are ASTUserFunctionCalls.
+# The body is simplified, differentiated and compiled for evaluation once for each
+# context (and set of simplify options) it's used with, and calls reuse those, so
+# calling a function a lot doesn't redo any work on its body.
+class UserFunction:
+  def __init__(self, name, parameter, body):
+    self.name = name
+    self.parameter = parameter
+    self.body = body
+    # Variables in the body other than the parameter, which calls depend on too
+    variables = body.get_variables()
+    variables.discard(parameter)
+    self.outer_variables = tuple(variables)
+    self.simplified = {}
+    self.derivatives = {}
+    self.compiled = {}
+  
+  def __str__(self):
+    return self.name + "(" + self.parameter + ") = " + self.body.pretty_str(100)
+  
+  # Returns the body with argument in place of the parameter, without simplifying it
+  def substitute(self, argument):
+    if isinstance(argument, ASTVariable) and argument.name == self.parameter:
+      return self.body
+    return self.body.substitute(self.parameter, argument)
+  
+  # Returns the function's value at a reduced argument, simplified with state's options
+  def inline(self, argument, state):
+    key = (state.context, state.sort_terms, state.expand_logarithms, state.expand)
+    body = self.simplified.get(key)
+    if body == None:
+      body = self.body.simplify(state.sort_terms, state.expand_logarithms, state.context, state.expand)
+      self.simplified[key] = body
+    if isinstance(argument, ASTVariable) and argument.name == self.parameter:
+      return body
+    return state.reduce(state.distribute(body.substitute(self.parameter, argument)))
+  
+  # Returns the derivative of the body with respect to the parameter
+  def derivative(self, context):
+    context = get_context(context)
+    derivative = self.derivatives.get(context)
+    if derivative == None:
+      derivative = self.body.derivative(self.parameter, context)
+      self.derivatives[context] = derivative
+    return derivative
+  
+  def evaluate(self, value, context):
+    context = get_context(context)
+    compiled = self.compiled.get(context)
+    if compiled == None:
+      from cas_compile import CompiledExpression
+      compiled = CompiledExpression(self.body, (self.parameter,), context)
+      self.compiled[context] = compiled
+    return compiled(value)
+
+class ASTUserFunctionCall(ASTFunctionCall):
+  __slots__ = ("function",)
+  # Calls to different functions with the same argument aren't equal
+  fields = ("function", "argument")
+  def __init__(self, function, argument):
+    self.function = function
+    ASTFunctionCall.__init__(self, argument)
+    self.constant = argument.constant and len(function.outer_variables) == 0
+  
+  @property
+  def name(self):
+    return self.function.name
+  @property
+  def outer_variables(self):
+    return self.function.outer_variables
+  
+  def with_children(self, children):
+    return ASTUserFunctionCall(self.function, children[0])
+  
+  def substitute(self, var, value):
+    if var in self.function.outer_variables:
+      # The variable is in the body, so the call has to be replaced with it
+      return self.function.substitute(self.argument).substitute(var, value)
+    return ASTFunctionCall.substitute(self, var, value)
+  
+  # Simplifying replaces calls with the function's simplified body
+  def reduce_with(self, state, children):
+    return self.function.inline(children[0], state)
+  
+  def eval(self, context=None):
+    if self.depth > MAX_RECURSION_DEPTH:
+      return eval_iteratively(self, context)
+    return self.function.evaluate(self.argument.eval(context), context)
+  def eval_with(self, values, context):
+    return self.function.evaluate(values[0], context)
+  # Evaluates the body with the argument's result as the parameter's value
+  def exact_eval_with(self, values, context, results):
+    values = dict(values)
+    values[self.function.parameter] = results[0]
+    return exact_eval_raw(self.function.body, values, context)
+  def derivative_f(self, context):
+    return self.function.derivative(context).substitute(self.function.parameter, self.argument)
+  def derivative_with(self, var, context, derivatives):
+    if len(self.function.outer_variables) > 0:
+      # The body depends on var directly too, not just through the argument
+      return self.function.substitute(self.argument).derivative(var, context)
+    return ASTFunctionCall.derivative_with(self, var, context, derivatives)
+
+function_names = {
+  "sqrt": lambda arg, context=None: ASTPower(arg, ASTFraction(1, 2, context)),
+  "cbrt": lambda arg, context=None: ASTPower(arg, ASTFraction(1, 3, context)),
   
   # Log functions with specified bases are handled when parsing,
   # but generic log functions are handled here.
-  "log": lambda arg: ASTLogarithm(ASTNumber(10), arg),
-  "ln": lambda arg: ASTLogarithm(ASTEuler(), arg),
-}
\ No newline at end of file
+  "log": lambda arg, context=None: ASTLogarithm(ASTNumber(10), arg),
+  "ln": lambda arg, context=None: ASTLogarithm(EULER, arg),
+}
+
+# Makes a function callable by its name and aliases
+def register_function(definition):
+  definition.function.definition = definition
+  function_names[definition.name] = definition.function
+  for alias in definition.aliases:
+    function_names[alias] = definition.function
+
+for definition in FUNCTIONS:
+  register_function(definition)
@@ -0,0 +1,202 @@
+import cas_settings
+from cas_rational import Rational, make_rational, exact_divide, exact_power, exact_rational_log, gcd, numerator, denominator
+from cas_factor import bit_length
+from math import log
+
+# Micropython's float implementation unfortunately
+# doesn't fall back to the __float__ magic method.
+# This is a workaround for that.
+def to_float(obj):
+  try:
+    return float(obj)
+  except:
+    return obj.__float__()
+
+# Number backends decide how numbers are represented while parsing and simplifying.
+# Everything that creates or combines numbers exactly goes through a backend
+# instead of checking cas_settings.USE_RATIONALS, so the representation can be
+# picked per call with an EngineContext.
+#
+# Whatever the backend, whole numbers are stored as plain ints (see ASTNumber),
+# so backends only differ in how they represent fractions.
+
+# Whether a number from any backend is exact; floats (and gmpy2's mpfr) aren't
+def is_exact_number(number):
+  return isinstance(number, int) or hasattr(number, "denominator")
+
+# The number of bits in the larger of an exact number's numerator and denominator.
+# Floats are always considered small.
+def coefficient_bits(number):
+  if isinstance(number, int):
+    return bit_length(number)
+  if not hasattr(number, "denominator"):
+    return 0
+  return max(bit_length(int(numerator(number))), bit_length(int(denominator(number))))
+
+class NumberBackend:
+  name = "generic"
+  # Whether numbers are represented exactly. Inexact backends never return None
+  # from power or log, since a floating point result is always available.
+  exact = True
+
+  # Returns numerator/denominator, where both are ints
+  def fraction(self, numerator, denominator=1):
+    raise Exception("Implement me!")
+  # Converts an int, float, or fraction from any backend into this backend's representation
+  def convert(self, number):
+    if isinstance(number, int):
+      return number
+    if isinstance(number, float):
+      n, d = number.as_integer_ratio()
+      return self.fraction(n, d)
+    return self.fraction(int(numerator(number)), int(denominator(number)))
+  def divide(self, a, b):
+    raise Exception("Implement me!")
+  # Returns base^exponent, or None if it can't be represented exactly
+  def power(self, base, exponent):
+    raise Exception("Implement me!")
+  # Returns the logarithm of x to the base of base, or None if it can't be represented exactly
+  def log(self, x, base):
+    x = make_rational(int(numerator(x)), int(denominator(x)))
+    base = make_rational(int(numerator(base)), int(denominator(base)))
+    result = exact_rational_log(x, base)
+    return None if result == None else self.convert(result)
+  # Returns the greatest common divisor of a list of whole numbers
+  def gcd(self, values):
+    return gcd(values)
+  def to_float(self, number):
+    return to_float(number)
+
+# Our own pure-Python rationals; these work everywhere, including on calculators.
+class RationalBackend(NumberBackend):
+  name = "rational"
+  def fraction(self, numerator, denominator=1):
+    return make_rational(numerator, denominator)
+  def convert(self, number):
+    if isinstance(number, Rational) or isinstance(number, int):
+      return number
+    return NumberBackend.convert(self, number)
+  def divide(self, a, b):
+    return exact_divide(a, b)
+  def power(self, base, exponent):
+    return exact_power(base, exponent)
+  def log(self, x, base):
+    return exact_rational_log(x, base)
+
+# Floating point numbers; fast, but results aren't exact.
+class FloatBackend(NumberBackend):
+  name = "float"
+  exact = False
+  def fraction(self, numerator, denominator=1):
+    return numerator / denominator
+  def convert(self, number):
+    return float(number)
+  def divide(self, a, b):
+    return a / b
+  def power(self, base, exponent):
+    return base ** exponent
+  def log(self, x, base):
+    # Logarithms of non-positive numbers and to the base of 1 are undefined
+    try:
+      return log(x, base)
+    except (ValueError, ZeroDivisionError):
+      return None
+
+backends = {}
+# Backends picked by the "auto" setting, from most to least preferred
+AUTO_BACKENDS = []
+
+def register_backend(backend, auto=False):
+  backends[backend.name] = backend
+  if auto:
+    AUTO_BACKENDS.append(backend.name)
+
+# fractions and gmpy2 aren't available on calculators, so they're optional.
+try:
+  from fractions import Fraction
+
+  # The standard library's fractions. These are slower than our Rational,
+  # so they're only used when explicitly requested.
+  class FractionBackend(NumberBackend):
+    name = "fraction"
+    def fraction(self, numerator, denominator=1):
+      if denominator == 1:
+        return numerator
+      result = Fraction(numerator, denominator)
+      return result.numerator if result.denominator == 1 else result
+    def divide(self, a, b):
+      return self.convert(Fraction(a) / b)
+    def power(self, base, exponent):
+      if denominator(exponent) != 1:
+        return None
+      exponent = int(numerator(exponent))
+      if isinstance(base, int) and exponent >= 0:
+        return base ** exponent
+      return self.convert(Fraction(base) ** exponent)
+    def convert(self, number):
+      if isinstance(number, int):
+        return number
+      if isinstance(number, Fraction):
+        return number.numerator if number.denominator == 1 else number
+      return NumberBackend.convert(self, number)
+  register_backend(FractionBackend())
+except ImportError:
+  pass
+
+try:
+  import gmpy2
+
+  # GMP's rationals, which are implemented in C and much faster than
+  # either pure-Python implementation, especially with large coefficients.
+  class GmpyBackend(NumberBackend):
+    name = "gmpy2"
+    def fraction(self, numerator, denominator=1):
+      if denominator == 1:
+        return numerator
+      return self.convert(gmpy2.mpq(numerator, denominator))
+    def divide(self, a, b):
+      return self.convert(gmpy2.mpq(a) / b)
+    def power(self, base, exponent):
+      if denominator(exponent) != 1:
+        return None
+      exponent = int(numerator(exponent))
+      if isinstance(base, int) and exponent >= 0:
+        return base ** exponent
+      return self.convert(gmpy2.mpq(base) ** exponent)
+    def gcd(self, values):
+      result = 0
+      for value in values:
+        result = gmpy2.gcd(result, gmpy2.mpz(value))
+        if result == 1:
+          break
+      return int(result)
+    def convert(self, number):
+      if isinstance(number, int):
+        return number
+      if not isinstance(number, float):
+        number = gmpy2.mpq(numerator(number), denominator(number))
+      else:
+        number = gmpy2.mpq(number)
+      return int(number.numerator) if number.denominator == 1 else number
+  register_backend(GmpyBackend(), auto=True)
+except ImportError:
+  pass
+
+register_backend(RationalBackend(), auto=True)
+register_backend(FloatBackend())
+
+# Returns the backend to use when none is specified; see cas_settings
+def default_backend():
+  return cas_settings.default_context().backend
+
+# Accepts a backend, a backend name, or None for the default backend
+def get_backend(backend=None):
+  if backend == None:
+    return default_backend()
+  if isinstance(backend, str):
+    if backend == "auto":
+      return backends[AUTO_BACKENDS[0]]
+    if backend not in backends:
+      raise Exception("Number backend " + backend + " isn't available.")
+    return backends[backend]
+  return backend
@@ -1,7 +1,6 @@
 from cas_ast import *
-from cas_functions import ASTFunctionCall
-import cas_settings
-from cas_rational import Rational
+from cas_functions import ASTFunctionCall, ASTUserFunctionCall, UserFunction, function_names
+from cas_settings import get_context
 
 def is_letter(c):
   return "a" <= c <= "z" or "A" <= c <= "Z"
@@ -35,6 +34,8 @@ class TokenType:
   EXPONENT = 8
   # Used in logarithms
   UNDERSCORE = 9
+  # Used in function definitions
+  EQUALS = 10
 
 token_names = {}
 token_chars = {}
@@ -62,6 +63,7 @@ add_tok(TokenType.EXPONENT, "Exponent", "^")
 # ",," is an alternative to "_" because "_" is difficult
 # to type in prompt inputs on NSpire calculators.
 add_tok(TokenType.UNDERSCORE, "Underscore", ("_", ",,"))
+add_tok(TokenType.EQUALS, "Equals", "=")
 
 class Token:
   def __init__(self, type, literal, position):
@@ -83,10 +85,13 @@ class Token:
     return str(self)
 
 class Tokens:
-  def __init__(self, str):
+  def __init__(self, str, context=None, functions=None):
     self.str = str
     self.idx = 0
     self.list = []
+    self.context = get_context(context)
+    # User-defined functions that can be called, by name
+    self.functions = functions if functions != None else {}
   
   def test_token_chars(self):
     to_test = min(len(self.str) - self.idx, longest_token_char)
@@ -169,7 +174,7 @@ class Tokens:
     
     self.list.append(Token(
       TokenType.NUMBER,
-      Rational(numerator, denominator) if cas_settings.USE_RATIONALS else (numerator / denominator),
+      self.context.backend.fraction(numerator, denominator),
       start_idx
     ))
     
@@ -234,13 +239,47 @@ class Tokens:
     return tok
 
   def to_ast(self):
-    self.idx = 0
+    return self.to_ast_from(0)
+  def to_ast_from(self, idx):
+    self.idx = idx
     expression = self.p_expr()
     if self.idx < len(self.list):
       self.p_error("Unexpected \"" + self.p_peek().literal + "\" at end of input")
     return expression
   
+  def to_definition(self):
+    self.idx = 0
+    return self.p_function(self.p_name())
+  def to_assignment(self):
+    self.idx = 0
+    name = self.p_name()
+    if self.p_peek().type == TokenType.OPEN_PAREN:
+      return name, self.p_function(name)
+    self.p_take_expect(TokenType.EQUALS)
+    return name, self.to_ast_from(self.idx)
+  
+  # Takes the name being defined
+  def p_name(self):
+    name = self.p_take_expect(TokenType.IDENTIFIER)
+    if name.literal in function_names or name.literal in builtin_variables or name.literal == "log":
+      self.idx -= 1
+      self.p_error("Cannot redefine " + name.literal)
+    return name.literal
+  # Takes the rest of a function definition after its name
+  def p_function(self, name):
+    self.p_take_expect(TokenType.OPEN_PAREN)
+    parameter = self.p_take_expect(TokenType.IDENTIFIER)
+    if parameter.literal in builtin_variables:
+      self.idx -= 1
+      self.p_error("Cannot use " + parameter.literal + " as a parameter")
+    self.p_take_expect(TokenType.CLOSE_PAREN)
+    self.p_take_expect(TokenType.EQUALS)
+    body = self.to_ast_from(self.idx)
+    return UserFunction(name, parameter.literal, body)
+  
   # Recursive descent parser grammar:
+  # Assignment -> Identifier = Expression | Definition
+  # Definition -> Identifier (Identifier) = Expression
   # Expression -> Term ((+ | -) Term)*
   # Term -> Power ((* | /) Power)*
   # Power -> Factor (^ Factor)*
@@ -316,7 +355,9 @@ class Tokens:
     if self.p_take_if(TokenType.OPEN_PAREN):
       argument = self.p_expr()
       self.p_take_expect(TokenType.CLOSE_PAREN)
-      return ASTFunctionCall.create(ident.literal, argument)
+      if ident.literal in self.functions:
+        return ASTUserFunctionCall(self.functions[ident.literal], argument)
+      return ASTFunctionCall.create(ident.literal, argument, self.context)
     
     if ident.literal in builtin_variables:
       return builtin_variables[ident.literal]
@@ -328,7 +369,23 @@ class Tokens:
     for token in self.list:
       token.print()
 
-def parse_to_ast(str):
-  tokens = Tokens(str)
+# context is the EngineContext used for number literals; see cas_settings.py
+# functions is a dictionary of the user-defined functions that can be called, by name
+def parse_to_ast(str, context=None, functions=None):
+  tokens = Tokens(str, context, functions)
+  tokens.parse()
+  return tokens.to_ast()
+
+# Parses a function definition like f(x) = x^2*sin(x), returning a UserFunction.
+# The body can call the functions in functions, but not the function itself.
+def parse_definition(str, context=None, functions=None):
+  tokens = Tokens(str, context, functions)
+  tokens.parse()
+  return tokens.to_definition()
+
+# Parses either a definition or a binding like a = 2x+1, returning (name, value),
+# where value is a UserFunction for definitions and an expression for bindings
+def parse_assignment(str, context=None, functions=None):
+  tokens = Tokens(str, context, functions)
   tokens.parse()
-  return tokens.to_ast()
\ No newline at end of file
+  return tokens.to_assignment()
@@ -0,0 +1,493 @@
+from cas_ast import *
+from cas_expand import term_to_ast
+from cas_factor import int_gcd, integer_root
+from cas_rational import numerator, denominator
+
+# Rational function normalization: writing a sum or product with denominators as
+# one fraction, and cancelling the factors its numerator and denominator have in
+# common, so 3x^2/x = 3x and (x^2-1)/(x-1) = x+1.
+#
+# Expressions are turned into sparse multivariate polynomials with integer
+# coefficients: dictionaries from exponent tuples to coefficients, where each
+# position in the tuple is a generator. Anything that isn't a sum, product or
+# non-negative integer power (variables, function calls, sqrt(x), ...) is a generator.
+#
+# Common factors are found with the heuristic GCD (Char, Geddes and Gonnet's GCDHEU).
+# It evaluates both polynomials at a large integer, takes the gcd of the resulting
+# integers, and reads the gcd polynomial back off of that integer's digits in base
+# x. Euclid's algorithm over the rationals would be simpler, but its intermediate
+# coefficients get enormous, which is a problem for the calculator's memory.
+#
+# Normalizing can make expressions bigger (1/x+1/y = (x+y)/(xy)), so the result
+# is only used when it has fewer nodes than what we started with.
+
+# Polynomials with more terms than this are left alone, since dividing them is slow
+MAX_POLYNOMIAL_TERMS = 200
+
+# Integer powers up to this are split into repeated factors when cancelling,
+# so (x+1)^5/(x+1) = (x+1)^4 without multiplying out (x+1)^5
+MAX_REPEATED_FACTORS = 16
+
+# How many points the heuristic GCD tries before giving up
+HEURISTIC_GCD_ATTEMPTS = 6
+
+def poly_add(a, b):
+  result = dict(a)
+  for exponents, coefficient in b.items():
+    coefficient = result.get(exponents, 0) + coefficient
+    if coefficient == 0:
+      del result[exponents]
+    else:
+      result[exponents] = coefficient
+  return result
+
+def poly_multiply(a, b):
+  result = {}
+  for exponents_a, coefficient_a in a.items():
+    for exponents_b, coefficient_b in b.items():
+      exponents = tuple([x + y for x, y in zip(exponents_a, exponents_b)])
+      coefficient = result.get(exponents, 0) + coefficient_a * coefficient_b
+      if coefficient == 0:
+        del result[exponents]
+      else:
+        result[exponents] = coefficient
+  return result
+
+def poly_is_constant(p):
+  return len(p) == 0 or (len(p) == 1 and not any(next(iter(p))))
+
+# The gcd of an integer polynomial's coefficients
+def poly_content(p):
+  result = 0
+  for coefficient in p.values():
+    result = int_gcd(result, coefficient)
+    if result == 1:
+      break
+  return result
+
+# Returns (content, primitive part) of an integer polynomial.
+# The primitive part's leading coefficient is positive.
+def poly_primitive(p):
+  content = poly_content(p)
+  if p[max(p)] < 0:
+    content = -content
+  return content, {exponents: coefficient // content for exponents, coefficient in p.items()}
+
+# Returns a/b if b divides a exactly (over the integers), or None.
+# Uses the lexicographic order, so every step removes a's leading term.
+def poly_divide(a, b):
+  quotient = {}
+  remainder = dict(a)
+  leading_b = max(b)
+  coefficient_b = b[leading_b]
+  while len(remainder) > 0:
+    leading = max(remainder)
+    coefficient = remainder[leading]
+    if coefficient % coefficient_b != 0:
+      return None
+    shift = tuple([x - y for x, y in zip(leading, leading_b)])
+    if min(shift) < 0 or len(quotient) > MAX_POLYNOMIAL_TERMS:
+      return None
+    coefficient //= coefficient_b
+    quotient[shift] = coefficient
+    for exponents, other in b.items():
+      exponents = tuple([x + y for x, y in zip(exponents, shift)])
+      value = remainder.get(exponents, 0) - coefficient * other
+      if value == 0:
+        del remainder[exponents]
+      else:
+        remainder[exponents] = value
+  return quotient
+
+# Substitutes value for generator number var
+def poly_evaluate(p, var, value):
+  result = {}
+  for exponents, coefficient in p.items():
+    power = exponents[var]
+    if power != 0:
+      coefficient *= value ** power
+      exponents = exponents[:var] + (0,) + exponents[var + 1:]
+    coefficient += result.get(exponents, 0)
+    if coefficient == 0:
+      del result[exponents]
+    else:
+      result[exponents] = coefficient
+  return result
+
+# Turns the gcd of polynomials evaluated at generator var = x back into a polynomial in var,
+# by writing each coefficient in base x with digits between -x/2 and x/2
+def poly_interpolate(p, var, x):
+  result = {}
+  power = 0
+  while len(p) > 0:
+    remaining = {}
+    for exponents, coefficient in p.items():
+      digit = coefficient % x
+      if digit > x // 2:
+        digit -= x
+      if digit != 0:
+        result[exponents[:var] + (power,) + exponents[var + 1:]] = digit
+      coefficient = (coefficient - digit) // x
+      if coefficient != 0:
+        remaining[exponents] = coefficient
+    p = remaining
+    power += 1
+  return result
+
+# The gcd of two non-zero integer polynomials in generators 0 to level - 1,
+# with a positive leading coefficient, or None if the heuristic GCD failed
+def heuristic_gcd(f, g, level):
+  if poly_is_constant(f) or poly_is_constant(g):
+    return {tuple([0] * len(next(iter(f)))): int_gcd(poly_content(f), poly_content(g))}
+  content_f, f = poly_primitive(f)
+  content_g, g = poly_primitive(g)
+  content = int_gcd(content_f, content_g)
+
+  # The gcd can only contain generators both polynomials contain
+  var = level - 1
+  while var >= 0 and not (any(exponents[var] for exponents in f) and any(exponents[var] for exponents in g)):
+    var -= 1
+  if var < 0:
+    return {tuple([0] * len(next(iter(f)))): content}
+
+  norm_f = max(abs(coefficient) for coefficient in f.values())
+  norm_g = max(abs(coefficient) for coefficient in g.values())
+  bound = 2 * min(norm_f, norm_g) + 29
+  x = max(min(bound, 99 * integer_root(bound, 2)), 2 * min(norm_f // abs(f[max(f)]), norm_g // abs(g[max(g)])) + 2)
+  for attempt in range(HEURISTIC_GCD_ATTEMPTS):
+    evaluated_f = poly_evaluate(f, var, x)
+    evaluated_g = poly_evaluate(g, var, x)
+    if len(evaluated_f) > 0 and len(evaluated_g) > 0:
+      h = heuristic_gcd(evaluated_f, evaluated_g, var)
+      if h != None:
+        h = poly_primitive(poly_interpolate(h, var, x))[1]
+        if poly_divide(f, h) != None and poly_divide(g, h) != None:
+          return {exponents: coefficient * content for exponents, coefficient in h.items()}
+    # Try a bigger point that isn't a nice round number
+    x = 73794 * x * integer_root(integer_root(x, 2), 2) // 27011
+  return None
+
+# Finds the generators of node, which are numbered in the order they're found
+def find_generators(node, generators):
+  stack = [node]
+  while len(stack) > 0:
+    node = stack.pop()
+    if node.is_number():
+      continue
+    if isinstance(node, ASTSum) or isinstance(node, ASTProduct):
+      stack.extend(node.children())
+    elif isinstance(node, ASTPower) and node.exponent.is_integer() and node.exponent.number >= 0:
+      stack.append(node.base)
+    elif node not in generators:
+      generators[node] = len(generators)
+
+# Returns node as a polynomial with exact coefficients, or None if it's too big
+def to_polynomial(node, generators, state):
+  zero = tuple([0] * len(generators))
+  if node.is_number():
+    if not is_exact_number(node.number):
+      return None
+    return {zero: node.number} if node.number != 0 else {}
+  if isinstance(node, ASTSum):
+    result = {}
+    for term in node.terms:
+      term = to_polynomial(term, generators, state)
+      if term == None:
+        return None
+      result = poly_add(result, term)
+    return result
+  if isinstance(node, ASTProduct):
+    result = {zero: 1}
+    for factor in node.factors:
+      factor = to_polynomial(factor, generators, state)
+      if factor == None or len(result) * len(factor) > MAX_POLYNOMIAL_TERMS:
+        return None
+      result = poly_multiply(result, factor)
+    return result
+  if isinstance(node, ASTPower) and node.exponent.is_integer() and node.exponent.number >= 0:
+    base = to_polynomial(node.base, generators, state)
+    if base == None:
+      return None
+    result = {zero: 1}
+    for i in range(int(node.exponent.number)):
+      if len(result) * len(base) > MAX_POLYNOMIAL_TERMS:
+        return None
+      result = poly_multiply(result, base)
+    return result
+  exponents = list(zero)
+  exponents[generators[node]] = 1
+  return {tuple(exponents): 1}
+
+# Returns (numerator, denominator, primitive part) with p = numerator/denominator * primitive part,
+# where the primitive part has integer coefficients
+def clear_denominators(p):
+  multiple = 1
+  for coefficient in p.values():
+    d = int(denominator(coefficient))
+    multiple = multiple * d // int_gcd(multiple, d)
+  p = {exponents: int(numerator(coefficient * multiple)) for exponents, coefficient in p.items()}
+  content, p = poly_primitive(p)
+  return content, multiple, p
+
+def polynomial_to_ast(p, generators):
+  terms = []
+  for exponents, coefficient in p.items():
+    terms.append(term_to_ast(coefficient, dict([(generator, exponents[i]) for generator, i in generators.items() if exponents[i] != 0])))
+  if len(terms) == 1:
+    return terms[0]
+  return ASTSum(terms)
+
+# Returns (base, exponent) for a factor, if it's a small positive integer power
+def split_power(factor):
+  if isinstance(factor, ASTPower) and factor.exponent.is_integer() and not factor.base.is_number():
+    exponent = int(factor.exponent.number)
+    if 0 < exponent <= MAX_REPEATED_FACTORS:
+      return factor.base, exponent
+  return factor, 1
+
+# The node's terms, each split into a coefficient, a list of its numerator's (base, exponent) pairs
+# and a dictionary of its denominator's bases and (positive) exponents, or None if there's nothing to normalize.
+# Unlike split_term, bases in the numerator and denominator aren't merged, so x^2/x is x^2 over x.
+def split_quotients(node, state):
+  terms = node.terms if isinstance(node, ASTSum) else (node,)
+  split = []
+  # How many terms each denominator appears in
+  denominator_counts = {}
+  for term in terms:
+    coefficient = 1
+    numerator_factors = []
+    denominator_factors = {}
+    for factor in (term.factors if isinstance(term, ASTProduct) else (term,)):
+      if factor.is_number():
+        coefficient *= factor.number
+      elif isinstance(factor, ASTPower) and factor.exponent.is_integer() and factor.exponent.number < 0:
+        exponent = -int(factor.exponent.number)
+        if factor.base.is_number():
+          power = state.backend.power(factor.base.number, -exponent) if factor.base.number != 0 else None
+          if power == None:
+            return None
+          coefficient *= power
+        else:
+          base, power = split_power(factor.base)
+          denominator_factors[base] = denominator_factors.get(base, 0) + exponent * power
+      else:
+        numerator_factors.append(split_power(factor))
+    if not is_exact_number(coefficient):
+      return None
+    for base in denominator_factors:
+      denominator_counts[base] = denominator_counts.get(base, 0) + 1
+    split.append((coefficient, numerator_factors, denominator_factors))
+  if len(denominator_counts) == 0:
+    return None
+  # Writing a sum as one fraction usually makes it bigger, like 1/x+1/y = (x+y)/(xy),
+  # unless some of its terms have the same denominator
+  if isinstance(node, ASTSum) and max(denominator_counts.values()) < 2:
+    return None
+  return split
+
+def count_nodes(node):
+  count = 0
+  for descendant in node.iter_preorder():
+    count += 1
+  return count
+
+# Returns (p/g, q/g) where g is the gcd of primitive integer polynomials p and q,
+# or None if they don't have a common factor (or the heuristic GCD failed)
+def cancel_common(p, q, level):
+  if poly_is_constant(p) or poly_is_constant(q):
+    return None
+  if len(p) == 1 or len(q) == 1:
+    # The gcd with a monomial is just the smallest power of each generator
+    smallest = list(next(iter(p)))
+    for exponents in list(p) + list(q):
+      smallest = [min(x, y) for x, y in zip(smallest, exponents)]
+    if not any(smallest):
+      return None
+    common = {tuple(smallest): 1}
+  else:
+    common = heuristic_gcd(p, q, level)
+    if common == None or poly_is_constant(common):
+      return None
+  return poly_divide(p, common), poly_divide(q, common)
+
+# numerator/denominator in the context's backend, where both are ints
+def make_fraction(numerator, denominator, state):
+  if denominator < 0:
+    numerator, denominator = -numerator, -denominator
+  return state.backend.fraction(numerator, denominator)
+
+# Factors for a list of polynomials, with equal ones written as powers.
+# sign is -1 for factors of a denominator.
+def factors_to_ast(polynomials, generators, sign=1):
+  powers = {}
+  for polynomial in polynomials:
+    if poly_is_constant(polynomial):
+      continue
+    key = tuple(sorted(polynomial.items()))
+    entry = powers.get(key)
+    if entry == None:
+      powers[key] = [polynomial, 1]
+    else:
+      entry[1] += 1
+  factors = []
+  for polynomial, exponent in powers.values():
+    base = polynomial_to_ast(polynomial, generators)
+    factors.append(base if exponent * sign == 1 else ASTPower(base, ASTNumber(exponent * sign)))
+  return factors
+
+# Returns the reduced product of factors if it has fewer nodes than node, or None
+def smaller_product(node, factors, state):
+  result = ASTProduct(factors)
+  # Reducing hardly ever makes the result much smaller, so this skips reducing most results we wouldn't use
+  size = count_nodes(node)
+  if count_nodes(result) >= size:
+    return None
+  result = result.reduce(state)
+  if count_nodes(result) >= size:
+    return None
+  return result
+
+# Cancels common factors of a product's numerator and denominator.
+# Each factor of the numerator is only compared with each factor of the denominator,
+# so factors that don't cancel aren't multiplied out.
+def normalize_product(node, split, state):
+  coefficient, numerator_factors, denominator_factors = split[0]
+  generators = {}
+  # Each factor of the numerator and denominator, repeated for powers, as
+  # [base, its generators, its primitive polynomial (once it's needed), whether it changed]
+  def units(factors):
+    result = []
+    for base, exponent in factors:
+      base_generators = {}
+      find_generators(base, base_generators)
+      for generator in base_generators:
+        if generator not in generators:
+          generators[generator] = len(generators)
+      for i in range(exponent):
+        result.append([base, base_generators, None, False])
+    return result
+  numerator = units(numerator_factors)
+  denominator = units(denominator_factors.items())
+
+  # Turns an entry's factor into a polynomial, keeping its content in the coefficient
+  scale = [1, 1]
+  def convert(entry, inverse):
+    if entry[2] == None:
+      polynomial = to_polynomial(entry[0], generators, state)
+      if polynomial == None or len(polynomial) == 0:
+        entry[2] = False
+        return False
+      content, multiple, entry[2] = clear_denominators(polynomial)
+      if inverse:
+        content, multiple = multiple, content
+      scale[0] *= content
+      scale[1] *= multiple
+    return entry[2] != False
+
+  changed = False
+  for entry in numerator:
+    for other in denominator:
+      if not any(generator in other[1] for generator in entry[1]):
+        # They can only have a common factor if they share a generator
+        continue
+      if not convert(entry, False) or not convert(other, True):
+        continue
+      cancelled = cancel_common(entry[2], other[2], len(generators))
+      if cancelled != None:
+        entry[2], other[2] = cancelled
+        entry[3] = other[3] = True
+        changed = True
+  if not changed:
+    return None
+
+  coefficient *= make_fraction(scale[0], scale[1], state)
+  factors = [] if coefficient == 1 else [ASTNumber(coefficient)]
+  for entries, sign in ((numerator, 1), (denominator, -1)):
+    unchanged = {}
+    for base, base_generators, polynomial, base_changed in entries:
+      if not base_changed:
+        if polynomial:
+          # Converted but unchanged, so its content is in the coefficient
+          base = polynomial_to_ast(polynomial, generators)
+        unchanged[base] = unchanged.get(base, 0) + 1
+    for base, exponent in unchanged.items():
+      factors.append(base if exponent * sign == 1 else ASTPower(base, ASTNumber(exponent * sign)))
+    factors.extend(factors_to_ast([entry[2] for entry in entries if entry[3]], generators, sign))
+  return smaller_product(node, factors, state)
+
+# Writes a sum as one fraction over the product of its terms' denominators, and cancels
+# common factors of that fraction's numerator and denominator
+def normalize_sum(node, split, state):
+  # Every denominator, to the highest power it appears to
+  denominators = {}
+  generators = {}
+  for coefficient, numerator_factors, denominator_factors in split:
+    for base, exponent in denominator_factors.items():
+      if exponent > denominators.get(base, 0):
+        denominators[base] = exponent
+    for base, exponent in numerator_factors:
+      find_generators(base, generators)
+  for base in denominators:
+    find_generators(base, generators)
+  zero = tuple([0] * len(generators))
+
+  denominator_polynomials = {}
+  for base in denominators:
+    polynomial = to_polynomial(base, generators, state)
+    if polynomial == None or len(polynomial) == 0:
+      return None
+    denominator_polynomials[base] = polynomial
+
+  # The numerator over the common denominator
+  total = {}
+  for coefficient, numerator_factors, denominator_factors in split:
+    term = {zero: coefficient}
+    factors = list(numerator_factors)
+    for base, exponent in denominators.items():
+      factors.append((base, exponent - denominator_factors.get(base, 0)))
+    for base, exponent in factors:
+      polynomial = denominator_polynomials.get(base)
+      if polynomial == None:
+        polynomial = to_polynomial(base, generators, state)
+        if polynomial == None:
+          return None
+      for i in range(exponent):
+        if len(term) * len(polynomial) > MAX_POLYNOMIAL_TERMS:
+          return None
+        term = poly_multiply(term, polynomial)
+    total = poly_add(total, term)
+    if len(total) > MAX_POLYNOMIAL_TERMS:
+      return None
+  if len(total) == 0:
+    return ZERO
+
+  # total = (numerator / denominator) * remaining, and the common denominator is
+  # the product of remaining_denominators over (numerator / denominator) too
+  numerator_part, denominator_part, remaining = clear_denominators(total)
+  remaining_denominators = []
+  for base, exponent in denominators.items():
+    content, multiple, polynomial = clear_denominators(denominator_polynomials[base])
+    numerator_part *= multiple ** exponent
+    denominator_part *= content ** exponent
+    remaining_denominators.extend([polynomial] * exponent)
+
+  for i, polynomial in enumerate(remaining_denominators):
+    cancelled = cancel_common(remaining, polynomial, len(generators))
+    if cancelled != None:
+      remaining, remaining_denominators[i] = cancelled
+
+  factors = [ASTNumber(make_fraction(numerator_part, denominator_part, state)), polynomial_to_ast(remaining, generators)]
+  factors.extend(factors_to_ast(remaining_denominators, generators, -1))
+  return smaller_product(node, factors, state)
+
+# Returns node, a reduced sum or product, as a single fraction with common factors cancelled,
+# or None if that isn't smaller
+def normalize_quotient(node, state):
+  if not state.context.exact or node.depth > MAX_RECURSION_DEPTH:
+    return None
+  split = split_quotients(node, state)
+  if split == None:
+    return None
+  if isinstance(node, ASTProduct):
+    return normalize_product(node, split, state)
+  return normalize_sum(node, split, state)
@@ -0,0 +1,283 @@
+from cas_ast import *
+from cas_functions import ASTFunctionCall
+from cas_parser import parse_to_ast
+from cas_settings import get_context
+
+import sys
+
+# Seeded random expression generation for stress tests, scaling benchmarks and fuzzing.
+# Expressions are generated as ASTs, and to_input_str turns them into strings
+# that parse_to_ast accepts so the parser can be exercised too.
+
+# We use our own small PRNG (xorshift32) instead of the random module so that
+# the same seed produces the same expressions on CPython and Micropython.
+class SeededRandom:
+  def __init__(self, seed=0):
+    # xorshift can't start from 0
+    self.state = (seed * 2654435761 + 1) & 0xFFFFFFFF or 1
+
+  def next_int(self):
+    x = self.state
+    x ^= (x << 13) & 0xFFFFFFFF
+    x ^= x >> 17
+    x ^= (x << 5) & 0xFFFFFFFF
+    self.state = x
+    return x
+
+  # A float in [0, 1)
+  def random(self):
+    return self.next_int() / 4294967296
+
+  # An integer in [low, high]
+  def randint(self, low, high):
+    return low + self.next_int() % (high - low + 1)
+
+  def choice(self, items):
+    return items[self.next_int() % len(items)]
+
+  # Picks a key from a dictionary of keys to weights
+  def weighted_choice(self, weights):
+    total = 0
+    for weight in weights.values():
+      total += weight
+    target = self.random() * total
+    for key, weight in weights.items():
+      target -= weight
+      if target < 0 and weight > 0:
+        return key
+    # Rounding can leave us at the end; pick the last key with a weight
+    for key, weight in weights.items():
+      if weight > 0:
+        last = key
+    return last
+
+# Default relative weights of the kinds of node generated at inner levels
+DEFAULT_NODE_WEIGHTS = {
+  "sum": 3,
+  "product": 3,
+  "power": 1,
+  "function": 2,
+  "log": 1,
+}
+
+# Default relative weights of the functions used for function nodes
+DEFAULT_FUNCTION_WEIGHTS = {
+  "sin": 3,
+  "cos": 3,
+  "tan": 1,
+  "sec": 1,
+  "csc": 1,
+  "cot": 1,
+  "arctan": 1,
+  "sqrt": 1,
+  "ln": 1,
+}
+
+# Default relative weights of the kinds of leaf
+DEFAULT_LEAF_WEIGHTS = {
+  "variable": 4,
+  "number": 3,
+  "constant": 1,
+}
+
+class ExpressionGenerator:
+  # max_depth: the maximum nesting depth; leaves are at depth 0
+  # sum_breadth, product_breadth: (minimum, maximum) number of terms or factors
+  # variables: the variable names leaves are picked from
+  # coefficient_bits: the maximum bit size of generated numerators and denominators
+  # rational_probability: the chance that a generated number is a fraction
+  # leaf_probability: the chance an inner node becomes a leaf early
+  # exponents: the exponents power nodes are picked from
+  # context: the EngineContext used to create fractions
+  def __init__(
+    self, seed=0, max_depth=4,
+    sum_breadth=(2, 3), product_breadth=(2, 3),
+    variables=("x",), coefficient_bits=4, rational_probability=0.2,
+    leaf_probability=0.25, exponents=(2, 3, -1),
+    node_weights=None, function_weights=None, leaf_weights=None, context=None
+  ):
+    self.random = SeededRandom(seed)
+    self.max_depth = max_depth
+    self.sum_breadth = sum_breadth
+    self.product_breadth = product_breadth
+    self.variables = list(variables)
+    self.coefficient_bits = coefficient_bits
+    self.rational_probability = rational_probability
+    self.leaf_probability = leaf_probability
+    self.exponents = list(exponents)
+    self.node_weights = node_weights if node_weights != None else DEFAULT_NODE_WEIGHTS
+    self.function_weights = function_weights if function_weights != None else DEFAULT_FUNCTION_WEIGHTS
+    self.leaf_weights = leaf_weights if leaf_weights != None else DEFAULT_LEAF_WEIGHTS
+    self.context = get_context(context)
+
+  def number(self, allow_fraction=True):
+    limit = (1 << self.coefficient_bits) - 1
+    numerator = self.random.randint(1, max(limit, 1))
+    if self.random.random() < 0.3:
+      numerator = -numerator
+    if allow_fraction and self.random.random() < self.rational_probability:
+      denominator = self.random.randint(2, max(limit, 2))
+      return ASTFraction(numerator, denominator, self.context)
+    return ASTNumber(numerator)
+
+  def leaf(self):
+    kind = self.random.weighted_choice(self.leaf_weights)
+    if kind == "variable" and len(self.variables) > 0:
+      return ASTVariable(self.random.choice(self.variables))
+    if kind == "constant":
+      return PI if self.random.random() < 0.5 else EULER
+    return self.number()
+
+  def exponent(self):
+    exponent = self.random.choice(self.exponents)
+    if not isinstance(exponent, int):
+      exponent = self.context.backend.convert(exponent)
+    return ASTNumber(exponent)
+
+  def generate(self, depth=None):
+    if depth == None:
+      depth = self.max_depth
+    if depth <= 0 or self.random.random() < self.leaf_probability:
+      return self.leaf()
+
+    kind = self.random.weighted_choice(self.node_weights)
+    if kind == "sum":
+      count = self.random.randint(self.sum_breadth[0], self.sum_breadth[1])
+      return ASTSum([self.generate(depth - 1) for _ in range(count)])
+    if kind == "product":
+      count = self.random.randint(self.product_breadth[0], self.product_breadth[1])
+      return ASTProduct([self.generate(depth - 1) for _ in range(count)])
+    if kind == "power":
+      return ASTPower(self.generate(depth - 1), self.exponent())
+    if kind == "log":
+      # Numeric bases keep most logarithms defined when evaluating
+      base = ASTNumber(self.random.randint(2, 10))
+      return ASTLogarithm(base, self.generate(depth - 1))
+    name = self.random.weighted_choice(self.function_weights)
+    return ASTFunctionCall.create(name, self.generate(depth - 1))
+
+  def generate_string(self, depth=None):
+    return to_input_str(self.generate(depth))
+
+  def generate_corpus(self, count, depth=None):
+    return [self.generate_string(depth) for _ in range(count)]
+
+# Converts an AST into a string that parse_to_ast accepts.
+# Unlike pretty_str, this fully parenthesizes everything.
+def to_input_str(node):
+  if isinstance(node, ASTPi):
+    return "pi"
+  if isinstance(node, ASTEuler):
+    return "E"
+  if isinstance(node, ASTNumber):
+    string = str(node.number)
+    if isinstance(node.number, float) and "e" in string:
+      # The parser doesn't understand exponent notation
+      string = ("%.17f" % node.number).rstrip("0")
+    return "(" + string + ")"
+  if isinstance(node, ASTVariable):
+    return node.name
+  if isinstance(node, ASTSum):
+    return "(" + "+".join(to_input_str(term) for term in node.terms) + ")"
+  if isinstance(node, ASTProduct):
+    return "(" + "*".join(to_input_str(factor) for factor in node.factors) + ")"
+  if isinstance(node, ASTPower):
+    return "(" + to_input_str(node.base) + "^" + to_input_str(node.exponent) + ")"
+  if isinstance(node, ASTLogarithm):
+    return "log_(" + to_input_str(node.base) + ")(" + to_input_str(node.argument) + ")"
+  if isinstance(node, ASTFunctionCall):
+    return node.name + "(" + to_input_str(node.argument) + ")"
+  raise Exception("Can't convert " + type(node).__name__ + " to an input string")
+
+# Fuzzing
+
+# Evaluates a node with the given variable values, returning None
+# if the expression isn't defined (or isn't real) there.
+def try_eval(node, values):
+  try:
+    result = node.substitute_with_numbers(values).eval()
+  except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+    return None
+  if isinstance(result, complex) or result != result or result in (float("inf"), float("-inf")):
+    return None
+  return result
+
+def close_enough(a, b, tolerance):
+  return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+
+# Generates random expressions and checks simplify() and derivative() against
+# numeric evaluation at a few sample points, like test_expression_numeric does.
+# Derivatives are checked against a central finite difference.
+# Returns a list of failures as (kind, expression string, message) tuples.
+def fuzz(count=100, seed=0, points=4, tolerance=1e-6, check_simplify=True, check_derivative=True, log=None, context=None, **generator_options):
+  generator = ExpressionGenerator(seed=seed, context=context, **generator_options)
+  context = generator.context
+  sampler = SeededRandom(seed + 1)
+  variables = generator.variables
+  failures = []
+
+  def fail(kind, expression, message):
+    failures.append((kind, expression, message))
+    if log != None:
+      log(kind + " failure: " + expression + "\n  " + message)
+
+  for _ in range(count):
+    node = generator.generate()
+    expression = to_input_str(node)
+
+    samples = []
+    for _ in range(points):
+      samples.append(dict((var, round(sampler.random() * 4 - 2, 3) or 0.5) for var in variables))
+
+    if check_simplify:
+      try:
+        simplified = node.simplify(context=context)
+      except Exception as e:
+        fail("simplify", expression, "raised " + repr(e))
+        simplified = None
+
+      if simplified != None:
+        for values in samples:
+          expected = try_eval(node, values)
+          if expected == None:
+            continue
+          actual = try_eval(simplified, values)
+          if actual == None or not close_enough(actual, expected, tolerance):
+            fail("simplify", expression, "at " + str(values) + ": expected " + str(expected) + ", got " + str(actual) + " from " + simplified.pretty_str(100))
+            break
+
+    if check_derivative and len(variables) > 0:
+      var = variables[0]
+      try:
+        derivative = node.derivative(var, context)
+      except Exception as e:
+        fail("derivative", expression, "raised " + repr(e))
+        derivative = None
+
+      if derivative != None:
+        for values in samples:
+          h = 1e-5 * max(1, abs(values[var]))
+          above = dict(values)
+          below = dict(values)
+          above[var] = values[var] + h
+          below[var] = values[var] - h
+          f_above = try_eval(node, above)
+          f_below = try_eval(node, below)
+          actual = try_eval(derivative, values)
+          if f_above == None or f_below == None or actual == None:
+            continue
+          expected = (f_above - f_below) / (2 * h)
+          # Finite differences are much less precise than direct evaluation
+          if not close_enough(actual, expected, max(tolerance, 1e-3)):
+            fail("derivative", expression, "at " + str(values) + ": expected about " + str(expected) + ", got " + str(actual) + " from " + derivative.pretty_str(100))
+            break
+
+  return failures
+
+if __name__ == "__main__":
+  # python src/cas_random_expr.py [count] [seed] [max depth]
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+  depth = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+  failures = fuzz(count, seed, max_depth=depth, log=print)
+  print(str(len(failures)) + " failures in " + str(count) + " expressions")
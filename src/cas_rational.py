@@ -1,41 +1,104 @@
-from math import fabs
-
-# Returns a dictionary of prime factors and their exponents
-def prime_factors(n):
-  factors = {}
-  i = 2
-  while i * i <= abs(n):
-    while n % i == 0:
-      if i in factors:
-        factors[i] += 1
-      else:
-        factors[i] = 1
-      n //= i
-    i += 1
-  if n > 1:
-      factors[n] = 1
-  return factors
+from cas_factor import int_gcd, bit_length, prime_factors, integer_root
+from math import log
+import sys
+
+# The modulus CPython uses for hashing numbers. Using the same algorithm
+# means Rationals hash like ints, floats and Fractions with the same value.
+# Micropython doesn't have hash_info, so we fall back to hashing tuples there.
+try:
+  _HASH_MODULUS = sys.hash_info.modulus
+except AttributeError:
+  _HASH_MODULUS = None
+
+# Yields every fraction p/q in lowest terms with 0 < q <= max_denominator that's within
+# floating point error of value, as (p, q) pairs with the smallest q first
+def near_fractions(value, max_denominator):
+  for q in range(1, max_denominator + 1):
+    scaled = value * q
+    p = int(round(scaled))
+    if abs(scaled - p) <= 1e-9 * q * max(1, abs(value)) and fast_2_gcd(p, q) == 1:
+      yield p, q
+
+LOG_2 = log(2)
+
+# Returns log(n) for a positive int, even when n is too big to convert to a float
+def int_log(n):
+  bits = bit_length(n)
+  if bits > 1000:
+    shift = bits - 64
+    return log(n >> shift) + shift * LOG_2
+  return log(n)
+
+# Returns log(1 + t) accurately when t is close to 0, where log(1 + t) loses most of t's digits
+def log_1_plus(t):
+  u = 1 + t
+  if u == 1:
+    return t
+  return log(u) * t / (u - 1)
+
+# Returns log(numerator / denominator) as a float, or None if it can't be computed
+def float_log(numerator, denominator):
+  try:
+    difference = numerator - denominator
+    # Subtracting the logs of two numbers this close together would cancel most of the digits
+    if 2 * abs(difference) < denominator:
+      return log_1_plus(difference / denominator)
+    return int_log(numerator) - int_log(denominator)
+  except (OverflowError, ValueError):
+    return None
+
+# Whether (a/b)^q = (c/d)^p exactly, where both fractions are positive and in lowest terms
+# and p/q is in lowest terms with q > 0
+def is_rational_log(a, b, c, d, p, q):
+  # Since p/q is in lowest terms, c/d has to be a perfect qth power
+  root_c = integer_root(c, q)
+  if root_c ** q != c:
+    return False
+  root_d = integer_root(d, q)
+  if root_d ** q != d:
+    return False
+  if p < 0:
+    root_c, root_d = root_d, root_c
+    p = -p
+  return a == root_c ** p and b == root_d ** p
+
+# Factoring is only used when floating point logarithms can't be computed or don't lead
+# to a result, and only for numbers small enough to factor quickly
+FACTORING_LOG_BITS = 64
 
 # Returns the exact logarithm of x to the base of base.
 # If no rational result is possible, returns None.
-# TODO: This is really slow and inefficient, so we should
-# probably add a setting to disable it since it can take
-# multiple seconds on calculators to calculate a single time.
-# We should also probably cache results.
+# If log_base(x) = p/q in lowest terms, then base^p = x^q, so q divides the exponent of
+# every prime in base. Those exponents are at most log2(base), so the floating point
+# result has to be close to a fraction with a small denominator; each one that is gets
+# checked exactly with integer roots and powers, which is much faster than factoring.
 def exact_rational_log(x, base):
   # Easy cases
   if x <= 0 or base <= 0:
     return None # Undefined
   if x == 1:
-    return Rational(0)
+    return 0
   if base == 1:
     return None # Undefined for base 1 unless x == 1
   if x == base:
-    return Rational(1) # Trivial
+    return 1 # Trivial
   
-  a, b = x.numerator, x.denominator
-  c, d = base.numerator, base.denominator
+  a, b = int(numerator(x)), int(denominator(x))
+  c, d = int(numerator(base)), int(denominator(base))
 
+  log_x = float_log(a, b)
+  log_base = float_log(c, d)
+  if log_x != None and log_base != None and log_base != 0:
+    for p, q in near_fractions(log_x / log_base, max(bit_length(c), bit_length(d))):
+      if is_rational_log(a, b, c, d, p, q):
+        return make_rational(p, q)
+  
+  if max(bit_length(a), bit_length(b), bit_length(c), bit_length(d)) > FACTORING_LOG_BITS:
+    return None
+  return factored_rational_log(a, b, c, d)
+
+# Finds log_(c/d)(a/b) by factoring all four numbers, or returns None if it isn't rational
+def factored_rational_log(a, b, c, d):
   # We need to find integers p and q such that:
   # (exp_a - exp_b) * q = (exp_c - exp_d) * p
 
@@ -85,7 +148,7 @@ def exact_rational_log(x, base):
       return None # Inconsistent solutions
 
   if p != None and q != None:
-    return Rational(p, q)
+    return make_rational(p, q)
   return None
 
 
@@ -106,139 +169,318 @@ def fast_2_gcd(a, b):
     a, b = b, a % b
   return a
 
+# Integers are kept as plain ints wherever possible since they're much
+# faster than Rationals; these helpers only create a Rational when
+# the result is a genuine fraction.
+
+# Returns numerator/denominator as an int if it's a whole number, or a Rational otherwise
+def make_rational(numerator, denominator=1):
+  if isinstance(numerator, int) and isinstance(denominator, int):
+    if denominator == 1:
+      return numerator
+    if denominator == 0:
+      raise ZeroDivisionError("Rational division by zero")
+    if denominator < 0:
+      numerator, denominator = -numerator, -denominator
+    g = int_gcd(numerator, denominator)
+    if g != 1:
+      numerator //= g
+      denominator //= g
+    return reduced_rational(numerator, denominator)
+  result = Rational(numerator, denominator)
+  if result._denominator == 1:
+    return result._numerator
+  return result
+
+# Builds a number from an already-reduced fraction with a positive denominator,
+# skipping normalization entirely.
+def reduced_rational(numerator, denominator):
+  if denominator == 1:
+    return numerator
+  return Rational(numerator, denominator, True)
+
+def numerator(number):
+  if isinstance(number, int):
+    return number
+  return number.numerator
+def denominator(number):
+  if isinstance(number, int):
+    return 1
+  return number.denominator
+
+# Exact division of ints and Rationals. Floats fall back to regular division.
+def exact_divide(a, b):
+  if isinstance(a, int) and isinstance(b, int):
+    if a % b == 0:
+      return a // b
+    return Rational(a, b)
+  if isinstance(a, float) or isinstance(b, float):
+    return a / b
+  return make_rational(a, b)
+
+# Exact exponentiation of ints and Rationals.
+# Returns None if the result isn't rational (e.g. 2^(1/2)).
+def exact_power(base, exponent):
+  if isinstance(base, float) or isinstance(exponent, float):
+    return base ** exponent
+  if isinstance(exponent, int):
+    if isinstance(base, int):
+      if exponent >= 0:
+        return base ** exponent
+      if base == 0:
+        raise ZeroDivisionError("0 cannot be raised to a negative power")
+      return make_rational(1, base ** -exponent)
+    return base ** exponent
+  return Rational(base) ** exponent
+
+# An immutable exact fraction. Instances are always fully reduced with a positive
+# denominator, so equal values have equal fields and can be used as dictionary keys.
+# Arithmetic returns plain ints when the result is a whole number.
 class Rational:
-  def __init__(self, numerator, denominator=1):
+  __slots__ = ("_numerator", "_denominator", "_hash")
+
+  # _reduced skips validation and normalization; it's only for internal
+  # use when the fraction is already known to be in lowest terms.
+  def __init__(self, numerator, denominator=1, _reduced=False):
+    self._hash = None
+    if _reduced:
+      self._numerator = numerator
+      self._denominator = denominator
+      return
+
     if isinstance(numerator, Rational):
-      self.numerator = numerator.numerator
-      self.denominator = numerator.denominator
-      if isinstance(denominator, Rational):
-        self.numerator *= denominator.denominator
-        self.denominator *= denominator.numerator
-      else:
-        if int(denominator) != denominator:
-          raise Exception("Rational numbers cannot be created from floats")
-        self.denominator *= denominator
+      n = numerator._numerator
+      d = numerator._denominator
     else:
       if int(numerator) != numerator:
         raise Exception("Rational numbers cannot be created from floats")
-      self.numerator = int(numerator)
-      self.denominator = 1
-      if isinstance(denominator, Rational):
-        self.denominator = denominator.numerator
-        self.numerator *= denominator.denominator
+      n = int(numerator)
+      d = 1
+    if isinstance(denominator, Rational):
+      n *= denominator._denominator
+      d *= denominator._numerator
+    else:
+      if int(denominator) != denominator:
+        raise Exception("Rational numbers cannot be created from floats")
+      d *= int(denominator)
+
+    if d == 0:
+      raise ZeroDivisionError("Rational division by zero")
+    if d < 0:
+      n, d = -n, -d
+    g = int_gcd(n, d)
+    if g != 1:
+      n //= g
+      d //= g
+    self._numerator = n
+    self._denominator = d
+
+  @property
+  def numerator(self):
+    return self._numerator
+  @property
+  def denominator(self):
+    return self._denominator
+
+  def __hash__(self):
+    if self._hash == None:
+      n, d = self._numerator, self._denominator
+      if d == 1:
+        self._hash = hash(n)
+      elif _HASH_MODULUS != None:
+        # Same as CPython's algorithm for Fractions
+        inverse = pow(d, _HASH_MODULUS - 2, _HASH_MODULUS)
+        if inverse == 0:
+          result = sys.hash_info.inf
+        else:
+          result = hash(hash(abs(n)) * inverse)
+        if n < 0:
+          result = -result
+        self._hash = -2 if result == -1 else result
       else:
-        if int(denominator) != denominator:
-          raise Exception("Rational numbers cannot be created from floats")
-        self.denominator = int(denominator)
-    
-    self.reduce()
-  
-  def reduce(self):
-    if self.denominator < 0:
-      self.numerator *= -1
-      self.denominator *= -1
-    g = fast_2_gcd(int(fabs(self.numerator)), int(fabs(self.denominator)))
-    if g == 0:
-      # Probably shouldn't happen, but just in case
-      return
-    self.numerator //= g
-    self.denominator //= g
-  
+        self._hash = hash((n, d))
+    return self._hash
+
   def __add__(self, other):
+    na, da = self._numerator, self._denominator
+    if isinstance(other, int):
+      # a/b + c = (a + cb)/b is already reduced since gcd(a + cb, b) = gcd(a, b) = 1
+      return reduced_rational(na + other * da, da)
     if isinstance(other, Rational):
-      return Rational(self.numerator * other.denominator + other.numerator * self.denominator, self.denominator * other.denominator)
-    return Rational(self.numerator + other * self.denominator, self.denominator)
+      nb, db = other._numerator, other._denominator
+      if da == db:
+        return make_rational(na + nb, da)
+      # Knuth's algorithm; keeps intermediate values small
+      g = int_gcd(da, db)
+      if g == 1:
+        # Coprime denominators never need reducing
+        return Rational(na * db + nb * da, da * db, True)
+      s = da // g
+      t = na * (db // g) + nb * s
+      g2 = int_gcd(t, g)
+      if g2 == 1:
+        return Rational(t, s * db, True)
+      return reduced_rational(t // g2, s * (db // g2))
+    if isinstance(other, float):
+      return float(self) + other
+    return NotImplemented
   def __radd__(self, other):
     return self + other
   
   def __sub__(self, other):
-    if isinstance(other, Rational):
-      return Rational(self.numerator * other.denominator - other.numerator * self.denominator, self.denominator * other.denominator)
-    return Rational(self.numerator - other * self.denominator, self.denominator)
+    if isinstance(other, int) or isinstance(other, Rational) or isinstance(other, float):
+      return self + -other
+    return NotImplemented
   def __rsub__(self, other):
     return -self + other
 
   def __mul__(self, other):
+    na, da = self._numerator, self._denominator
+    if isinstance(other, int):
+      if other == 0:
+        return 0
+      g = int_gcd(other, da)
+      return reduced_rational(na * (other // g), da // g)
     if isinstance(other, Rational):
-      return Rational(self.numerator * other.numerator, self.denominator * other.denominator)
-    return Rational(self.numerator * other, self.denominator)
+      nb, db = other._numerator, other._denominator
+      g1 = int_gcd(na, db)
+      g2 = int_gcd(nb, da)
+      return reduced_rational((na // g1) * (nb // g2), (da // g2) * (db // g1))
+    if isinstance(other, float):
+      return float(self) * other
+    return NotImplemented
   def __rmul__(self, other):
     return self * other
   
   def __truediv__(self, other):
+    if isinstance(other, int):
+      if other == 0:
+        raise ZeroDivisionError("Rational division by zero")
+      return self * Rational(1, other) if other != 1 else self
     if isinstance(other, Rational):
-      return Rational(self.numerator * other.denominator, self.denominator * other.numerator)
-    return Rational(self.numerator, self.denominator * other)
+      return self * other._reciprocal()
+    if isinstance(other, float):
+      return float(self) / other
+    return NotImplemented
   def __rtruediv__(self, other):
-    return Rational(other) / self
+    if isinstance(other, int):
+      return self._reciprocal() * other
+    if isinstance(other, float):
+      return other / float(self)
+    return NotImplemented
+  
+  def _reciprocal(self):
+    n, d = self._numerator, self._denominator
+    if n == 0:
+      raise ZeroDivisionError("Rational division by zero")
+    if n < 0:
+      return reduced_rational(-d, -n)
+    return reduced_rational(d, n)
   
   def __floordiv__(self, other):
-    return (self / other).__int__()
+    if isinstance(other, int):
+      return self._numerator // (self._denominator * other)
+    if not isinstance(other, Rational):
+      other = Rational(other)
+    return (self._numerator * other._denominator) // (self._denominator * other._numerator)
   def __rfloordiv__(self, other):
     return Rational(other) // self
 
   def __mod__(self, other):
-    if not isinstance(other, Rational):
+    if not isinstance(other, Rational) and not isinstance(other, int):
       other = Rational(other)
     return self - other * (self // other)
   def __rmod__(self, other):
     return Rational(other) % self
 
-  def __lt__(self, other):
+  # Returns (a, b) such that comparing a to b is the same as comparing self to other
+  def _cross(self, other):
+    if isinstance(other, int):
+      return self._numerator, other * self._denominator
+    if isinstance(other, float):
+      return float(self), other
     if not isinstance(other, Rational):
       other = Rational(other)
-    return self.numerator * other.denominator < other.numerator * self.denominator
+    return self._numerator * other._denominator, other._numerator * self._denominator
+
+  def __lt__(self, other):
+    a, b = self._cross(other)
+    return a < b
   
   def __le__(self, other):
-    if not isinstance(other, Rational):
-      other = Rational(other)
-    return self.numerator * other.denominator <= other.numerator * self.denominator
+    a, b = self._cross(other)
+    return a <= b
   
   def __gt__(self, other):
-    if not isinstance(other, Rational):
-      other = Rational(other)
-    return self.numerator * other.denominator > other.numerator * self.denominator
+    a, b = self._cross(other)
+    return a > b
   
   def __ge__(self, other):
-    if not isinstance(other, Rational):
-      other = Rational(other)
-    return self.numerator * other.denominator >= other.numerator * self.denominator
+    a, b = self._cross(other)
+    return a >= b
   
   def __eq__(self, other):
-    if not isinstance(other, Rational):
-      if other == None:
-        return False
-      other = Rational(other)
-    return self.numerator == other.numerator and self.denominator == other.denominator
+    if isinstance(other, Rational):
+      return self._numerator == other._numerator and self._denominator == other._denominator
+    if isinstance(other, int):
+      return self._denominator == 1 and self._numerator == other
+    if isinstance(other, float):
+      # Compare exactly where we can so equality agrees with hashing
+      try:
+        n, d = other.as_integer_ratio()
+      except (AttributeError, ValueError, OverflowError):
+        return float(self) == other
+      return self._numerator == n and self._denominator == d
+    if other == None:
+      return False
+    if hasattr(other, "denominator"):
+      # Fractions from other number backends are also always reduced
+      return self._numerator == other.numerator and self._denominator == other.denominator
+    other = Rational(other)
+    return self._numerator == other._numerator and self._denominator == other._denominator
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __bool__(self):
+    return self._numerator != 0
   
   def __str__(self):
-    if self.denominator == 1:
-      return str(int(self.numerator))
-    return str(int(self.numerator)) + "/" + str(int(self.denominator))
+    if self._denominator == 1:
+      return str(self._numerator)
+    return str(self._numerator) + "/" + str(self._denominator)
   
   def __repr__(self):
     return str(self)
   
   def __neg__(self):
-    return Rational(-self.numerator, self.denominator)
+    return reduced_rational(-self._numerator, self._denominator)
   
   def __abs__(self):
-    return Rational(abs(self.numerator), abs(self.denominator))
+    return reduced_rational(abs(self._numerator), self._denominator)
   
   # Returns None if the result is not a rational number
   def __pow__(self, other):
-    if not isinstance(other, Rational):
+    if isinstance(other, Rational):
+      if other._denominator != 1:
+        return None
+      other = other._numerator
+    elif not isinstance(other, int):
       other = Rational(other)
-    if other.denominator == 1:
-      power = other.numerator
-      if power >= 0:
-        return Rational(self.numerator ** power, self.denominator ** power)
-      else: # Negative power
-        return Rational(self.denominator ** abs(power), self.numerator ** abs(power))
-    return None
+      if other._denominator != 1:
+        return None
+      other = other._numerator
+    n, d = self._numerator, self._denominator
+    # Powers of coprime numbers are still coprime, so there's nothing to reduce
+    if other >= 0:
+      return reduced_rational(n ** other, d ** other)
+    if n == 0:
+      raise ZeroDivisionError("Rational division by zero")
+    if n < 0:
+      return reduced_rational((-d) ** -other, (-n) ** -other)
+    return reduced_rational(d ** -other, n ** -other)
 
   def __float__(self):
-    return self.numerator / self.denominator
+    return self._numerator / self._denominator
   
   def __int__(self):
-    return int(self.numerator // self.denominator)
\ No newline at end of file
+    return self._numerator // self._denominator
@@ -1,13 +1,44 @@
-from cas_parser import parse_to_ast, ParseException
+import sys
+from cas_parser import ParseException
+from cas_cse import eliminate_common_subexpressions
+from cas_worksheet import Worksheet
+from cas_roots import find_roots
 
+# Variables and functions the user has defined
+worksheet = Worksheet()
+
+# Returns the parsed expression, or None if it couldn't be parsed or was a definition
 def parse(str):
   try:
-    return parse_to_ast(str)
+    if "=" in str:
+      changed = worksheet.set(str)
+      print("Defined " + str.strip())
+      if len(changed) > 1:
+        print("Updated " + ", ".join(changed[1:]))
+      return None
+    return worksheet.parse(str)
   except ParseException as e:
     print("Error parsing expression")
     print(e)
     return None
+  except Exception as e:
+    print(e)
+    return None
+
+def print_worksheet():
+  for name in worksheet.names():
+    cell = worksheet.cell(name)
+    if cell.error != None:
+      print(cell.text + "  (" + cell.error + ")")
+    elif cell.function != None:
+      print(cell.function.__str__())
+    else:
+      try:
+        print(name + " = " + worksheet.simplified(name).pretty_str(100))
+      except Exception as e:
+        print(cell.text + "  (" + e.__str__() + ")")
 
+print("Variables and functions can be defined like a = 2 or f(x) = x^2*sin(x)")
 ast = None
 while ast == None:
   str = input("Expression: ")
@@ -20,43 +51,79 @@ while True:
   print("1. Derivative")
   print("2. Evaluate")
   print("3. Simplify")
-  print("4. New expression")
-  print("5. Exit")
+  print("4. Expand")
+  print("5. New expression")
+  print("6. Find roots")
+  print("7. Worksheet")
+  print("8. Exit")
 
   option = input("Option: ")
 
   if option == "1":
     var = input("Variable of differentiation: ")
     
-    simplified_ast = ast.simplify(expand_logarithms=False)
+    simplified_ast = worksheet.substitute(ast).simplify(expand_logarithms=False)
     derivative = simplified_ast.derivative(var)
 
     print("\n*** Derivative: ", end="")
-    print(derivative.pretty_str(100))
+    # Derivatives can get huge, so they're written out as they're printed
+    derivative.write_pretty(sys.stdout)
+    print()
+    # Big derivatives repeat a lot, so also show them with the repeats pulled out
+    shared = eliminate_common_subexpressions(derivative)
+    if len(shared.bindings) > 0:
+      print("*** With common subexpressions:")
+      print(shared.pretty_str(100))
   elif option == "2":
-    simplified_ast = ast.simplify(expand_logarithms=False)
+    simplified_ast = worksheet.substitute(ast).simplify(expand_logarithms=False)
     
     variables = simplified_ast.get_variables()
     values = {}
     for var in variables:
       values[var] = int(input("Value of " + var + ": "))
-    new_ast = simplified_ast.substitute_with_numbers(values)
-
-    print("\n*** Exact result: ", end="")
-    exact = new_ast.simplify()
+    # Anything that can't be exact, like sin(2), is left in the result
+    exact = simplified_ast.exact_eval(values)
+    # Huge coefficients are approximated; see cas_settings.MAX_COEFFICIENT_BITS
+    print("\n*** Exact result: " if exact.is_exact() else "\n*** Result (approximated): ", end="")
     print(exact.pretty_str(100))
     if not exact.is_integer():
       print("*** Approximate result: ", end="")
-      print(new_ast.eval())
+      print(exact.eval())
   elif option == "3":
     # TODO: Expand_logarithms should be only used on explicit user request
-    simplified_ast = ast.simplify(expand_logarithms=True) # TODO: Allow the user to configure this
-    print("\n*** Simplified: ", end="")
+    simplified_ast = worksheet.substitute(ast).simplify(expand_logarithms=True) # TODO: Allow the user to configure this
+    print("\n*** Simplified: " if simplified_ast.is_exact() else "\n*** Simplified (approximated): ", end="")
     print(simplified_ast.pretty_str(100))
   elif option == "4":
+    # Expansions that would be too big are left alone; see cas_settings.MAX_EXPANSION_TERMS
+    expanded_ast = worksheet.substitute(ast).expand(expand_logarithms=False)
+    print("\n*** Expanded: " if expanded_ast.is_exact() else "\n*** Expanded (approximated): ", end="")
+    print(expanded_ast.pretty_str(100))
+  elif option == "5":
     ast = None
     while ast == None:
       str = input("Expression: ")
       ast = parse(str)
-  elif option == "5":
+  elif option == "6":
+    var = input("Variable: ")
+    try:
+      # The ends can be expressions, like 2*pi
+      start = worksheet.resolve(worksheet.parse(input("Start of interval: "))).eval()
+      end = worksheet.resolve(worksheet.parse(input("End of interval: "))).eval()
+      roots = find_roots(worksheet.substitute(ast), var, (start, end))
+    except Exception as e:
+      print(e)
+      continue
+    if len(roots) == 0:
+      print("\n*** No roots found")
+    else:
+      print("\n*** Roots: " + ", ".join([repr(root) for root in roots]))
+  elif option == "7":
+    print()
+    print_worksheet()
+    # Lets the user change definitions without leaving the current expression
+    str = input("Definition (empty to go back): ")
+    if str != "":
+      parse(str)
+  elif option == "8":
     break
\ No newline at end of file
@@ -0,0 +1,167 @@
+from cas_ast import *
+from cas_compile import CompiledExpression
+
+# Numeric root finding.
+#
+# find_roots compiles the expression and its derivative once (see cas_compile.py), samples
+# the interval at evenly spaced starting points, and runs a search from each one:
+#  - Between neighbouring samples where the sign changes, safeguarded Newton's method, which
+#    falls back to bisection whenever a Newton step leaves the bracket or doesn't shrink it
+#    enough, so it always converges.
+#  - From samples where |f| is smaller than at both neighbours, plain Newton's method, which
+#    finds roots that touch zero without crossing it, like x^2.
+# Every search takes one step per round, so they all make progress together, and the
+# rounds stop when they've all finished or the iteration or time budget runs out.
+
+# Micropython doesn't have perf_counter, but it has ticks_us.
+try:
+  from time import perf_counter
+  def now():
+    return perf_counter()
+except ImportError:
+  try:
+    from time import ticks_us, ticks_diff
+    _start_ticks = ticks_us()
+    def now():
+      return ticks_diff(ticks_us(), _start_ticks) / 1000000
+  except ImportError:
+    from time import time as now
+
+# Returns f(x) as a float, or None if f isn't defined (or isn't real) there
+def try_call(f, x):
+  try:
+    value = f(x)
+  except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+    return None
+  if isinstance(value, complex):
+    return None
+  value = to_float(value)
+  if value != value or value in (float("inf"), float("-inf")):
+    return None
+  return value
+
+# Whether two values have different signs
+def sign_change(a, b):
+  return a != None and b != None and a != 0 and b != 0 and (a < 0) != (b < 0)
+
+class RootSearch:
+  # limit: how far from 0 the value can be at the end for it to count as a root
+  # lo and hi bracket a sign change, where lo_value is the value at lo, if they're given
+  def __init__(self, x, value, limit, lo=None, hi=None, lo_value=None):
+    self.x = x
+    self.value = value
+    self.limit = limit
+    self.bracketed = lo != None
+    self.lo = lo
+    self.hi = hi
+    self.lo_value = lo_value
+    # The bracket's width before the last step, for deciding whether Newton is shrinking it fast enough
+    self.last_width = None if lo == None else hi - lo
+    self.done = False
+    self.converged = False
+
+  # Takes one step; f and df are the compiled function and derivative
+  def step(self, f, df, x_tolerance):
+    x = self.x
+    slope = try_call(df, x)
+    guess = None
+    if slope != None and slope != 0:
+      guess = x - self.value / slope
+    if self.bracketed:
+      width = self.hi - self.lo
+      # Bisect when Newton leaves the bracket, or when the last step didn't halve it
+      if guess == None or not (self.lo < guess < self.hi) or width > self.last_width / 2:
+        guess = (self.lo + self.hi) / 2
+      self.last_width = width
+    elif guess == None:
+      self.done = True
+      return
+    value = try_call(f, guess)
+    if value == None:
+      if not self.bracketed:
+        self.done = True
+        return
+      # Assume the undefined point is on the side of the bracket it's closest to
+      guess = (self.lo + self.hi) / 2
+      value = try_call(f, guess)
+      if value == None:
+        self.done = True
+        return
+    step = abs(guess - x)
+    self.x = guess
+    self.value = value
+    if self.bracketed:
+      if value == 0:
+        self.lo = self.hi = guess
+      elif (value < 0) == (self.lo_value < 0):
+        self.lo = guess
+        self.lo_value = value
+      else:
+        self.hi = guess
+      if self.hi - self.lo <= x_tolerance * max(1, abs(guess)):
+        self.done = self.converged = True
+    if value == 0 or step <= x_tolerance * max(1, abs(guess)):
+      self.done = self.converged = True
+
+# Returns the real roots of expr (a function of var) in interval, a (start, end) pair, in order.
+# samples: how many evenly spaced starting points to search from; roots closer together than
+#   the spacing can be missed
+# max_iterations: the most steps any one search takes
+# time_limit: the most seconds to spend searching; whatever's been found by then is returned
+# tolerance: how close together roots (and steps) have to be to count as the same
+# value_tolerance: how close to 0 the expression has to be for a root that isn't bracketed by a sign change
+def find_roots(expr, var, interval, context=None, samples=64, max_iterations=100, time_limit=1.0, tolerance=1e-12, value_tolerance=1e-9):
+  context = get_context(context)
+  deadline = now() + time_limit
+  simplified = expr.simplify(expand_logarithms=False, context=context)
+  f = CompiledExpression(simplified, (var,), context)
+  df = CompiledExpression(simplified.derivative(var, context), (var,), context)
+
+  start, end = to_float(interval[0]), to_float(interval[1])
+  if start > end:
+    start, end = end, start
+  count = max(samples, 2)
+  points = [start + (end - start) * i / (count - 1) for i in range(count)]
+  values = [try_call(f, x) for x in points]
+
+  roots = []
+  searches = []
+  for i in range(count):
+    value = values[i]
+    if value == None:
+      continue
+    if value == 0:
+      roots.append(points[i])
+      continue
+    before = values[i - 1] if i > 0 else None
+    after = values[i + 1] if i + 1 < count else None
+    if sign_change(value, after):
+      # There's a root (or a pole) before the next sample, so start from whichever end is closer to 0.
+      # Poles change sign too, so the value there has to end up smaller than at either end.
+      if abs(value) < abs(after):
+        searches.append(RootSearch(points[i], value, abs(value), points[i], points[i + 1], value))
+      else:
+        searches.append(RootSearch(points[i + 1], after, abs(after), points[i], points[i + 1], value))
+    elif not sign_change(before, value)\
+      and (before == None or abs(value) < abs(before)) and (after == None or abs(value) < abs(after)):
+      searches.append(RootSearch(points[i], value, value_tolerance))
+
+  iteration = 0
+  active = searches
+  while len(active) > 0 and iteration < max_iterations and now() < deadline:
+    for search in active:
+      search.step(f, df, tolerance)
+    active = [search for search in active if not search.done]
+    iteration += 1
+
+  for search in searches:
+    if search.converged and start <= search.x <= end and abs(search.value) <= search.limit:
+      roots.append(search.x)
+
+  # Searches from different starts often find the same root
+  roots.sort()
+  unique = []
+  for root in roots:
+    if len(unique) == 0 or abs(root - unique[-1]) > max(tolerance * 1000, 1e-9) * max(1, abs(root)):
+      unique.append(root)
+  return unique
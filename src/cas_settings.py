@@ -1,5 +1,109 @@
+# These module settings are only defaults. Everything that parses, simplifies,
+# differentiates or evaluates also takes an EngineContext, which overrides them
+# for that call without affecting anything else running at the same time.
+
 # If we should use a rational representation for numbers
 # instead of floating point. This is slower, but guarentees
 # exact results.
 
-USE_RATIONALS = True
\ No newline at end of file
+USE_RATIONALS = True
+
+# The number backend used for rationals; see cas_numbers.py.
+# "auto" uses gmpy2 if it's installed and our own Rational otherwise.
+# Other options are "rational", "fraction" (the standard library's fractions) and "gmpy2".
+
+NUMBER_BACKEND = "auto"
+
+# Exact coefficients bigger than this many bits (in the numerator or denominator)
+# are replaced with floats while simplifying, since arithmetic on huge
+# rationals gets very slow. Results with floats in them aren't exact; see ASTNode.is_exact.
+# None means coefficients are always kept exact.
+
+MAX_COEFFICIENT_BITS = 4096
+
+# Expanding products of sums (see ASTNode.expand) can create a huge number of terms;
+# (x+y+z)^20 has 231 and (a+b)(c+d)...(o+p) has 256. Expansions that would create
+# more terms than this are left unexpanded. None means there's no limit.
+
+MAX_EXPANSION_TERMS = 1000
+
+# Settings for one use of the engine.
+# Contexts aren't changed after they're created, so they can be shared between threads.
+class EngineContext:
+  # backend: a number backend or its name; defaults to the settings above
+  # use_rationals: if False, numbers are floats and backend is ignored; defaults to
+  #   USE_RATIONALS, unless a backend is given
+  # max_coefficient_bits: see MAX_COEFFICIENT_BITS
+  # max_expansion_terms: see MAX_EXPANSION_TERMS
+  def __init__(self, backend=None, use_rationals=None, max_coefficient_bits="default", max_expansion_terms="default"):
+    from cas_numbers import get_backend
+    if use_rationals == None:
+      use_rationals = USE_RATIONALS if backend == None else True
+    if not use_rationals:
+      backend = "float"
+    elif backend == None:
+      backend = NUMBER_BACKEND
+    self.backend = get_backend(backend)
+    if max_coefficient_bits == "default":
+      max_coefficient_bits = MAX_COEFFICIENT_BITS
+    self.max_coefficient_bits = max_coefficient_bits
+    # Integers are too big exactly when they're outside of (-bound, bound)
+    self._bound = 1 << max_coefficient_bits if max_coefficient_bits != None else None
+    if max_expansion_terms == "default":
+      max_expansion_terms = MAX_EXPANSION_TERMS
+    self.max_expansion_terms = max_expansion_terms
+
+  # Whether numbers are represented exactly
+  @property
+  def exact(self):
+    return self.backend.exact
+
+  # Whether a coefficient is too big to keep exact
+  def too_big(self, number):
+    if self._bound == None:
+      return False
+    if isinstance(number, int):
+      return not -self._bound < number < self._bound
+    from cas_numbers import coefficient_bits
+    return coefficient_bits(number) > self.max_coefficient_bits
+
+  # Whether base^exponent would obviously be too big to keep exact, without computing it
+  def power_too_big(self, base, exponent):
+    if self.max_coefficient_bits == None or not isinstance(exponent, int):
+      return False
+    from cas_numbers import coefficient_bits
+    # A b-bit number is at least 2^(b-1)
+    return (coefficient_bits(base) - 1) * abs(exponent) > self.max_coefficient_bits
+
+  # Returns number, or a float approximation if it's too big to keep exact
+  def limit(self, number):
+    if not self.too_big(number):
+      return number
+    from cas_numbers import to_float
+    try:
+      approximation = to_float(number)
+    except OverflowError:
+      approximation = 0.0
+    if approximation == 0.0 or approximation - approximation != 0.0:
+      # Out of the range of floats, so exact is the only option
+      return number
+    return approximation
+
+  # Whether an expansion creating this many terms is allowed
+  def can_expand(self, terms):
+    return self.max_expansion_terms == None or terms <= self.max_expansion_terms
+
+# The default context is rebuilt whenever the settings above change
+_default_context = None
+_default_settings = None
+
+def default_context():
+  global _default_context, _default_settings
+  settings = (USE_RATIONALS, NUMBER_BACKEND, MAX_COEFFICIENT_BITS, MAX_EXPANSION_TERMS)
+  if settings != _default_settings:
+    _default_context = EngineContext()
+    _default_settings = settings
+  return _default_context
+
+def get_context(context=None):
+  return default_context() if context == None else context
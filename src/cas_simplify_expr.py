@@ -1,8 +1,31 @@
 from cas_ast import *
 from math import *
 from cas_functions import ASTFunctionCall
-from cas_rational import gcd
-import cas_settings
+
+# How much each type of factor moves a term to the front when sorting terms; see ExpressionTerm.sort_position
+TERM_PRECEDENCE = {
+  ASTNumber: 5,
+  ASTVariable: 10,
+  ASTFunctionCall: 0,
+  ASTPower: 20,
+  ASTSum: 30,
+  ASTProduct: 40,
+  ASTLogarithm: 50,
+}
+
+def term_precedence(term):
+  precedence = TERM_PRECEDENCE.get(type(term))
+  if precedence == None:
+    # Functions like FunctionSin count as ASTFunctionCall, π and e as numbers, and d/dx as a variable
+    if isinstance(term, ASTFunctionCall):
+      precedence = TERM_PRECEDENCE[ASTFunctionCall]
+    elif isinstance(term, ASTConstant):
+      precedence = TERM_PRECEDENCE[ASTNumber]
+    else:
+      precedence = TERM_PRECEDENCE[ASTVariable]
+    # Remembered, so each type is only looked up once
+    TERM_PRECEDENCE[type(term)] = precedence
+  return precedence
 
 # A class that simplifies a nested expression and its terms
 class ExpressionReducer:
@@ -16,7 +39,21 @@ class ExpressionReducer:
     for i in range(len(self.terms)):
       self.terms[i] = self.terms[i].reduce()
     
-    # Remove 0 terms
+    if len(self.terms) > 1:
+      # Combine like terms, finding them by their factors in canonical order
+      positions = {}
+      combined = []
+      for term in self.terms:
+        key = tuple(term.terms) if len(term.terms) < 2 else tuple(sorted(term.terms, key=sort_key))
+        i = positions.get(key)
+        if i == None:
+          positions[key] = len(combined)
+          combined.append(term)
+        else:
+          combined[i].constant += term.constant
+      self.terms = combined
+    
+    # Remove 0 terms, including like terms that cancelled out
     i = 0
     while i < len(self.terms):
       if self.terms[i].constant == 0:
@@ -24,33 +61,24 @@ class ExpressionReducer:
         i -= 1
       i += 1
     
-    if len(self.terms) > 1:
-      # Combine like terms
-      # This is really inefficient, but it works.
-      # TODO: use a hash table or something
-      i = 0
-      while i < len(self.terms):
-        term = self.terms[i]
-        j = i + 1
-        while j < len(self.terms):
-          other = self.terms[j]
-          if term.terms == other.terms:
-            term.constant += other.constant
-            self.terms.pop(j)
-            j -= 1
-          j += 1
-        i += 1
-      
-      # Factor out common terms
-      common_factors = set(self.terms[0].terms)
+    # Factor out common terms, unless we're expanding, since that would undo it
+    if len(self.terms) > 1 and not self.state.expand:
+      # Common bases are factored out to their smallest power, like x^2+x = x(x+1)
+      common_powers = self.terms[0].powers()
       for term in self.terms[1:]:
-        common_factors.intersection_update(term.terms)
+        powers = term.powers()
+        for base in list(common_powers):
+          if base not in powers:
+            del common_powers[base]
+          elif powers[base] < common_powers[base]:
+            common_powers[base] = powers[base]
+        if len(common_powers) == 0:
+          break
       
-      if len(common_factors) > 0:
-        self.common_terms.extend(common_factors)
+      for base, exponent in common_powers.items():
+        self.common_terms.append(base if exponent == 1 else ASTPower(base, ASTNumber(exponent)))
         for term in self.terms:
-          for factor in common_factors:
-            term.terms.remove(factor)
+          term.remove_power(base, exponent)
       
       coefficients = []
       all_negative = True
@@ -62,7 +90,7 @@ class ExpressionReducer:
         all_negative &= term.constant < 0 
       
       if len(coefficients) > 0:
-        hcf = gcd(coefficients) * (-1 if all_negative else 1)
+        hcf = self.state.backend.gcd(coefficients) * (-1 if all_negative else 1)
 
         if hcf != 1:
           self.common_terms.append(
@@ -77,7 +105,7 @@ class ExpressionReducer:
     parts = list(self.terms) # clone
     
     if len(parts) == 0:
-      return ASTNumber(0)
+      return ZERO
     
     if self.state.sort_terms:
       parts.sort(reverse=True,key=lambda x: x.sort_position())
@@ -87,13 +115,19 @@ class ExpressionReducer:
       terms = list(self.common_terms)
     
     if len(parts) > 0:
-      terms.append(ASTSum([part.to_ast() for part in parts]))
+      remaining = [part.to_ast() for part in parts]
+      if len(self.common_terms) > 0:
+        # The product of the common terms and what's left gets reduced again, which can
+        # combine terms that are alike now, but each term on its own is already reduced
+        for part in remaining:
+          self.state.remember(part, part)
+      terms.append(ASTSum(remaining))
     
     if len(terms) == 0:
-      return ASTNumber(0)
+      return ZERO
     
     if self.state.sort_terms:
-      terms.sort(key=lambda x: x.__str__())
+      terms.sort(key=sort_key)
     
     if len(terms) == 1:
       return terms[0]
@@ -104,12 +138,15 @@ class ExpressionTerm:
   def __init__(self, term, state):
     self.state = state
 
+    # Factors are tuples, but we need a list we can change
     if isinstance(term, ASTProduct):
-      self.terms = term.factors
+      self.terms = list(term.factors)
     elif isinstance(term, list):
       self.terms = term
     else:
       self.terms = [term]
+    # Kept so to_ast can return it when nothing changed
+    self.original = term if isinstance(term, ASTNode) else None
     
     self.compute_constant()
   
@@ -121,18 +158,9 @@ class ExpressionTerm:
   # This is a bit hacky, but it mostly works well enough
   # Higher numbers are sorted to the front
   def sort_position(self):
-    sort_precedence = {
-      ASTNumber: 5,
-      ASTVariable: 10,
-      ASTFunctionCall: 0,
-      ASTPower: 20,
-      ASTSum: 30,
-      ASTProduct: 40,
-      ASTLogarithm: 50,
-    }
     return \
       len(self.terms) * 100 +\
-      sum([sort_precedence[type(term)] for term in self.terms]) +\
+      sum([term_precedence(term) for term in self.terms]) +\
       (105 if self.constant != 1 else 0) -\
       (1000 if self.constant < 0 else 0)
   
@@ -141,27 +169,35 @@ class ExpressionTerm:
     return self
   
   def divide(self, by):
-    self.constant /= by
+    self.constant = self.state.backend.divide(self.constant, by)
   
   def is_number(self):
     return len(self.terms) == 0
   
   def compute_constant(self):
-    self.constant = Rational(1) if cas_settings.USE_RATIONALS else 1
+    self.constant = 1
+    # The number factors that went into the constant
+    self.numbers = []
     self.reduce()
     
     i = 0
     while i < len(self.terms):
       term = self.terms[i]
+      if isinstance(term, ASTProduct):
+        # Reducing can turn a factor into a product (like a sum with one term),
+        # whose numbers need to be merged into the constant too
+        self.terms[i:i + 1] = term.factors
+        continue
       if isinstance(term, ASTNumber):
         self.constant *= term.number
+        self.numbers.append(term)
         self.terms.pop(i)
         i -= 1
       
       if isinstance(term, ASTPower) and term.exponent.is_exactly(-1):
         base = term.base
         if base.is_number():
-          self.constant /= base.number
+          self.divide(base.number)
           self.terms.pop(i)
         elif isinstance(base, ASTProduct):
           # TODO Recursively extract constant
@@ -169,12 +205,96 @@ class ExpressionTerm:
           non_constant_base_factors = []
           for factor in base.factors:
             if isinstance(factor, ASTNumber):
-              self.constant /= factor.number
+              self.divide(factor.number)
             else:
               non_constant_base_factors.append(factor)
-          self.terms[i] = ASTPower(ASTProduct(non_constant_base_factors), ASTNumber(-1))
+          self.terms[i] = ASTPower(ASTProduct(non_constant_base_factors), NEG_ONE)
 
       i += 1
+    
+    self.combine_powers()
+  
+  # Merges factors with the same base by adding their exponents, like x*y*x^2 = x^3*y
+  # and x^2*x^-1 = x. Bases are found with a dictionary, so this is one pass over the factors.
+  def combine_powers(self):
+    if len(self.terms) < 2:
+      return
+    # The bases in the order they first appear, with their exponents and the first factor
+    positions = {}
+    bases = []
+    merged = False
+    for term in self.terms:
+      if isinstance(term, ASTPower):
+        base, exponent = term.base, term.exponent
+      else:
+        base, exponent = term, ONE
+      i = positions.get(base)
+      if i == None:
+        positions[base] = len(bases)
+        bases.append((base, [exponent], term))
+      else:
+        bases[i][1].append(exponent)
+        merged = True
+    if not merged:
+      return
+    
+    terms = []
+    for base, exponents, term in bases:
+      if len(exponents) == 1:
+        terms.append(term)
+        continue
+      number = 0
+      others = []
+      for exponent in exponents:
+        if exponent.is_number():
+          number += exponent.number
+        else:
+          others.append(exponent)
+      if len(others) > 0:
+        if number != 0:
+          others.append(ASTNumber(number))
+        exponent = ASTSum(others).reduce(self.state)
+      elif number == 0:
+        # x^a*x^-a = 1
+        continue
+      else:
+        exponent = ASTNumber(number)
+      power = base if exponent.is_exactly(1) else ASTPower(base, exponent).reduce(self.state)
+      # Powers of numbers can reduce to numbers, like 2^(1/2)*2^(1/2) = 2
+      for factor in (power.factors if isinstance(power, ASTProduct) else (power,)):
+        if factor.is_number():
+          self.constant *= factor.number
+        else:
+          terms.append(factor)
+    self.terms = terms
+  
+  # Returns a dictionary of the factors' bases and their positive numeric exponents; other factors have an exponent of 1
+  def powers(self):
+    powers = {}
+    for term in self.terms:
+      if isinstance(term, ASTPower) and term.exponent.is_number() and term.exponent.number > 0:
+        powers[term.base] = term.exponent.number
+      else:
+        powers[term] = 1
+    return powers
+  
+  # Divides by base^exponent, where base is one of the bases from powers()
+  def remove_power(self, base, exponent):
+    for i, term in enumerate(self.terms):
+      if term == base:
+        # The smallest power can be fractional, like x^(1/2) in x^(1/2)+x, leaving x^(1/2) here
+        remaining = 1 - exponent
+      elif isinstance(term, ASTPower) and term.base == base and term.exponent.is_number():
+        remaining = term.exponent.number - exponent
+      else:
+        continue
+      if remaining == 0:
+        self.terms.pop(i)
+      elif remaining == 1:
+        self.terms[i] = base
+      else:
+        self.terms[i] = ASTPower(base, ASTNumber(remaining))
+      return
   
   def reduce(self):
     for i in range(len(self.terms)):
@@ -182,15 +302,28 @@ class ExpressionTerm:
 
     return self
   
+  # Returns an ASTNumber for the constant, reusing the original number if it didn't change
+  def constant_ast(self):
+    if len(self.numbers) == 1:
+      number = self.numbers[0].number
+      if number == self.constant and type(number) == type(self.constant):
+        return self.numbers[0]
+    return ASTNumber(self.constant)
+  
   def to_ast(self):
+    self.constant = self.state.context.limit(self.constant)
     if len(self.terms) == 0 or self.constant == 0:
-      return ASTNumber(self.constant)
+      return self.constant_ast()
     
     if self.state.sort_terms:
-      self.terms.sort(key=lambda x: x.__str__())
+      self.terms.sort(key=sort_key)
     
     if self.constant == 1:
       if len(self.terms) == 1:
         return self.terms[0]
-      return ASTProduct(self.terms)
-    return ASTProduct([ASTNumber(self.constant)] + self.terms)
\ No newline at end of file
+      factors = self.terms
+    else:
+      factors = [self.constant_ast()] + self.terms
+    if isinstance(self.original, ASTProduct) and same_nodes(self.original.factors, factors):
+      return self.original
+    return ASTProduct(factors)
\ No newline at end of file
@@ -1,9 +1,14 @@
 from cas_parser import parse_to_ast
 from cas_ast import *
+from cas_rational import Rational
+from cas_functions import ASTFunctionCall
 from math import *
 
+# These are only the defaults; tests for other settings pass their own EngineContext.
+# Results are checked with the calculator's backend; other backends have their own tests.
 import cas_settings
 cas_settings.USE_RATIONALS = True
+cas_settings.NUMBER_BACKEND = "rational"
 
 QUIET = False
 COLLAPSE_CATEGORIES = False
@@ -222,6 +227,62 @@ def rational_tests():
   test_assert_equal(str(Rational(5)), "5", "Rational string integer")
   test_end_collapsed_category()
 
+  test_collapsed_category("Integer fast path")
+  from cas_rational import make_rational, exact_divide, exact_power
+  test_assert_equal(type(make_rational(6, 3)), int, "Whole rationals are ints")
+  test_assert_equal(make_rational(3, 6), Rational(1, 2), "Fractions stay rational")
+  test_assert_equal(type(Rational(3, 2) * Rational(2, 3)), int, "Rational arithmetic demotes whole results")
+  test_assert_equal(type(Rational(1, 2) + Rational(1, 2)), int, "Rational addition demotes whole results")
+  test_assert_equal(exact_divide(6, 3), 2, "Exact integer division")
+  test_assert_equal(exact_divide(3, 6), Rational(1, 2), "Exact division promotes to rational")
+  test_assert_equal(exact_power(2, -3), Rational(1, 8), "Exact negative power")
+  test_assert_equal(exact_power(4, Rational(1, 2)), None, "Exact rational power of an integer isn't supported")
+  test_assert_equal(exact_power(Rational(4, 9), 2), Rational(16, 81), "Exact power of a rational")
+  test_assert_equal(type(ASTNumber(5).number), int, "Integers aren't boxed")
+  test_assert_equal(type(ASTNumber(Rational(10, 2)).number), int, "Whole rationals are unboxed")
+  if get_context().exact: # Coefficients are floats without rationals
+    test_assert_equal(type(parse_to_ast("3*x+4*x").simplify().factors[0].number), int, "Simplification keeps integers")
+  test_end_collapsed_category()
+
+  test_collapsed_category("Rational value semantics")
+  test_assert_equal(hash(Rational(6, 3)), hash(2), "Whole rationals hash like ints")
+  test_assert_equal(hash(Rational(1, 2)) == hash(0.5), True, "Rationals hash like equal floats")
+  test_assert_equal({Rational(2, 4): "half"}[Rational(1, 2)], "half", "Rationals as dictionary keys")
+  test_assert_equal(Rational(1, 2) == 0.5, True, "Rational float equality")
+  test_assert_equal(Rational(1, 3) == 1 / 3, False, "Rational float equality is exact")
+  test_assert_equal(Rational(10 ** 400 + 1, 3) - Rational(1, 3), Rational(10 ** 400, 3), "Rationals with huge numerators")
+  test_assert_equal(Rational(2, -6).denominator, 3, "Rational denominators are positive")
+  test_assert_equal(Rational(-2, 3) ** -3, Rational(-27, 8), "Rational negative power of a negative")
+  test_assert_equal(3 / Rational(-6, 7), Rational(-7, 2), "Rational reciprocal of a negative")
+  immutable = False
+  try:
+    Rational(1, 2).numerator = 5
+  except AttributeError:
+    immutable = True
+  test_assert_equal(immutable, True, "Rationals are immutable")
+  test_end_collapsed_category()
+
+  test_collapsed_category("Factorization")
+  from cas_factor import is_prime, prime_factors, perfect_power
+  from cas_rational import exact_rational_log
+  test_assert_equal(is_prime(2 ** 61 - 1), True, "Large prime")
+  test_assert_equal(is_prime(1000003 * 1000033), False, "Large semiprime isn't prime")
+  test_assert_equal(prime_factors(600851475143), {71: 1, 839: 1, 1471: 1, 6857: 1}, "Factor with large primes")
+  test_assert_equal(prime_factors(1000003 ** 3 * 1000033), {1000003: 3, 1000033: 1}, "Factor with Pollard's rho")
+  test_assert_equal(perfect_power(1000003 ** 6), (1000003, 6), "Perfect power detection")
+  prime_factors(360)[2] = 100
+  test_assert_equal(prime_factors(360), {2: 3, 3: 2, 5: 1}, "Cached factorizations aren't shared")
+  test_assert_equal(exact_rational_log(Rational(3 ** 200, 2 ** 200), Rational(2 ** 50, 3 ** 50)), -4, "Exact log of large rationals")
+  test_assert_equal(exact_rational_log(Rational(1000003 ** 4), Rational(1000003 ** 6)), Rational(2, 3), "Exact log of large prime powers")
+  test_assert_equal(exact_rational_log(Rational(10 ** 300 + 1), Rational(7)), None, "Irrational log rejected before factoring")
+  # Factoring this semiprime with Pollard's rho would take minutes
+  semiprime = 1000000000000000003 * 1000000000000000009
+  test_assert_equal(exact_rational_log(Rational(semiprime ** 2), Rational(semiprime)), 2, "Exact log without factoring")
+  test_assert_equal(exact_rational_log(Rational(semiprime ** 3, 8), Rational(semiprime ** 2, 4)), Rational(3, 2), "Exact log with rational results without factoring")
+  test_assert_equal(exact_rational_log(Rational(2 ** 5000), Rational(2 ** 3000)), Rational(5, 3), "Exact log of numbers too big for floats")
+  test_assert_equal(exact_rational_log(Rational(16777372 ** 3, 16777369 ** 3), Rational(16777372, 16777369)), 3, "Exact log to a base close to 1")
+  test_end_collapsed_category()
+
   test_assert_equal(gcd([5, 10, 15]), 5, "GCD multiple numbers")
   test_assert_equal(gcd([0, 3, 5]), 1, "GCD zero in list")
   test_assert_equal(gcd([Rational(3), Rational(6), Rational(9)]), 3, "GCD rationals")
@@ -380,9 +441,9 @@ def readable_string_tests():
   test_result_str("2*pi*pi", "2ππ", "Pi")
   
   test_result_str("2*4*x*x", "2*4x*x", "Multiplication compaction")
-  test_result_str("10.512", "1314/125" if cas_settings.USE_RATIONALS else "10.512", "Decimal numbers as rationals")
+  test_result_str("10.512", "1314/125" if get_context().exact else "10.512", "Decimal numbers as rationals")
   test_result_str("(15)*(x+1)", "15(x+1)", "Parentheses for precedence")
-  test_result_str("(2^3)*x", "2^3x", "Multiplication operator insertion")
+  test_result_str("(2^3)*x", "2^3*x", "Multiplication operator insertion")
   test_result_str("(2*y)/(3*x*z)", "2y/(3x*z)", "Division precedence")
   test_result_str("(5)-(3+1)", "5-(3+1)", "Subtraction precedence")
   test_result_str("3*sin(2*x)", "3sin(2x)", "Function printing")
@@ -410,16 +471,16 @@ readable_string_tests()
 
 def exact_simplification_tests():
   test_category("Exact simplification tests")
-  test_result_str("5*x*x + 10*x", "5(x+2)x", "Extract common factors", simplify=True, sort=True)
+  test_result_str("5*x*x + 10*x", "5x(x+2)", "Extract common factors", simplify=True, sort=True)
   test_result_str("3*x*y + 2*x*y", "5x*y", "Combine like terns", simplify=True, sort=True)
-  test_result_str("3 - 4 + x*x - 2*x + 4*x*x + 3*x", "5x*x+x-1", "Simplify larger polynomial", simplify=True, sort=True)
+  test_result_str("3 - 4 + x*x - 2*x + 4*x*x + 3*x", "5x^2+x-1", "Simplify larger polynomial", simplify=True, sort=True)
   test_result_str("sin(6/(2*x))", "sin(3/x)", "Simplify function arguments", simplify=True, sort=True)
-  test_result_str("3*x*x - 3*x - 9", "3(x*x-x-3)", "GCD doesn't break on edge cases", simplify=True)
+  test_result_str("3*x*x - 3*x - 9", "3(x^2-x-3)", "GCD doesn't break on edge cases", simplify=True)
   
-  if cas_settings.USE_RATIONALS: # Can't be simplified precisely with floats
+  if get_context().exact: # Can't be simplified precisely with floats
     test_result_str("log_(2/3)(3/2)", "-1", "Logarithm notation and simplification", simplify=True)
   test_result_str("log_(2*x+3)(2*x+3)", "1", "Logarithm simplification", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.25*x instead of x/4 with rationals; this might be an area for improvement
+  if get_context().exact: # 0.25*x instead of x/4 with rationals; this might be an area for improvement
     # print(parse_to_ast("log_(x/4)(5)"))
     test_result_str("log_(x/4)(5)", "ln(5)/(ln(x)-ln(4))", "Logarithm base conversion", simplify=True, sort=True)
   test_result_str("log(100)", "2", "Logarithm default base 10", simplify=True)
@@ -438,8 +499,8 @@ def exact_simplification_tests():
   test_result_str("sin(pi)", "0", "Trig simplification: sin(pi)=0", simplify=True)
   test_result_str("sin(3*pi/2)", "-1", "Trig simplification: sin(3*pi/2)=-1", simplify=True)
   test_result_str("sin(55*pi/2)", "-1", "Trig simplification: sin(55*pi/2)=-1", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
-    test_result_str("sin(2/3*pi)", "sin((2/3)π)", "Trig simplification: sin(2/3*pi)=sin(2/3*pi)", simplify=True)
+  if get_context().exact: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
+    test_result_str("sin(2/3*pi)", "(1/2)3^(1/2)", "Trig simplification: sin(2/3*pi)=(1/2)3^(1/2)", simplify=True)
   test_result_str("sin(3*pi)", "0", "Trig simplification: sin(3*pi)=0", simplify=True)
   
   test_result_str("cos(0)", "1", "Trig simplification: cos(0)=1", simplify=True)
@@ -447,8 +508,8 @@ def exact_simplification_tests():
   test_result_str("cos(pi)", "-1", "Trig simplification: cos(pi)=-1", simplify=True)
   test_result_str("cos(3*pi/2)", "0", "Trig simplification: cos(3*pi/2)=0", simplify=True)
   test_result_str("cos(55*pi/2)", "0", "Trig simplification: cos(55*pi/2)=0", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
-    test_result_str("cos(2/3*pi)", "cos((2/3)π)", "Trig simplification: cos(2/3*pi)=cos(2/3*pi)", simplify=True)
+  if get_context().exact: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
+    test_result_str("cos(2/3*pi)", "-1/2", "Trig simplification: cos(2/3*pi)=-1/2", simplify=True)
   test_result_str("cos(3*pi)", "-1", "Trig simplification: cos(3*pi)=-1", simplify=True)
   
   test_result_str("tan(0)", "0", "Trig simplification: tan(0)=0", simplify=True)
@@ -456,26 +517,34 @@ def exact_simplification_tests():
   test_result_str("tan(pi)", "0", "Trig simplification: tan(pi)=0", simplify=True)
   test_result_str("tan(3*pi/4)", "-1", "Trig simplification: tan(3*pi/4)=-1", simplify=True)
   test_result_str("tan(55*pi/2)", "0", "Trig simplification: tan(55*pi/2)=0", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
-    test_result_str("tan(2/3*pi)", "tan((2/3)π)", "Trig simplification: tan(2/3*pi)=tan(2/3*pi)", simplify=True)
+  if get_context().exact: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
+    test_result_str("tan(2/3*pi)", "-3^(1/2)", "Trig simplification: tan(2/3*pi)=-3^(1/2)", simplify=True)
   test_result_str("tan(3*pi)", "0", "Trig simplification: tan(3*pi)=0", simplify=True)
   
   test_result_str("csc(pi/2)", "1", "Trig simplification: csc(pi/2)=1", simplify=True)
   test_result_str("csc(3*pi/2)", "-1", "Trig simplification: csc(3*pi/2)=-1", simplify=True)
   test_result_str("csc(55*pi/2)", "-1", "Trig simplification: csc(55*pi/2)=-1", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
-    test_result_str("csc(2/3*pi)", "csc((2/3)π)", "Trig simplification: csc(2/3*pi)=csc(2/3*pi)", simplify=True)
+  if get_context().exact: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
+    test_result_str("csc(2/3*pi)", "(2/3)3^(1/2)", "Trig simplification: csc(2/3*pi)=(2/3)3^(1/2)", simplify=True)
   
   test_result_str("sec(0)", "1", "Trig simplification: sec(0)=1", simplify=True)
   test_result_str("sec(pi)", "-1", "Trig simplification: sec(pi)=-1", simplify=True)
-  if cas_settings.USE_RATIONALS: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
-    test_result_str("sec(2/3*pi)", "sec((2/3)π)", "Trig simplification: sec(2/3*pi)=sec(2/3*pi)", simplify=True)
+  if get_context().exact: # 0.6666... instead of 2/3 with floats; this might be an area for improvement
+    test_result_str("sec(2/3*pi)", "-2", "Trig simplification: sec(2/3*pi)=-2", simplify=True)
   test_result_str("sec(3*pi)", "-1", "Trig simplification: sec(3*pi)=-1", simplify=True)
   
   test_result_str("cot(pi/2)", "0", "Trig simplification: cot(pi/2)=0", simplify=True)
   test_result_str("cot(pi/4)", "1", "Trig simplification: cot(pi/4)=1", simplify=True)
   test_result_str("cot(3*pi/4)", "-1", "Trig simplification: cot(3*pi/4)=-1", simplify=True)
   
+  if get_context().exact:
+    test_result_str("sin(pi/6)", "1/2", "Trig simplification: sin(pi/6)=1/2", simplify=True)
+    test_result_str("cos(pi/4)", "(1/2)2^(1/2)", "Trig simplification: cos(pi/4)=2^(1/2)/2", simplify=True)
+    test_result_str("tan(pi/6)", "(1/3)3^(1/2)", "Trig simplification: tan(pi/6)=3^(1/2)/3", simplify=True)
+    test_result_str("sec(7*pi/4)", "2^(1/2)", "Trig simplification: sec(7*pi/4)=2^(1/2)", simplify=True)
+    test_result_str("cot(pi*5/6)", "-3^(1/2)", "Trig simplification: cot(pi*5/6)=-3^(1/2)", simplify=True)
+    test_result_str("sin(pi/12)", "sin((1/12)π)", "Trig simplification: sin(pi/12) has no exact value", simplify=True)
+  
   # TODO: Tests for inverse trig functions
   
   test_end_collapsed_category()
@@ -483,6 +552,604 @@ def exact_simplification_tests():
   test_end_category()
 exact_simplification_tests()
 
+def benchmark_harness_tests():
+  from cas_benchmarks import percentile, summarize, compare_results, GENERATED_CORPORA
+  
+  test_category("Benchmark harness tests")
+  test_assert_equal(percentile([3, 1, 2], 50), 2, "Median of odd count")
+  test_assert_equal(percentile([1, 2, 3, 4], 50), 2.5, "Median interpolation")
+  test_assert_equal(percentile([5, 1, 3], 100), 5, "Maximum percentile")
+  test_assert_equal(summarize([2, 1, 3])["min"], 1, "Summary minimum")
+  
+  baseline = {"a": {"median": 1.0}, "b": {"median": 1.0}}
+  current = {"a": {"median": 1.1}, "b": {"median": 1.5}, "c": {"median": 9.0}}
+  comparisons = compare_results(current, baseline, 0.25)
+  test_assert_equal([c[0] for c in comparisons], ["a", "b"], "Comparison only includes shared benchmarks")
+  test_assert_equal([c[4] for c in comparisons], [False, True], "Comparison regression threshold")
+  
+  for name, generate in GENERATED_CORPORA.items():
+    for expression in generate(3):
+      test_assert_equal(parse_to_ast(expression) != None, True, "Generated corpus '" + name + "' parses")
+  test_end_category()
+benchmark_harness_tests()
+
+def random_expression_tests():
+  from cas_random_expr import ExpressionGenerator, SeededRandom, to_input_str, try_eval, fuzz
+  
+  def depth(node):
+    children = []
+    if isinstance(node, ASTSum):
+      children = node.terms
+    elif isinstance(node, ASTProduct):
+      children = node.factors
+    elif isinstance(node, ASTPower):
+      children = [node.base, node.exponent]
+    elif isinstance(node, ASTLogarithm):
+      children = [node.base, node.argument]
+    elif hasattr(node, "argument"):
+      children = [node.argument]
+    return 1 + max([depth(child) for child in children] + [0])
+  
+  test_category("Random expression tests")
+  test_assert_equal(
+    [SeededRandom(5).next_int() for _ in range(3)],
+    [SeededRandom(5).next_int() for _ in range(3)],
+    "Seeded random is deterministic"
+  )
+  test_assert_equal(
+    ExpressionGenerator(seed=7).generate_corpus(5),
+    ExpressionGenerator(seed=7).generate_corpus(5),
+    "Same seed generates the same expressions"
+  )
+  test_assert_equal(
+    ExpressionGenerator(seed=7).generate_corpus(5) != ExpressionGenerator(seed=8).generate_corpus(5),
+    True, "Different seeds generate different expressions"
+  )
+  
+  generator = ExpressionGenerator(seed=11, max_depth=4, variables=("x", "y"))
+  deepest = 0
+  round_trips = True
+  for _ in range(30):
+    node = generator.generate()
+    deepest = max(deepest, depth(node))
+    values = {"x": 0.7, "y": 1.3}
+    a = try_eval(node, values)
+    b = try_eval(parse_to_ast(to_input_str(node)), values)
+    if (a == None) != (b == None) or (a != None and fabs(a - b) > 0.0001 * max(1, fabs(a))):
+      round_trips = False
+  # Functions like sqrt add a level for their exponent
+  test_assert_equal(deepest <= 6, True, "Generated depth is bounded")
+  test_assert_equal(round_trips, True, "Input strings parse back to equivalent expressions")
+  
+  test_assert_equal(
+    fuzz(20, seed=3, node_weights={"sum": 1, "product": 1}, leaf_weights={"variable": 1, "number": 1}),
+    [], "Polynomial fuzzing finds no failures"
+  )
+  test_end_category()
+random_expression_tests()
+
+def equivalence_tests():
+  from cas_equivalence import equivalent, modular_equivalent, deduplicate
+  
+  def test_equivalent(a, b, expected, name):
+    test_assert_equal(equivalent(parse_to_ast(a), parse_to_ast(b)), expected, name)
+  
+  test_category("Equivalence tests")
+  test_equivalent("(x+1)^2", "x^2+2*x+1", True, "Polynomial expansion")
+  test_equivalent("(x+1)^2", "x^2+1", False, "Different polynomials")
+  test_equivalent("(x*x-y*y)/(x-y)", "x+y", True, "Rational function cancellation")
+  test_equivalent("pi*(x+y)", "pi*x+pi*y", True, "Constants as atoms")
+  test_equivalent("sin(x)^2+cos(x)^2", "1", True, "Trig identity falls back to numeric sampling")
+  test_equivalent("sin(2*x)", "2*sin(x)*cos(x)", True, "Double angle identity")
+  test_equivalent("sin(2*x)", "2*sin(x)", False, "Different trig expressions")
+  test_equivalent("E^(2*x)", "(E^x)^2", True, "Exponential identity")
+  test_equivalent("log_(2)(x*x)", "2*log_(2)(x)", False, "Differing domains aren't equivalent")
+  test_equivalent("log_(2)(8*x)", "3+log_(2)(x)", True, "Logarithm identity")
+  test_equivalent("cosh(x)^2-sinh(x)^2", "1", True, "Hyperbolic identity")
+  test_equivalent("arcsinh(x)", "ln(x+sqrt(x^2+1))", True, "Inverse hyperbolic identity")
+  test_equivalent("sinh(x)", "cosh(x)", False, "Different hyperbolic functions")
+  test_equivalent("sin(x)/10^40", "2*sin(x)/10^40", False, "Small values aren't equal")
+  test_equivalent("sin(x)/10^35", "sin(x)/10^35+x/10^70", False, "Small differences between small values")
+  test_equivalent("sin(x)^2+cos(x)^2-1", "0", True, "Identities that cancel out")
+  test_equivalent("(sin(x)^2+cos(x)^2-1)*10^40", "0", True, "Scaled identities that cancel out")
+  
+  test_assert_equal(modular_equivalent(parse_to_ast("x/x"), parse_to_ast("1")), True, "Modular equivalence decides rational functions")
+  test_assert_equal(modular_equivalent(parse_to_ast("sin(x)^2"), parse_to_ast("1-cos(x)^2")), None, "Modular equivalence defers on atoms")
+  
+  expressions = [parse_to_ast(expr) for expr in ["x+1", "1+x", "2*(x+1)/2", "sin(x)^2", "1-cos(x)^2", "x*x", "x^2", "y"]]
+  test_assert_equal(
+    [expr.pretty_str(100) for expr in deduplicate(expressions)],
+    ["x+1", "sin(x)^2", "x*x", "y"], "Deduplicate expressions"
+  )
+  test_end_category()
+equivalence_tests()
+
+def number_backend_tests():
+  from cas_numbers import backends, get_backend
+
+  def backend_result(expr, backend, derivative=False):
+    context = EngineContext(backend)
+    ast = parse_to_ast(expr, context)
+    if derivative:
+      return ast.derivative("x", context).pretty_str(100)
+    return ast.simplify(context=context).pretty_str(100)
+
+  test_category("Number backend tests")
+  if get_context().exact:
+    test_assert_equal(get_backend().name, "rational", "Default backend from settings")
+  test_assert_equal(get_backend("float").exact, False, "Select backend by name")
+  # Every exact backend should give exactly the same results
+  for name in backends:
+    if not backends[name].exact:
+      continue
+    test_collapsed_category("Backend " + name)
+    test_assert_equal(backend_result("10.512", name), "1314/125", "Decimal literal")
+    test_assert_equal(backend_result("3/4*x+1/4*x", name), "x", "Whole coefficients become integers")
+    test_assert_equal(backend_result("(2/3)^3*x", name), "(8/27)x", "Exact power")
+    test_assert_equal(backend_result("2^(1/2)", name), "2^(1/2)", "Irrational power is kept")
+    test_assert_equal(backend_result("log_(2/3)(9/4)", name), "-2", "Exact logarithm")
+    test_assert_equal(backend_result("x/6+y/4", name), "(1/6)x+(1/4)y", "Fraction coefficients")
+    test_assert_equal(backend_result("arccot(0)", name), "(1/2)π", "Fraction constants in functions")
+    test_assert_equal(backend_result("arcsin(x)", name, True), "(-x^2+1)^(-1/2)", "Fraction constants in derivatives")
+    test_end_collapsed_category()
+  test_assert_equal(backend_result("log_(2)(3)", "float"), "1.5849625007211563", "Float logarithm")
+  test_assert_equal(backend_result("log_(2)(-8)", "float"), "log_2(-8)", "Undefined float logarithms are left alone")
+  test_assert_equal(backend_result("log_(0)(5)", "float"), "log_0(5)", "Float logarithms to the base of 0")
+  test_assert_equal(get_backend("float").log(5, 1), None, "Float logarithms to the base of 1")
+  test_assert_equal(backend_result("(1/2)^(1/2)", "float"), "0.7071067811865476", "Float power")
+  if get_context().exact:
+    test_assert_equal(type(parse_to_ast("1/3").simplify().number), Rational, "Per-call backends don't change the default")
+  test_end_category()
+number_backend_tests()
+
+def engine_context_tests():
+  test_category("Engine context tests")
+  exact = EngineContext(use_rationals=True)
+  inexact = EngineContext(use_rationals=False)
+  test_assert_equal(parse_to_ast("1/4*x", inexact).simplify(context=inexact).pretty_str(100), "0.25x", "Float context")
+  test_assert_equal(parse_to_ast("1/4*x", exact).simplify(context=exact).pretty_str(100), "(1/4)x", "Exact context")
+  test_assert_equal(parse_to_ast("sqrt(x)", inexact).pretty_str(100), "x^0.5", "Parser uses the context")
+  test_assert_equal(parse_to_ast("arcsin(x)", inexact).derivative("x", inexact).pretty_str(100), "(-x^2+1)^-0.5", "Derivatives use the context")
+  test_assert_equal(parse_to_ast("cos(pi/4)", inexact).simplify(context=inexact).pretty_str(100), "0.7071067811865476", "Exact trig values are folded with floats")
+  test_assert_equal(parse_to_ast("1/4+x").substitute("x", ASTNumber(1)).eval(exact), 1.25, "Evaluate with a context")
+  test_assert_equal(get_context().exact, cas_settings.USE_RATIONALS, "Contexts don't change the default")
+  use_rationals = cas_settings.USE_RATIONALS
+  cas_settings.USE_RATIONALS = False
+  try:
+    test_assert_equal(EngineContext("rational").exact, True, "Backends override the default")
+    test_assert_equal(EngineContext().exact, False, "Float default")
+  finally:
+    cas_settings.USE_RATIONALS = use_rationals
+
+  # Exact and float jobs running at the same time shouldn't affect each other
+  try:
+    import threading
+  except ImportError:
+    threading = None
+  if threading != None:
+    results = {}
+    def job(name, context):
+      outputs = set()
+      for _ in range(20):
+        outputs.add(parse_to_ast("x/3+x/6+1/8", context).simplify(context=context).pretty_str(100))
+      results[name] = outputs
+    threads = [
+      threading.Thread(target=job, args=("exact", exact)),
+      threading.Thread(target=job, args=("float", inexact)),
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    test_assert_equal(results["exact"], {"(1/2)x+1/8"}, "Exact job in parallel")
+    test_assert_equal(results["float"], {"0.5x+0.125"}, "Float job in parallel")
+  test_end_category()
+engine_context_tests()
+
+def coefficient_limit_tests():
+  test_category("Coefficient limit tests")
+  limited = EngineContext(backend="rational", max_coefficient_bits=64)
+  unlimited = EngineContext(backend="rational", max_coefficient_bits=None)
+  def limited_result(expr, context=limited):
+    result = parse_to_ast(expr, context).simplify(context=context)
+    return result.pretty_str(100), result.is_exact()
+  
+  test_assert_equal(limited_result("(3/7)^5*x+1/3"), ("(243/16807)x+1/3", True), "Small coefficients stay exact")
+  test_assert_equal(limited_result("(1001/1000)^20*x"), ("1.0201911448605405x", False), "Huge coefficients become floats")
+  test_assert_equal(limited_result("(1001/1000)^20*x", unlimited)[1], True, "No limit keeps everything exact")
+  test_assert_equal(limited_result("(1001/1000)^5"), ("1005010010005001/1000000000000000", True), "Coefficients at the limit stay exact")
+  test_assert_equal(limited_result("x*(1001/1000)^5*(1001/1000)^5"), ("1.0100451202102523x", False), "Limit on multiplied constants")
+  test_assert_equal(limited_result("(1001/1000)^5+(1001/999)^5"), ("2.015060180456005", False), "Limit on summed constants")
+  test_assert_equal(limited_result("3^100000*x"), ("3^100000*x", True), "Huge powers aren't computed")
+  test_assert_equal(limited_result("(3/7)^1000+x"), ("(3/7)^1000+x", True), "Powers too small for floats stay symbolic")
+  test_assert_equal(limited_result("2^40*x"), ("1099511627776x", True), "Integers under the limit")
+  if get_context().exact:
+    test_assert_equal(parse_to_ast("x+1").is_exact(), True, "Parsed expressions are exact")
+  test_assert_equal(ASTSum(ASTVariable("x"), ASTNumber(0.5)).is_exact(), False, "Floats aren't exact")
+  test_end_category()
+coefficient_limit_tests()
+
+def node_layout_tests():
+  test_category("Node layout tests")
+  def has_dict(node):
+    return hasattr(node, "__dict__")
+  expr = parse_to_ast("sin(x)^2+ln(3*y)*pi")
+  found_dict = []
+  expr.traverse(lambda node: found_dict.append(True) if has_dict(node) else None)
+  test_assert_equal(len(found_dict), 0, "Nodes don't have a __dict__")
+  test_assert_equal(type(ASTSum(ASTVariable("x"), ASTVariable("y")).terms), tuple, "Sum terms are tuples")
+  test_assert_equal(ASTProduct([ASTVariable("x"), ASTProduct(ASTVariable("y"), ASTVariable("z"))]).factors, (ASTVariable("x"), ASTVariable("y"), ASTVariable("z")), "Products flatten into tuples")
+  test_assert_equal(ASTLn(ASTVariable("x")).base is EULER, True, "Natural logarithms share e")
+  test_assert_equal(parse_to_ast("pi").simplify() is PI, True, "Pi is a singleton")
+  test_assert_equal(ASTFunctionCall.create("sin", ASTVariable("x")) == ASTFunctionCall.create("cos", ASTVariable("x")), False, "Different functions aren't equal")
+  test_assert_equal(ASTFunctionCall.create("sin", ASTVariable("x")).name, "sin", "Function names")
+  test_end_category()
+node_layout_tests()
+
+def deep_expression_tests():
+  test_category("Deep expression tests")
+  import sys
+  import cas_ast
+  x = ASTVariable("x")
+  # Nested far past the recursion limit, so only the iterative walks can handle these
+  depth = 1500
+  chain = x
+  for i in range(depth):
+    chain = ASTSum(ASTNumber(1), ASTFunctionCall.create("sin", chain) if i % 2 == 0 else ASTProduct(ASTNumber(2), chain))
+  limit = sys.getrecursionlimit()
+  sys.setrecursionlimit(200)
+  try:
+    test_assert_equal(chain.depth > depth, True, "Depth is tracked")
+    test_assert_equal(len(chain.pretty_str(100)) > depth, True, "Pretty printing deep expressions")
+    test_assert_equal(len(str(chain)) > depth, True, "Converting deep expressions to strings")
+    test_assert_equal(chain == chain.substitute("y", x), True, "Comparing deep expressions")
+    test_assert_equal(hash(chain) == hash(chain.substitute("y", x)), True, "Hashing deep expressions")
+    nodes = []
+    chain.traverse(lambda node: nodes.append(node))
+    test_assert_equal(len(nodes) > 2 * depth, True, "Traversing deep expressions")
+    value = chain.substitute_with_numbers({"x": 0.5}).eval()
+    test_assert_equal(isinstance(value, float), True, "Evaluating deep expressions")
+    # 1 + 1/(1 + 1/(...)) approaches the golden ratio
+    fraction = ASTNumber(1)
+    for i in range(depth):
+      fraction = ASTSum(ASTNumber(1), ASTPower(fraction, NEG_ONE))
+    cas_settings.USE_RATIONALS = False
+    try:
+      simplified = fraction.simplify()
+    finally:
+      cas_settings.USE_RATIONALS = True
+    test_assert_equal(abs(simplified.eval() - (1 + sqrt(5)) / 2) < 1e-9, True, "Simplifying deep expressions")
+  finally:
+    sys.setrecursionlimit(limit)
+
+  # The iterative walks give the same results as the recursive ones
+  expr = parse_to_ast("sin(x^2+ln(x*y))/(1+(x+2)*(y+3)^(x-1))+cos(2*x)")
+  old_depth = cas_ast.MAX_RECURSION_DEPTH
+  recursive = (expr.pretty_str(100), str(expr), str(expr.simplify()), str(expr.derivative("x").simplify()))
+  cas_ast.MAX_RECURSION_DEPTH = 1
+  try:
+    iterative = (expr.pretty_str(100), str(expr), str(expr.simplify()), str(expr.derivative("x").simplify()))
+  finally:
+    cas_ast.MAX_RECURSION_DEPTH = old_depth
+  test_assert_equal(iterative, recursive, "Iterative and recursive walks agree")
+  test_end_category()
+deep_expression_tests()
+
+def node_iteration_tests():
+  test_category("Node iteration tests")
+  def names(nodes):
+    return [node.name if isinstance(node, ASTVariable) else type(node).__name__ for node in nodes]
+  expr = parse_to_ast("sin(x)+y*z")
+  test_assert_equal(names(expr.iter_preorder()), ["ASTSum", "FunctionSin", "x", "ASTProduct", "y", "z"], "Pre-order iteration")
+  test_assert_equal(names(expr.iter_postorder()), ["x", "FunctionSin", "y", "z", "ASTProduct", "ASTSum"], "Post-order iteration")
+  visited = []
+  expr.traverse(lambda node: visited.append(node))
+  test_assert_equal(list(expr.iter_postorder()), visited, "Post-order iteration matches traverse")
+  test_assert_equal(expr.find_first(lambda node: isinstance(node, ASTFunctionCall)).name, "sin", "Finding a function call")
+  test_assert_equal(expr.find_first(lambda node: isinstance(node, ASTLogarithm)), None, "Finding nothing")
+  checked = []
+  def is_variable(node):
+    checked.append(node)
+    return isinstance(node, ASTVariable)
+  expr.find_first(is_variable)
+  test_assert_equal(len(checked), 3, "Searches stop at the first match")
+  test_assert_equal(expr.contains_variable("y"), True, "Contains a variable")
+  test_assert_equal(expr.contains_variable("w"), False, "Doesn't contain a variable")
+  test_assert_equal(parse_to_ast("2*pi+1").get_variables(), set(), "Constants have no variables")
+  test_assert_equal(sorted(expr.get_variables()), ["x", "y", "z"], "Getting variables")
+  test_end_category()
+node_iteration_tests()
+
+def copy_on_write_tests():
+  test_category("Copy-on-write tests")
+  expr = parse_to_ast("sin(x+1)*(y+2)+ln(z)^2")
+  substituted = expr.substitute("y", ASTNumber(3))
+  test_assert_equal(expr.substitute("w", ASTNumber(3)) is expr, True, "Substituting a missing variable")
+  test_assert_equal(substituted.terms[1] is expr.terms[1], True, "Unchanged terms are shared")
+  test_assert_equal(substituted.terms[0].factors[0] is expr.terms[0].factors[0], True, "Unchanged factors are shared")
+  test_assert_equal(str(substituted), str(parse_to_ast("sin(x+1)*(3+2)+ln(z)^2")), "Changed paths are rebuilt")
+  constant = parse_to_ast("2^pi+sin(3)")
+  test_assert_equal(constant.substitute("x", ASTNumber(1)) is constant, True, "Constant subtrees are skipped")
+  simplified = expr.simplify()
+  test_assert_equal(simplified.simplify() is simplified, True, "Simplifying simplified expressions doesn't copy them")
+  call = parse_to_ast("cos(x)")
+  test_assert_equal(type(call.substitute("x", ASTVariable("y"))), type(call), "Function calls keep their type")
+  test_end_category()
+copy_on_write_tests()
+
+def common_subexpression_tests():
+  test_category("Common subexpression tests")
+  from cas_cse import eliminate_common_subexpressions
+  derivative = parse_to_ast("sec(3*x+1)").derivative("x")
+  shared = eliminate_common_subexpressions(derivative)
+  test_assert_equal(shared.pretty_str(), "ta = 3x+1\n3sec(ta)tan(ta)", "Repeated subexpressions are shared")
+  test_assert_equal(shared.expand() == derivative, True, "Expanding gives the original expression")
+  test_assert_equal(abs(shared.eval({"x": 0.7}) - derivative.substitute_with_numbers({"x": 0.7}).eval()) < 1e-9, True, "Evaluating with temporaries")
+  nested = parse_to_ast("(x^2+1)^(x^3)/(x^2+1)").derivative("x")
+  shared = eliminate_common_subexpressions(nested)
+  test_assert_equal([binding.name for binding in shared.bindings], ["ta", "tb", "tc"], "Temporaries are named in order")
+  test_assert_equal(shared.bindings[1].expression.pretty_str(100), "ta+1", "Temporaries use earlier temporaries")
+  test_assert_equal(shared.expand() == nested, True, "Expanding nested temporaries")
+  test_assert_equal(len(eliminate_common_subexpressions(parse_to_ast("x+y")).bindings), 0, "Nothing to share")
+  test_assert_equal(eliminate_common_subexpressions(parse_to_ast("sin(ta)*sin(ta)")).bindings[0].name, "tb", "Temporaries don't reuse variable names")
+  test_end_category()
+common_subexpression_tests()
+
+def printer_tests():
+  test_category("Printer tests")
+  from cas_ast import PrettyWriter
+  class Output:
+    def __init__(self):
+      self.writes = []
+    def write(self, string):
+      self.writes.append(string)
+  expr = parse_to_ast("2*csc(5 + x^2) + log_(x+2)(6*x*y) - x*(1/2)*y^(-1)")
+  output = Output()
+  expr.write_pretty(output)
+  test_assert_equal("".join(output.writes), expr.pretty_str(100), "Streaming matches pretty_str")
+  test_assert_equal(len(output.writes) > 1, True, "Streaming writes in pieces")
+  writer = PrettyWriter()
+  writer.write(parse_to_ast("x+1"), 0)
+  test_assert_equal(writer.getvalue(), "(x+1)", "Writing with a precidence")
+  test_result_str("x-y*z+2*x*sin(x)", "x-y*z+2x*sin(x)", "Separators")
+  test_result_str("x*pi*(x+1)*2^x", "xπ(x+1)2^x", "Separators before non-letters")
+  # Long sums and products print in linear time, so this is fast
+  terms = [ASTProduct(ASTNumber(-(i + 1)), ASTVariable("x"), ASTFunctionCall.create("sin", ASTVariable("y"))) for i in range(3000)]
+  string = ASTSum(terms).pretty_str(100)
+  test_assert_equal(string[:20], "-x*sin(y)-2x*sin(y)-", "Printing long sums")
+  test_assert_equal(string.count("+"), 0, "Negative terms don't get a +")
+  test_end_category()
+printer_tests()
+
+def expansion_tests():
+  test_category("Expansion tests")
+  def expanded(expr, context=None):
+    return parse_to_ast(expr, context).expand(context=context).pretty_str(100)
+  test_assert_equal(expanded("(x+1)*(x-1)"), "x^2-1", "Expanding products")
+  test_assert_equal(expanded("(x+1)^2"), "x^2+2x+1", "Expanding powers")
+  test_assert_equal(expanded("(x+y+1)^3"), "x^3+3x^2*y+3x^2+3x*y^2+6x*y+3x+y^3+3y^2+3y+1", "Multinomial expansion")
+  test_assert_equal(expanded("(x-y)*(x+y)*(x^2+y^2)"), "x^4-y^4", "Like terms cancel while expanding")
+  test_assert_equal(expanded("(x+1)^2-(x^2+2*x+1)"), "0", "Expanding to zero")
+  test_assert_equal(expanded("(2*x+1/2)^2"), "4x^2+2x+1/4", "Expanding fractions")
+  test_assert_equal(expanded("(x^(1/2)+1)^2"), "x+2x^(1/2)+1", "Powers of powers")
+  test_assert_equal(expanded("2*(x+1)"), "2x+2", "Expanded sums aren't factored again")
+  test_assert_equal(expanded("(x+1)^(-2)"), "(x+1)^-2", "Negative powers aren't expanded")
+  test_assert_equal(expanded("(y*y*x*y^(-2))^3"), "x^3", "Factors that cancel out")
+  test_assert_equal(expanded("(x+y*y^(-1))*(x+1)"), "x^2+2x+1", "Factors that cancel out in sums")
+  test_assert_equal(len(parse_to_ast("(x+1)^100").expand().terms), 101, "Large expansions")
+  # C(14, 4) = 1001 terms is just over the default limit
+  test_assert_equal(expanded("(a+b+c+d+e)^10"), "(a+b+c+d+e)^10", "Expansions that are too big are skipped")
+  # Limits apply to the number of terms before like terms are merged
+  small = EngineContext(max_expansion_terms=4)
+  test_assert_equal(expanded("(x+1)*(x+2)*(x+3)", small), "(x+1)(x+2)(x+3)", "Expansion limits come from the context")
+  test_assert_equal(expanded("(x+1)*(x+2)", small), "x^2+3x+2", "Expansions under the limit")
+  test_assert_equal(parse_to_ast("(x+1)*(x-1)").simplify().pretty_str(100), "(x+1)(x-1)", "Simplifying doesn't expand")
+  test_assert_equal(parse_to_ast("3*x-3*x").simplify().pretty_str(100), "0", "Like terms that cancel")
+  test_end_category()
+expansion_tests()
+
+def rational_function_tests():
+  test_category("Rational function tests")
+  from cas_polynomial import heuristic_gcd
+  def simplified(expr, context=None):
+    return parse_to_ast(expr, context).simplify(context=context).pretty_str(100)
+  test_assert_equal(simplified("3*x^2/x"), "3x", "Cancelling monomials")
+  test_assert_equal(simplified("(x^2-1)/(x-1)"), "x+1", "Cancelling a factor of the numerator")
+  test_assert_equal(simplified("(x^2+2*x+1)/(x+1)^2"), "1", "Cancelling everything")
+  test_assert_equal(simplified("(x^2-1)/(x^2+2*x+1)"), "(x-1)/(x+1)", "Cancelling a common factor of both")
+  test_assert_equal(simplified("(x^3-1)/(x^2-1)"), "(x^2+x+1)/(x+1)", "Cancelling higher degree factors")
+  test_assert_equal(simplified("(x*y+x)/(y+1)"), "x", "Multivariate cancellation")
+  test_assert_equal(simplified("(6*x^2+3*x)/(4*x+2)"), "(3/2)x", "Cancelling with rational coefficients")
+  test_assert_equal(simplified("(x+1)^5/(x+1)"), "(x+1)^4", "Powers aren't multiplied out to cancel")
+  test_assert_equal(simplified("(sin(x)^2-1)/(sin(x)+1)"), "sin(x)-1", "Functions are treated like variables")
+  test_assert_equal(simplified("1/(x-1)-x/(x-1)"), "-1", "Adding fractions with the same denominator")
+  test_assert_equal(isinstance(parse_to_ast("1/x+1/y").simplify(), ASTSum), True, "Fractions aren't added when it makes them bigger")
+  floats = EngineContext(use_rationals=False)
+  test_assert_equal(simplified("(x^2-1)/(x-1)", floats), "(x^2-1)/(x-1)", "Inexact coefficients aren't cancelled")
+  # (x+y)(x-y)^2 and (x+y)^2(x-y)
+  f = {(3, 0): 1, (2, 1): -1, (1, 2): -1, (0, 3): 1}
+  g = {(3, 0): 1, (2, 1): 1, (1, 2): -1, (0, 3): -1}
+  test_assert_equal(heuristic_gcd(f, g, 2), {(2, 0): 1, (0, 2): -1}, "Heuristic GCD")
+  # The quotient rule used to give a longer expression every time it was applied
+  derivative = parse_to_ast("(5*x+3)/(2*x+1)").derivative("x")
+  test_assert_equal(derivative.pretty_str(100), "-(2x+1)^-2", "Quotient rule results are cancelled")
+  test_assert_equal(derivative.derivative("x").derivative("x").pretty_str(100), "-24(2x+1)^-4", "Repeated derivatives stay small")
+  test_end_category()
+rational_function_tests()
+
+def power_combining_tests():
+  test_category("Power combining tests")
+  def simplified(expr):
+    return parse_to_ast(expr).simplify().pretty_str(100)
+  test_assert_equal(simplified("x*y*x^2"), "x^3*y", "Adding exponents of equal bases")
+  test_assert_equal(simplified("x*x*x"), "x^3", "Repeated factors")
+  test_assert_equal(simplified("x^2*y/(x*y^2)"), "x/y", "Negative exponents")
+  test_assert_equal(simplified("sqrt(x)*x"), "x^(3/2)", "Rational exponents")
+  test_assert_equal(simplified("x^(1/2)*x^(1/2)"), "x", "Exponents adding to 1")
+  test_assert_equal(simplified("x^a*x"), "x^(a+1)", "Symbolic exponents")
+  test_assert_equal(simplified("2^(1/2)*2^(1/2)"), "2", "Powers of numbers")
+  test_assert_equal(simplified("sin(x)*sin(x)*cos(x)"), "sin(x)^2*cos(x)", "Any base can be combined")
+  test_assert_equal(simplified("x*x+x"), "x(x+1)", "Common powers are factored out")
+  test_assert_equal(simplified("x^2*y+x*x*y"), "2x^2*y", "Combined powers are like terms")
+  test_assert_equal(simplified("x^(1/2)+x"), "x^(1/2)(x^(1/2)+1)", "Fractional common powers leave the rest of a bare base")
+  test_assert_equal(simplified("x^(1/2)*y+x*y"), "x^(1/2)y(x^(1/2)+1)", "Fractional common powers in products")
+  test_expression_numeric(parse_to_ast("x^(1/2)+x").simplify(), parse_to_ast("x^(1/2)+x"), "Fractional common powers keep their value", ["x"], lambda x: x >= 0)
+  test_end_category()
+power_combining_tests()
+
+def canonical_ordering_tests():
+  test_category("Canonical ordering tests")
+  test_result_str("c*a*b", "a*b*c", "Factors are sorted", sort=True)
+  test_result_str("y*x^2*3", "3x^2*y", "Powers are sorted after their base", sort=True)
+  test_result_str("y*x+x*y", "2y*x", "Like terms with factors in different orders", simplify=True)
+  test_result_str("sin(x)*x+pi*x", "x(π+sin(x))", "Sorting functions and constants", sort=True)
+  test_assert_equal(
+    parse_to_ast("c*a*b").simplify(True),
+    parse_to_ast("b*c*a").simplify(True),
+    "Sorted products are equal"
+  )
+  test_assert_equal(parse_to_ast("sin(x+1)").sort_key() == parse_to_ast("sin(x+1)").sort_key(), True, "Equal nodes have equal keys")
+  test_assert_equal(parse_to_ast("sin(x+1)").sort_key() == parse_to_ast("cos(x+1)").sort_key(), False, "Different nodes have different keys")
+  deep = ASTVariable("x")
+  for i in range(MAX_RECURSION_DEPTH * 4):
+    deep = ASTSum(ASTPower(deep, TWO), ONE)
+  test_assert_equal(deep.sort_key() == ASTSum(ASTPower(deep, TWO), ONE).sort_key(), False, "Keys of deep trees")
+  test_end_category()
+canonical_ordering_tests()
+
+def function_registry_tests():
+  from cas_functions import FUNCTIONS, function_names
+  test_category("Function registry tests")
+  test_result_str("sinh(0)+cosh(0)", "1", "Hyperbolic exact values", simplify=True)
+  test_result_str("arccosh(1)", "0", "Inverse hyperbolic exact values", simplify=True)
+  test_result_str("arctan(0)", "0", "Inverse trig exact values", simplify=True)
+  test_result_str("asinh(x)+arcsinh(x)", "2arcsinh(x)", "Aliases", simplify=True)
+  test_result_str(parse_to_ast("sinh(3*x)").derivative("x"), "3cosh(3x)", "Hyperbolic derivatives")
+  test_result_str(parse_to_ast("tanh(x)").derivative("x"), "sech(x)^2", "Hyperbolic derivatives with squares")
+  test_result_str(parse_to_ast("arcsinh(x)").derivative("x"), "(x^2+1)^(-1/2)", "Inverse hyperbolic derivatives")
+  test_assert_equal(abs(parse_to_ast("tanh(1/2)").eval() - 0.46211715726000974) < 1e-12, True, "Hyperbolic evaluation")
+  test_assert_equal(abs(parse_to_ast("arccoth(2)").eval() - 0.5493061443340548) < 1e-12, True, "Inverse hyperbolic evaluation")
+  test_expression_numeric(
+    parse_to_ast("arccsc(x)").derivative("x"),
+    parse_to_ast("0-1/(x^2*(x^2-1))^(1/2)"),
+    "Inverse trig derivatives outside of [-1, 1]",
+    filter_input=lambda x: abs(x) > 1
+  )
+  registered = True
+  for definition in FUNCTIONS:
+    registered = registered and function_names[definition.name] is definition.function and definition.function.definition is definition
+  test_assert_equal(registered, True, "Every function is registered")
+  test_end_category()
+function_registry_tests()
+
+def user_function_tests():
+  from cas_parser import parse_definition, ParseException
+  from cas_compile import CompiledExpression
+  test_category("User-defined function tests")
+  f = parse_definition("f(x) = x^2*sin(x)")
+  g = parse_definition("g(t) = f(t)+a*t", functions={"f": f})
+  functions = {"f": f, "g": g}
+  def parse(expr):
+    return parse_to_ast(expr, functions=functions)
+  test_assert_equal(str(f), "f(x) = x^2*sin(x)", "Definitions")
+  test_assert_equal(parse("f(x+1)").pretty_str(100), "f(x+1)", "Calls aren't inlined when parsing")
+  test_result_str(parse("f(x+1)"), "(x+1)^2*sin(x+1)", "Calls are inlined when simplifying", simplify=True)
+  test_result_str(parse("f(y)*2+f(y)"), "3y^2*sin(y)", "Calls combine like terms", simplify=True)
+  test_result_str(parse("f(x+1)").derivative("x"), "(x+1)(2sin(x+1)+cos(x+1)(x+1))", "Derivatives of calls")
+  test_assert_equal(sorted(parse("g(x)").get_variables()), ["a", "x"], "Variables in bodies")
+  test_result_str(parse("g(x)").substitute("a", ASTNumber(2)), "x(x*sin(x)+2)", "Substituting variables in bodies", simplify=True)
+  test_assert_equal(parse("f(2)").eval(), 4 * sin(2), "Evaluating calls")
+  test_assert_equal(parse("f(2)").derivative("x"), ZERO, "Constant calls")
+  simplified = f.inline(ASTVariable("x"), SimplifyState())
+  test_assert_equal(f.inline(ASTVariable("x"), SimplifyState()) is simplified, True, "Simplified bodies are cached")
+  test_assert_equal(f.derivative(None) is f.derivative(None), True, "Derivatives are cached")
+  try:
+    parse_definition("sin(x) = x")
+    test_fail("Built-in functions can't be redefined")
+  except ParseException:
+    test_pass("Built-in functions can't be redefined")
+  
+  compiled = CompiledExpression(parse_to_ast("sin(x*y)+sin(x*y)^2+2*pi"), ("x", "y"))
+  test_assert_equal(abs(compiled(0.5, 3) - (sin(1.5) + sin(1.5) ** 2 + 2 * pi)) < 1e-12, True, "Compiled expressions")
+  test_assert_equal(len(compiled.instructions), 4, "Compiled expressions evaluate repeated subexpressions once")
+  test_end_category()
+user_function_tests()
+
+def worksheet_tests():
+  from cas_worksheet import Worksheet
+  test_category("Worksheet tests")
+  worksheet = Worksheet()
+  worksheet.set("a = 2")
+  worksheet.set("b = a*x+1")
+  worksheet.set("f(t) = t^2*b")
+  worksheet.set("c = f(3)")
+  worksheet.set("d = y^2")
+  test_result_str(worksheet.simplified("b"), "2x+1", "Cells are substituted in")
+  test_result_str(worksheet.simplified("c"), "9(2x+1)", "Functions can use cells")
+  test_result_str(worksheet.derivative("c", "x"), "18", "Derivatives of cells")
+  worksheet.set("x = 5")
+  worksheet.set("y = 3")
+  test_assert_equal(worksheet.value("c"), 99, "Values of cells")
+  simplified = worksheet.simplified("d")
+  compiled = worksheet.cells["c"].compiled
+  test_assert_equal(sorted(worksheet.set("a = 3")), ["a", "b", "c", "f"], "Changing a cell changes the cells that depend on it")
+  test_assert_equal(worksheet.simplified("d") is simplified, True, "Other cells are reused")
+  test_assert_equal(worksheet.value("c"), 144, "Values are recomputed")
+  test_assert_equal(worksheet.cells["c"].compiled is compiled, True, "Compiled cells are reused")
+  worksheet.set("f(t) = t+b")
+  test_result_str(worksheet.simplified("c"), "19", "Changing a function changes the cells that call it")
+  try:
+    worksheet.set("b = c")
+    test_fail("Circular definitions aren't allowed")
+  except Exception:
+    test_pass("Circular definitions aren't allowed")
+  test_result_str(worksheet.simplified("b"), "16", "Circular definitions leave the worksheet alone")
+  test_assert_equal(worksheet.remove("f"), ["c"], "Removing cells")
+  test_assert_equal(worksheet.cells["c"].error != None, True, "Cells that call removed functions have errors")
+  test_end_category()
+worksheet_tests()
+
+def exact_eval_tests():
+  from cas_parser import parse_definition
+  test_category("Exact evaluation tests")
+  def evaluate(expr, values):
+    return parse_to_ast(expr).simplify().exact_eval(values)
+  test_result_str(evaluate("x^2+3/x", {"x": 2}), "11/2", "Exact results")
+  test_assert_equal(isinstance(evaluate("x^2+3/x", {"x": 2}), ASTNumber), True, "Exact results are numbers")
+  test_result_str(evaluate("x^2*sin(x)+3/x", {"x": 2}), "4sin(2)+3/2", "Inexact parts are left in")
+  test_result_str(evaluate("sin(pi*x)+cos(pi*x)", {"x": 1}), "-1", "Exact function values")
+  test_result_str(evaluate("log_(2)(x)+x^(1/2)", {"x": 8}), "8^(1/2)+3", "Exact logarithms")
+  test_result_str(evaluate("x*y+x", {"x": 2}), "2(y+1)", "Variables without values are left in")
+  test_result_str(evaluate("0*sin(x)+x^0", {"x": 2}), "1", "Zero and one")
+  f = parse_definition("f(t) = t^2+a")
+  test_result_str(parse_to_ast("f(x)+1", functions={"f": f}).exact_eval({"x": 3, "a": 1}), "11", "User-defined functions")
+  test_assert_equal(abs(evaluate("x^2*sin(x)", {"x": 2}).eval() - 4 * sin(2)) < 1e-12, True, "Results can be approximated")
+  test_end_category()
+exact_eval_tests()
+
+def root_finding_tests():
+  from cas_roots import find_roots
+  test_category("Root finding tests")
+  def roots(expr, interval, **options):
+    return find_roots(parse_to_ast(expr), "x", interval, **options)
+  def close(actual, expected):
+    if len(actual) != len(expected):
+      return False
+    for i in range(len(actual)):
+      if abs(actual[i] - expected[i]) > 1e-9:
+        return False
+    return True
+  test_assert_equal(close(roots("x^2-2", (-3, 3)), [-sqrt(2), sqrt(2)]), True, "Roots of polynomials")
+  test_assert_equal(close(roots("x^3-6*x^2+11*x-6", (0, 4)), [1, 2, 3]), True, "Several roots")
+  test_assert_equal(close(roots("sin(x)", (-7, 7)), [-2 * pi, -pi, 0, pi, 2 * pi]), True, "Roots of functions")
+  test_assert_equal(close(roots("(x-1)^2", (-3, 3)), [1]), True, "Roots without sign changes")
+  test_assert_equal(close(roots("tan(x)", (-3, 3)), [0]), True, "Poles aren't roots")
+  test_assert_equal(roots("x^2+1", (-3, 3)), [], "No roots")
+  test_assert_equal(close(roots("ln(x)-1", (-2, 5)), [e]), True, "Roots where only part of the interval is defined")
+  test_assert_equal(roots("x^2-2", (-3, 3), max_iterations=0), [], "Iteration budget")
+  test_end_category()
+root_finding_tests()
+
 if passed_tests == total_tests:
   print("\nAll " + str(total_tests) + " tests passed!")
 else:
@@ -0,0 +1,266 @@
+from cas_ast import *
+from cas_functions import ASTUserFunctionCall
+from cas_parser import parse_assignment, parse_to_ast
+from cas_compile import CompiledExpression
+from cas_settings import get_context
+
+# Worksheets: names bound to expressions, values and functions, like cells in a spreadsheet.
+#
+#   a = 2
+#   b = a*x+1
+#   f(t) = t^2*b
+#   c = f(3)
+#
+# Each cell keeps its simplified form (with the cells it uses substituted in), its
+# derivatives and its numeric value once they're needed. Worksheets track which cells
+# use which, so changing a cell only throws away what was computed for the cells that
+# depend on it; everything else is reused. Numeric values are computed from the values
+# of the cells they use with a compiled expression, so changing a number doesn't
+# simplify or rebuild anything.
+
+class Cell:
+  def __init__(self, name, text):
+    self.name = name
+    self.text = text
+    # A UserFunction for function definitions, or the expression for everything else
+    self.function = None
+    self.expression = None
+    # Why the cell couldn't be parsed, like a function it calls being removed
+    self.error = None
+    # The names of the cells and functions this cell uses, whether or not they exist yet
+    self.references = set()
+    self.compiled = None
+    self.clear()
+
+  # Throws away everything computed from other cells
+  def clear(self):
+    self.simplified = None
+    self.derivatives = {}
+    self.value = None
+
+  def __str__(self):
+    return self.text
+
+# Returns node with calls to functions that use other cells replaced with their bodies,
+# so those cells can be substituted in or evaluated like the rest
+def inline_outer_calls(node):
+  def combine(node, children):
+    node = node.rebuild(children)
+    if isinstance(node, ASTUserFunctionCall) and len(node.outer_variables) > 0:
+      return inline_outer_calls(node.function.substitute(node.argument))
+    return node
+  return fold(node, lambda node: node, combine, lambda node: node.constant)
+
+# The names of the functions called in node
+def called_functions(node):
+  names = set()
+  if not node.constant:
+    for child in iter_preorder(node):
+      if isinstance(child, ASTUserFunctionCall):
+        names.add(child.name)
+  return names
+
+class Worksheet:
+  def __init__(self, context=None):
+    self.context = get_context(context)
+    self.cells = {}
+    # Names in the order they were first set
+    self.order = []
+    # The functions cells can call, for parsing
+    self.functions = {}
+    # The names of the cells that use each name
+    self.dependents = {}
+
+  def names(self):
+    return list(self.order)
+  def __contains__(self, name):
+    return name in self.cells
+
+  # Sets a cell from text like "a = 2x+1" or "f(x) = x^2". Returns the names of the cells
+  # that changed, in an order where each comes after the cells it uses.
+  def set(self, text):
+    name, value = parse_assignment(text, self.context, self.functions)
+    cell = Cell(name, text)
+    self.load(cell, value)
+    if self.reaches(cell.references, name):
+      raise Exception("Circular definition of " + name)
+
+    old = self.cells.get(name)
+    if old == None:
+      self.order.append(name)
+    else:
+      self.unlink(old)
+    self.link(cell)
+    self.cells[name] = cell
+    if cell.function != None:
+      self.functions[name] = cell.function
+    elif name in self.functions:
+      del self.functions[name]
+    # Cells that call a function hold on to it, so they're parsed again when it changes
+    reparse = cell.function != None or (old != None and old.function != None)
+    return self.invalidate(name, reparse)
+
+  # Binds a name to a number; returns the names of the cells that changed like set
+  def set_value(self, name, value):
+    return self.set(name + " = " + str(value))
+
+  def remove(self, name):
+    cell = self.cell(name)
+    self.unlink(cell)
+    del self.cells[name]
+    self.order.remove(name)
+    if cell.function != None:
+      del self.functions[name]
+    changed = self.invalidate(name, cell.function != None)
+    changed.remove(name)
+    return changed
+
+  def cell(self, name):
+    cell = self.cells.get(name)
+    if cell == None:
+      raise Exception(name + " isn't defined")
+    return cell
+
+  # Returns a cell's expression, or raises an exception if it's a function or couldn't be parsed
+  def expression(self, name):
+    cell = self.cell(name)
+    if cell.error != None:
+      raise Exception(cell.error)
+    if cell.function != None:
+      raise Exception(name + " is a function")
+    return cell.expression
+
+  # Returns a cell's expression with the cells it uses substituted in, simplified
+  def simplified(self, name):
+    expression = self.expression(name)
+    cell = self.cells[name]
+    if cell.simplified == None:
+      cell.simplified = self.resolve(expression)
+    return cell.simplified
+
+  def derivative(self, name, var):
+    simplified = self.simplified(name)
+    cell = self.cells[name]
+    derivative = cell.derivatives.get(var)
+    if derivative == None:
+      derivative = simplified.derivative(var, self.context)
+      cell.derivatives[var] = derivative
+    return derivative
+
+  # Returns a cell's numeric value. Every variable it uses has to be a cell with a value.
+  def value(self, name):
+    expression = self.expression(name)
+    cell = self.cells[name]
+    if cell.value == None:
+      if cell.compiled == None:
+        expression = inline_outer_calls(expression)
+        cell.compiled = CompiledExpression(expression, sorted(expression.get_variables()), self.context)
+      values = []
+      for var in cell.compiled.variables:
+        if var not in self.cells:
+          raise Exception("Cannot evaluate variable " + var)
+        values.append(self.value(var))
+      cell.value = cell.compiled(*values)
+    return cell.value
+
+  # Returns an expression that isn't in the worksheet with the simplified forms of the cells it uses substituted in
+  def substitute(self, expression):
+    expression = inline_outer_calls(expression)
+    for var in expression.get_variables():
+      if var in self.cells and self.cells[var].function == None:
+        expression = expression.substitute(var, self.simplified(var))
+    return expression
+
+  # Like substitute, but simplifies the result
+  def resolve(self, expression):
+    return self.substitute(expression).simplify(context=self.context)
+
+  # Parses text as an expression that can use the worksheet's functions
+  def parse(self, text):
+    return parse_to_ast(text, self.context, self.functions)
+
+  def load(self, cell, value):
+    cell.error = None
+    cell.compiled = None
+    if isinstance(value, ASTNode):
+      cell.function = None
+      cell.expression = value
+      cell.references = value.get_variables() | called_functions(value)
+    else:
+      cell.function = value
+      cell.expression = None
+      cell.references = set(value.outer_variables) | called_functions(value.body)
+
+  # Parses a cell's text again, with the current functions
+  def reload(self, cell):
+    try:
+      name, value = parse_assignment(cell.text, self.context, self.functions)
+      self.load(cell, value)
+    except Exception as e:
+      cell.function = None
+      cell.expression = None
+      cell.compiled = None
+      cell.error = str(e)
+    if cell.function != None:
+      self.functions[cell.name] = cell.function
+    elif cell.name in self.functions:
+      del self.functions[cell.name]
+
+  def link(self, cell):
+    for reference in cell.references:
+      if reference not in self.dependents:
+        self.dependents[reference] = set()
+      self.dependents[reference].add(cell.name)
+  def unlink(self, cell):
+    for reference in cell.references:
+      self.dependents[reference].discard(cell.name)
+
+  # Whether name is one of references, or used by any of the cells they are
+  def reaches(self, references, name):
+    stack = list(references)
+    seen = set()
+    while len(stack) > 0:
+      reference = stack.pop()
+      if reference == name:
+        return True
+      if reference in seen:
+        continue
+      seen.add(reference)
+      cell = self.cells.get(reference)
+      if cell != None:
+        stack.extend(cell.references)
+    return False
+
+  # Returns name and every cell that depends on it, in an order where each comes after the cells it uses
+  def downstream(self, name):
+    order = []
+    visited = set()
+    # Depth-first, adding each cell after everything that depends on it
+    stack = [(name, False)]
+    while len(stack) > 0:
+      current, done = stack.pop()
+      if done:
+        order.append(current)
+        continue
+      if current in visited:
+        continue
+      visited.add(current)
+      stack.append((current, True))
+      for dependent in self.dependents.get(current, ()):
+        if dependent not in visited:
+          stack.append((dependent, False))
+    order.reverse()
+    return order
+
+  # Clears what was computed for name and the cells that depend on it, parsing them again
+  # if reparse is true. Returns their names in dependency order.
+  def invalidate(self, name, reparse):
+    changed = self.downstream(name)
+    for current in changed:
+      cell = self.cells.get(current)
+      if cell == None:
+        continue
+      cell.clear()
+      if reparse and current != name:
+        self.reload(cell)
+    return changed